@@ -6,6 +6,8 @@ import os
 from datetime import datetime
 from typing import Dict, List, Set
 
+from persistence import write_json_atomic
+
 
 class AchievementsManager:
     """Управляет достижениями пользователей"""
@@ -79,15 +81,19 @@ class AchievementsManager:
         },
     }
 
-    def __init__(self, achievements_file: str = "achievements.json"):
+    def __init__(self, achievements_file: str = "achievements.json", persistence=None):
         """
         Args:
             achievements_file: Путь к файлу со статистикой ачивок
+            persistence: PersistenceService для отложенного сохранения (без него - сразу на диск)
         """
         self.achievements_file = achievements_file
         # chat_id -> {user_id -> {achievement_id -> {'unlocked_at': timestamp}}}
         self.achievements: Dict[int, Dict[int, Dict[str, Dict]]] = {}
+        self.persistence = persistence
         self.load_achievements()
+        if persistence:
+            persistence.register(self.achievements_file, self._snapshot_data)
 
     def load_achievements(self):
         """Загрузить ачивки из файла"""
@@ -104,13 +110,18 @@ class AchievementsManager:
         else:
             self.achievements = {}
 
+    def _snapshot_data(self) -> Dict:
+        """Данные для записи в файл"""
+        return {str(chat_id): {str(user_id): user_ach for user_id, user_ach in chat.items()}
+                for chat_id, chat in self.achievements.items()}
+
     def save_achievements(self):
         """Сохранить ачивки в файл"""
+        if self.persistence:
+            self.persistence.mark_dirty(self.achievements_file)
+            return
         try:
-            data = {str(chat_id): {str(user_id): user_ach for user_id, user_ach in chat.items()}
-                   for chat_id, chat in self.achievements.items()}
-            with open(self.achievements_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            write_json_atomic(self.achievements_file, self._snapshot_data())
         except Exception as e:
             print(f"Error saving achievements: {e}")
 
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк GLMClient против локального заглушечного сервера
+
+Сравнивает прежнюю схему (новый httpx.AsyncClient, а значит новое
+TCP+TLS соединение на каждый запрос) с общим пулом keep-alive соединений.
+Сервер отвечает мгновенно, поэтому разница - это стоимость рукопожатий.
+
+Запуск: python bench_glm_client.py [--requests 300] [--no-tls]
+(для TLS нужен openssl в PATH - им генерируется самоподписанный сертификат)
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import ssl
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+from glm_client import GLMClient
+
+
+RESPONSE = json.dumps({
+    "choices": [{"message": {"role": "assistant", "content": "Чупапи на связи!"}}]
+}).encode("utf-8")
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Отвечает на любой POST готовым ответом GLM"""
+    protocol_version = "HTTP/1.1"  # keep-alive
+    disable_nagle_algorithm = True  # заголовки и тело уходят разными send - без этого +40 мс
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(RESPONSE)))
+        self.end_headers()
+        self.wfile.write(RESPONSE)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_certificate(tmp_dir: str) -> tuple:
+    """Самоподписанный сертификат для 127.0.0.1"""
+    cert = os.path.join(tmp_dir, "cert.pem")
+    key = os.path.join(tmp_dir, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-keyout", key, "-out", cert, "-subj", "/CN=127.0.0.1",
+         "-addext", "subjectAltName=IP:127.0.0.1"],
+        check=True, capture_output=True
+    )
+    return cert, key
+
+
+def start_server(cert: str = None, key: str = None) -> tuple:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    scheme = "http"
+    if cert:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        scheme = "https"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"{scheme}://127.0.0.1:{server.server_address[1]}/chat/completions"
+
+
+class PerRequestGLMClient(GLMClient):
+    """Прежнее поведение: новый клиент на каждый запрос"""
+
+    async def chat_completion(self, messages, max_tokens=2000, temperature=0.7, stream=False, timeout=None):
+        async with httpx.AsyncClient(timeout=60.0) as client:
+            response = await client.post(self.api_url, headers=self.headers, json={
+                "model": self.model, "messages": messages, "max_tokens": max_tokens,
+                "temperature": temperature, "stream": stream
+            })
+            response.raise_for_status()
+            return response.json()["choices"][0]["message"]["content"]
+
+
+async def run(client: GLMClient, count: int) -> list:
+    """Последовательные запросы, задержка каждого в миллисекундах"""
+    messages = [{"role": "user", "content": "привет"}]
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        content = await client.chat_completion(messages)
+        latencies.append((time.perf_counter() - start) * 1000)
+        assert content, "заглушка не ответила"
+    await client.aclose()
+    return latencies
+
+
+def report(title: str, latencies: list):
+    ordered = sorted(latencies)
+    p50 = ordered[len(ordered) // 2]
+    p99 = ordered[int(len(ordered) * 0.99) - 1]
+    print(f"{title}: {len(latencies)} запросов, среднее {statistics.mean(latencies):.2f} мс, "
+          f"p50 {p50:.2f} мс, p99 {p99:.2f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--no-tls", action="store_true", help="Без TLS (только TCP рукопожатие)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cert = key = None
+        if not args.no_tls:
+            if shutil.which("openssl") is None:
+                print("openssl не найден - запускаю без TLS")
+            else:
+                cert, key = make_certificate(tmp_dir)
+                # httpx доверяет сертификату из SSL_CERT_FILE
+                os.environ["SSL_CERT_FILE"] = cert
+
+        server, url = start_server(cert, key)
+        print(f"Заглушка GLM: {url}")
+        try:
+            report("До (клиент на каждый запрос)", asyncio.run(run(PerRequestGLMClient("key", url), args.requests)))
+            report("После (общий пул keep-alive)", asyncio.run(run(GLMClient("key", url), args.requests)))
+        finally:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк устойчивости GLMClient к сбоям провайдера на локальном фейковом сервере
+
+Сервер отвечает с базовой задержкой, иногда "подвисает" (медленный ответ) и
+иногда отвечает 503. Сравниваются прежний клиент (без повторов) и клиент с
+повторами, хеджированием и автоматом отключения: доля ответов и хвост
+задержки. Во втором сценарии провайдер лежит целиком - видно, как быстро
+автомат начинает отказывать сразу.
+
+Запуск: python bench_glm_resilience.py [--requests 300] [--concurrency 8]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from glm_client import GLMClient
+from glm_resilience import CircuitBreaker
+
+RESPONSE = json.dumps({
+    "choices": [{"message": {"role": "assistant", "content": "Чупапи на связи!"}}]
+}).encode("utf-8")
+
+
+class FaultyHandler(BaseHTTPRequestHandler):
+    """Ответ GLM с задержкой и случайными сбоями (параметры - в атрибутах сервера)"""
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        server = self.server
+        with server.lock:
+            roll = server.random.random()
+        if server.down or roll < server.error_rate:
+            time.sleep(server.base_delay)
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        slow = roll < server.error_rate + server.slow_rate
+        time.sleep(server.slow_delay if slow else server.base_delay)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(RESPONSE)))
+        self.end_headers()
+        self.wfile.write(RESPONSE)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class QuietServer(ThreadingHTTPServer):
+    """Без трассировок, когда клиент бросил запрос (отмененный дубль)"""
+
+    def handle_error(self, request, client_address):
+        pass
+
+
+def start_server(base_delay: float, slow_delay: float, slow_rate: float, error_rate: float) -> tuple:
+    server = QuietServer(("127.0.0.1", 0), FaultyHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.random = random.Random(7)
+    server.base_delay, server.slow_delay = base_delay, slow_delay
+    server.slow_rate, server.error_rate = slow_rate, error_rate
+    server.down = False
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/chat/completions"
+
+
+async def run(client: GLMClient, count: int, concurrency: int) -> tuple:
+    """Запросы в concurrency потоков: (задержки в мс, сколько без ответа)"""
+    messages = [{"role": "user", "content": "привет"}]
+    latencies, failures = [], 0
+    queue = list(range(count))
+
+    async def worker():
+        nonlocal failures
+        while queue:
+            queue.pop()
+            start = time.perf_counter()
+            content = await client.chat_completion(messages)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if not content:
+                failures += 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, failures
+
+
+def report(title: str, latencies: list, failures: int):
+    ordered = sorted(latencies)
+    p50 = ordered[len(ordered) // 2]
+    p99 = ordered[int(len(ordered) * 0.99) - 1]
+    print(f"{title}: без ответа {failures}/{len(latencies)}, "
+          f"p50 {p50:.0f} мс, p99 {p99:.0f} мс, макс {ordered[-1]:.0f} мс")
+
+
+def make_client(url: str, resilient: bool) -> GLMClient:
+    if not resilient:
+        return GLMClient("key", url, max_retries=0)
+    return GLMClient(
+        "key", url, max_retries=2, retry_base_delay=0.05, retry_max_delay=0.5,
+        hedge=True, breaker=CircuitBreaker(failure_threshold=5, reset_timeout=1.0)
+    )
+
+
+async def hiccups(url: str, count: int, concurrency: int):
+    for title, resilient in (("Без повторов", False), ("Повторы + хеджирование", True)):
+        client = make_client(url, resilient)
+        # Прогрев: перцентиль для хеджирования считается по недавним ответам
+        await run(client, 40, concurrency)
+        latencies, failures = await run(client, count, concurrency)
+        report(title, latencies, failures)
+        if resilient:
+            print(f"  {client.resilience_stats()}")
+        await client.aclose()
+
+
+async def outage(server, url: str, concurrency: int):
+    for title, resilient in (("Без автомата", False), ("С автоматом отключения", True)):
+        client = make_client(url, resilient)
+        server.down = True
+        latencies, failures = await run(client, 100, concurrency)
+        server.down = False
+        report(f"{title}, провайдер лежит", latencies, failures)
+        if resilient:
+            await asyncio.sleep(1.1)  # reset_timeout: пробный запрос замкнет автомат
+            await run(client, 5, 1)
+            print(f"  после восстановления: {client.resilience_stats()['breaker']}")
+        await client.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)  # Ошибки здесь ожидаемы - не засоряем вывод
+
+    server, url = start_server(base_delay=0.02, slow_delay=0.5, slow_rate=0.03, error_rate=0.05)
+    print(f"Фейковый GLM: {url} (3% ответов по 500 мс, 5% ответов 503)")
+    try:
+        asyncio.run(hiccups(url, args.requests, args.concurrency))
+        asyncio.run(outage(server, url, args.concurrency))
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк детекторов SmartLocalAI: стоимость классификации одного сообщения
+
+Сравнивает запуск всех паттернов каждого детектора (без фильтра) с
+однопроходным фильтром ключевых слов (SmartLocalAI.analyze) и проверяет,
+что результаты совпадают.
+
+Запуск: python bench_intents.py [--messages 20000]
+"""
+import argparse
+import random
+import re
+import statistics
+import time
+
+from smart_ai import SmartLocalAI
+
+
+CHAT_LINES = [
+    "привет всем", "как дела?", "че как пацаны", "пойдем вечером в кино",
+    "блин опять дождь", "кто идет на футбол в субботу?", "где взять нормальный кофе",
+    "чупапи будь пиратом", "чупапи, верни себя в норму", "теперь ты злой робот",
+    "напомни через 15 минут про созвон", "через 2 часа напомни забрать посылку",
+    "отвечай только короткими фразами", "всегда добавляй эмодзи в конце",
+    "меня зовут Олег", "мне 27 лет", "я из Казани", "работаю как программист",
+    "люблю пиццу с ананасами", "спасибо, от души", "пока, до завтра",
+    "почему бот молчит?", "когда зарплата уже", "сколько будет 2+2",
+    "это вообще законно?", "ты можешь рассказать анекдот?", "мне скучно",
+    "ну такое, отстой полный", "ура, получилось!", "жаль что так вышло",
+    "скинь мем", "ахахах", "ок", "го в доту", "кто мой создатель",
+    "завтра на работу к восьми", "видели новый трейлер?", "кот опять разбил чашку",
+    "ладно, я спать", "а вы знали что осьминоги умные", "погода сегодня супер",
+]
+
+
+def make_corpus(count: int, seed: int = 42) -> list:
+    """Сообщения из живых фраз, иногда склеенных по две"""
+    rnd = random.Random(seed)
+    corpus = []
+    for _ in range(count):
+        line = rnd.choice(CHAT_LINES)
+        if rnd.random() < 0.3:
+            line = f"{line} {rnd.choice(CHAT_LINES)}"
+        corpus.append(line)
+    return corpus
+
+
+class UnfilteredSmartLocalAI(SmartLocalAI):
+    """Без фильтра ключевых слов: каждый детектор прогоняет все свои паттерны"""
+
+    def _scan(self, text_lower, triggered):
+        return self.all_groups
+
+    def detect_sentiment(self, text, triggered=None):
+        # Прежний перебор основ: у сентимента фильтр и есть детектор
+        text_lower = text.lower()
+        for sentiment, patterns in self.sentiment_patterns.items():
+            if any(re.search(p, text_lower) for p in patterns):
+                return sentiment
+        return None
+
+
+class StubKnowledge:
+    """Минимальная замена KnowledgeManager для SmartLocalAI"""
+
+    def add_listener(self, listener):
+        listener.rebuild({})
+
+
+def run(ai: SmartLocalAI, corpus: list) -> tuple:
+    """Классифицировать все сообщения, вернуть (результаты, задержки в мкс)"""
+    results, latencies = [], []
+    for text in corpus:
+        start = time.perf_counter()
+        results.append(ai.analyze(text))
+        latencies.append((time.perf_counter() - start) * 1_000_000)
+    return results, latencies
+
+
+def report(title: str, latencies: list):
+    ordered = sorted(latencies)
+    p50 = ordered[len(ordered) // 2]
+    p99 = ordered[int(len(ordered) * 0.99) - 1]
+    print(f"{title}: {len(latencies)} сообщений, "
+          f"среднее {statistics.mean(latencies):.1f} мкс, p50 {p50:.1f} мкс, "
+          f"p99 {p99:.1f} мкс, макс {ordered[-1]:.1f} мкс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=20_000)
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.messages)
+
+    unfiltered = UnfilteredSmartLocalAI(StubKnowledge())
+    unfiltered.all_groups = set().union(*unfiltered.prefilter.keyword_groups.values())
+    filtered = SmartLocalAI(StubKnowledge())
+
+    expected, before = run(unfiltered, corpus)
+    actual, after = run(filtered, corpus)
+    mismatches = sum(1 for a, b in zip(expected, actual) if a != b)
+
+    report("Без фильтра (все паттерны)", before)
+    report("С фильтром ключевых слов", after)
+    print(f"Расхождений в результатах: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
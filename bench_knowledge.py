@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк KnowledgeManager: задержка add_raw_message при заполненной памяти
+и сборки контекста get_context_for_prompt
+
+Сравнивает прежнее вытеснение (сортировка всех фактов + list.remove)
+с текущим (глобальная очередь фактов в порядке добавления).
+
+Запуск: python bench_knowledge.py [--inserts 100000] [--legacy-inserts 100000] [--queries 1000]
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from knowledge_manager import KnowledgeManager
+
+
+WORDS = [
+    "привет", "как", "дела", "сегодня", "погода", "пицца", "работа", "код",
+    "бот", "чупапи", "вечером", "играть", "кино", "футбол", "кофе", "утро",
+    "пятница", "завтра", "машина", "деньги", "отпуск", "море", "музыка", "кот"
+]
+
+
+class LegacyKnowledgeManager(KnowledgeManager):
+    """Прежний алгоритм вытеснения - для сравнения"""
+
+    def get_total_count(self) -> int:
+        return sum(len(facts) for facts in self.facts.values())
+
+    def cleanup_old_facts(self):
+        total = self.get_total_count()
+
+        if total > self.MAX_FACTS:
+            all_facts = []
+            for key, fact_list in self.facts.items():
+                for fact in fact_list:
+                    all_facts.append({
+                        'key': key,
+                        'fact': fact,
+                        'timestamp': fact.get('timestamp', '')
+                    })
+
+            all_facts.sort(key=lambda x: x['timestamp'])
+
+            to_remove = total - self.MAX_FACTS
+            removed = 0
+
+            for item in all_facts:
+                if removed >= to_remove:
+                    break
+
+                key = item['key']
+                fact_to_remove = item['fact']
+
+                if key in self.facts and fact_to_remove in self.facts[key]:
+                    self.facts[key].remove(fact_to_remove)
+                    if not self.facts[key]:
+                        del self.facts[key]
+                    removed += 1
+
+            print(f"Удалено {removed} старых фактов для соблюдения лимита")
+
+
+def make_messages(count: int, seed: int = 42, words: list = WORDS) -> list:
+    rnd = random.Random(seed)
+    return [" ".join(rnd.choices(words, k=rnd.randint(3, 15))) for _ in range(count)]
+
+
+def make_vocabulary(count: int, seed: int = 7) -> list:
+    """Словарь случайных слов - ближе к живому чату, чем короткий WORDS"""
+    rnd = random.Random(seed)
+    letters = "абвгдежзиклмнопрстуфхцчшщыэюя"
+    return ["".join(rnd.choices(letters, k=rnd.randint(3, 9))) for _ in range(count)]
+
+
+def run(manager_cls, messages: list) -> list:
+    """Вставить все сообщения и вернуть задержки в микросекундах"""
+    latencies = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        km = manager_cls(os.path.join(tmp_dir, "bench_knowledge.json"))
+        # Подавляем печать "Удалено N старых фактов" на каждой вставке
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i, text in enumerate(messages):
+                start = time.perf_counter()
+                km.add_raw_message(text, i % 50, f"user{i % 50}")
+                latencies.append((time.perf_counter() - start) * 1_000_000)
+        km._close_journal()
+    return latencies
+
+
+def run_context(messages: list, queries: list) -> list:
+    """Заполнить память и вернуть задержки get_context_for_prompt в микросекундах"""
+    latencies = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        km = KnowledgeManager(os.path.join(tmp_dir, "bench_knowledge.json"))
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i, text in enumerate(messages):
+                km.add_raw_message(text, i % 50, f"user{i % 50}")
+        for query in queries:
+            start = time.perf_counter()
+            km.get_context_for_prompt(query)
+            latencies.append((time.perf_counter() - start) * 1_000_000)
+        km._close_journal()
+    return latencies
+
+
+def report(title: str, latencies: list, unit: str = "вставок"):
+    ordered = sorted(latencies)
+    p50 = ordered[len(ordered) // 2]
+    p99 = ordered[int(len(ordered) * 0.99) - 1]
+    print(f"{title}: {len(latencies)} {unit}, "
+          f"среднее {statistics.mean(latencies):.1f} мкс, p50 {p50:.1f} мкс, "
+          f"p99 {p99:.1f} мкс, макс {ordered[-1]:.1f} мкс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--inserts", type=int, default=100_000)
+    parser.add_argument("--legacy-inserts", type=int, default=100_000,
+                        help="Прежний алгоритм очень медленный - можно уменьшить")
+    parser.add_argument("--queries", type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"MAX_FACTS = {KnowledgeManager.MAX_FACTS}")
+    report("До (сортировка + list.remove)", run(LegacyKnowledgeManager, make_messages(args.legacy_inserts)))
+    report("После (очередь в порядке добавления)", run(KnowledgeManager, make_messages(args.inserts)))
+
+    vocabulary = make_vocabulary(20_000)
+    report("get_context_for_prompt", run_context(
+        make_messages(KnowledgeManager.MAX_FACTS * 2, words=vocabulary),
+        make_messages(args.queries, seed=1, words=vocabulary)
+    ), unit="запросов")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк сохранения JSON-менеджеров на примере RatingManager
+
+Сравнивает синхронную запись файла на каждое изменение с PersistenceService
+(пометка "грязный" + фоновый пакетный сброс). Меряется задержка add_rating
+и задержка цикла событий (насколько опаздывает asyncio.sleep) - последняя
+показывает, сколько сам фоновый сброс мешает другим обработчикам.
+
+Запуск: python bench_persistence.py [--history 20000 100000] [--updates 100]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import statistics
+import tempfile
+import time
+
+from persistence import PersistenceService
+from rating_manager import RatingManager
+
+
+def fill(manager: RatingManager, history: int):
+    """Заполнить историю рейтинга, чтобы файл стал большим"""
+    for i in range(history):
+        chat = manager.history.setdefault(-100 - i % 5, {})
+        chat.setdefault(i % 200, []).append({
+            "timestamp": "2026-01-01T12:00:00", "points": 1,
+            "reason": "Отличное сообщение про пиццу и котиков", "username": f"user{i % 200}"
+        })
+
+
+async def run(history: int, updates: int, persisted: bool) -> tuple:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "ratings.json")
+        persistence = PersistenceService(flush_interval=0.5) if persisted else None
+        manager = RatingManager(path, persistence=persistence)
+        fill(manager, history)
+
+        loop_lags = []
+        stop = False
+
+        async def probe():
+            # Пинг цикла событий каждые 5 мс
+            while not stop:
+                start = time.perf_counter()
+                await asyncio.sleep(0.005)
+                loop_lags.append((time.perf_counter() - start - 0.005) * 1000)
+
+        tasks = [asyncio.create_task(probe())]
+        if persistence:
+            tasks.append(asyncio.create_task(persistence.run()))
+
+        latencies = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i in range(updates):
+                start = time.perf_counter()
+                manager.add_rating(-100, i % 200, f"user{i % 200}", 1, "bench")
+                latencies.append((time.perf_counter() - start) * 1000)
+                await asyncio.sleep(0.01)  # Сообщения идут потоком, а не пачкой
+
+        stop = True
+        if persistence:
+            await persistence.close()
+        for task in tasks:
+            task.cancel()
+        size = os.path.getsize(path) / 1024
+    return latencies, loop_lags, size
+
+
+def percentiles(values: list) -> str:
+    ordered = sorted(values)
+    p50 = ordered[len(ordered) // 2]
+    p99 = ordered[int(len(ordered) * 0.99) - 1]
+    return f"среднее {statistics.mean(values):.2f} мс, p50 {p50:.2f} мс, p99 {p99:.2f} мс"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--history", type=int, nargs="+", default=[20_000, 100_000])
+    parser.add_argument("--updates", type=int, default=100)
+    args = parser.parse_args()
+
+    for history in args.history:
+        for persisted, title in ((False, "Синхронно"), (True, "PersistenceService")):
+            latencies, lags, size = asyncio.run(run(history, args.updates, persisted))
+            print(f"[{history} записей, файл {size:.0f} КБ] {title}")
+            print(f"    add_rating:     {percentiles(latencies)}")
+            print(f"    задержка цикла: {percentiles(lags)}")
+
+
+if __name__ == "__main__":
+    main()
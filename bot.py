@@ -1,8 +1,8 @@
 import logging
 import asyncio
 import random
+import time
 from datetime import datetime
-from collections import defaultdict
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand
 from telegram.ext import (
     Application,
@@ -20,9 +20,69 @@ from config import (
     ALLOWED_CHAT_IDS,
     GLM_API_KEY,
     GLM_API_URL,
-    DEFAULT_MODEL
+    DEFAULT_MODEL,
+    GLM_ROUTER_ENABLED,
+    GLM_MODEL_TIERS,
+    GLM_MODEL_ROUTES,
+    GLM_LATENCY_BUDGETS,
+    GLM_MAX_PROMPT_CHARS,
+    GLM_ROUTER_MAX_ERROR_RATE,
+    KNOWLEDGE_COMPACT_INTERVAL,
+    GLM_TIMEOUT,
+    GLM_CONNECT_TIMEOUT,
+    GLM_MAX_CONNECTIONS,
+    GLM_MAX_KEEPALIVE_CONNECTIONS,
+    GLM_KEEPALIVE_EXPIRY,
+    GLM_HTTP2,
+    STREAM_RESPONSES,
+    STREAM_EDIT_INTERVAL,
+    GLM_CACHE_ENABLED,
+    GLM_CACHE_MAX_BYTES,
+    GLM_CACHE_POLICY,
+    GLM_SCHEDULER_ENABLED,
+    GLM_CONCURRENCY_INITIAL,
+    GLM_CONCURRENCY_MIN,
+    GLM_CONCURRENCY_MAX,
+    GLM_LATENCY_TARGET,
+    GLM_PRIORITY_POLICY,
+    GLM_MAX_RETRIES,
+    GLM_RETRY_BASE_DELAY,
+    GLM_RETRY_MAX_DELAY,
+    GLM_HEDGE_ENABLED,
+    GLM_BREAKER_ENABLED,
+    GLM_BREAKER_FAILURES,
+    GLM_BREAKER_RESET,
+    GLM_DEADLINES,
+    LOCAL_FALLBACK_MIN_CONFIDENCE,
+    PERSISTENCE_FLUSH_INTERVAL_MS,
+    STORAGE_BACKEND,
+    SQLITE_DB_FILE,
+    MEMBER_MESSAGES_RETENTION_DAYS,
+    TELEGRAM_CONCURRENT_UPDATES,
+    CHAT_BACKLOG_LIMIT,
+    TELEGRAM_GLOBAL_RATE,
+    TELEGRAM_PRIVATE_CHAT_RATE,
+    TELEGRAM_GROUP_CHAT_PER_MINUTE,
+    TELEGRAM_CHAT_BURST,
+    TELEGRAM_MAX_RETRIES,
+    COALESCE_DEBOUNCE_MS,
+    COALESCE_MAX_WAIT_MS,
+    COALESCE_MAX_BATCH,
+    PROMPT_MAX_INPUT_TOKENS,
+    PROMPT_SECTION_BUDGETS,
+    PROMPT_HISTORY_CANDIDATES,
+    PROMPT_HISTORY_KEEP_LAST,
+    SUMMARY_ENABLED,
+    SUMMARY_USE_GLM,
+    SUMMARY_KEEP_RECENT,
+    SUMMARY_BATCH,
+    SUMMARY_MAX_CHARS
 )
 from glm_client import GLMClient
+from glm_scheduler import GLMScheduler
+from glm_resilience import CircuitBreaker
+from model_router import ModelRouter
+from response_cache import ResponseCache
 from history_manager import HistoryManager
 from members_manager import MembersManager
 from knowledge_manager import KnowledgeManager
@@ -36,6 +96,25 @@ from achievements_manager import AchievementsManager
 from mood_manager import MoodManager
 from human_behavior import HumanBehavior
 from casino_manager import CasinoManager
+from streaming import stream_to_message
+from persistence import PersistenceService
+from message_features import MessageFeatures
+from chat_dispatcher import ChatDispatcher
+from delivery import DeliveryScheduler
+from coalescer import MessageCoalescer
+from deadlines import run_with_deadline, cancel_late_requests
+from prompt_packer import PromptPacker, estimate_tokens, message_tokens
+from prompt_cache import PromptSegmentCache
+from conversation_summarizer import ConversationSummarizer
+from relevance_index import tokenize
+from rate_limiter import PriorityRateLimiter, priority, PRIORITY_ANNOUNCEMENT, PRIORITY_PROACTIVE
+from sqlite_storage import (
+    SQLiteStorage,
+    SQLiteRatingManager,
+    SQLiteMembersManager,
+    SQLiteAchievementsManager,
+    SQLiteDailyStatsManager
+)
 
 # Настройка логирования
 logging.basicConfig(
@@ -45,25 +124,95 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Инициализация клиентов
-glm_client = GLMClient(GLM_API_KEY, GLM_API_URL, DEFAULT_MODEL)
-# Храним до 30 сообщений локально, но отправляем в AI только последние 10-12 для экономии токенов
+glm_client = GLMClient(
+    GLM_API_KEY, GLM_API_URL, DEFAULT_MODEL,
+    timeout=GLM_TIMEOUT,
+    connect_timeout=GLM_CONNECT_TIMEOUT,
+    max_connections=GLM_MAX_CONNECTIONS,
+    max_keepalive_connections=GLM_MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry=GLM_KEEPALIVE_EXPIRY,
+    http2=GLM_HTTP2,
+    cache=ResponseCache(GLM_CACHE_POLICY, max_bytes=GLM_CACHE_MAX_BYTES) if GLM_CACHE_ENABLED else None,
+    scheduler=GLMScheduler(
+        GLM_PRIORITY_POLICY,
+        initial_limit=GLM_CONCURRENCY_INITIAL,
+        min_limit=GLM_CONCURRENCY_MIN,
+        max_limit=GLM_CONCURRENCY_MAX,
+        latency_target=GLM_LATENCY_TARGET,
+        # Доля чата в очереди к GLM - из его настроек (settings_manager создается ниже)
+        weight_for=lambda chat_id: settings_manager.get_glm_weight(chat_id)
+    ) if GLM_SCHEDULER_ENABLED else None,
+    max_retries=GLM_MAX_RETRIES,
+    retry_base_delay=GLM_RETRY_BASE_DELAY,
+    retry_max_delay=GLM_RETRY_MAX_DELAY,
+    hedge=GLM_HEDGE_ENABLED,
+    breaker=CircuitBreaker(GLM_BREAKER_FAILURES, GLM_BREAKER_RESET) if GLM_BREAKER_ENABLED else None,
+    router=ModelRouter(
+        GLM_MODEL_TIERS,
+        GLM_MODEL_ROUTES,
+        latency_budgets=GLM_LATENCY_BUDGETS,
+        max_prompt_chars=GLM_MAX_PROMPT_CHARS,
+        max_error_rate=GLM_ROUTER_MAX_ERROR_RATE
+    ) if GLM_ROUTER_ENABLED else None
+)
+# Храним до 30 сообщений локально, в AI идут недавние в пределах бюджета промпта (PROMPT_SECTION_BUDGETS)
 history_manager = HistoryManager(max_history=30, expiration_minutes=60)
-members_manager = MembersManager()
+# Старые реплики в фоне сжимаются в сводку, в промпт вместо них идет она
+summarizer = ConversationSummarizer(
+    history_manager,
+    summarize=(lambda chat_id, previous, turns: summarize_with_glm(chat_id, previous, turns)) if SUMMARY_USE_GLM else None,
+    keep_recent=SUMMARY_KEEP_RECENT,
+    batch=SUMMARY_BATCH,
+    max_chars=SUMMARY_MAX_CHARS
+) if SUMMARY_ENABLED else None
+# Отложенное пакетное сохранение JSON-менеджеров
+persistence = PersistenceService(flush_interval=PERSISTENCE_FLUSH_INTERVAL_MS / 1000)
+# Рейтинг, участники, ачивки и дневная статистика - в JSON или в SQLite
+sqlite_storage = SQLiteStorage(SQLITE_DB_FILE) if STORAGE_BACKEND == "sqlite" else None
+if sqlite_storage:
+    members_manager = SQLiteMembersManager(sqlite_storage, message_retention_days=MEMBER_MESSAGES_RETENTION_DAYS)
+    rating_manager = SQLiteRatingManager(sqlite_storage)
+    daily_stats = SQLiteDailyStatsManager(sqlite_storage)
+    achievements_manager = SQLiteAchievementsManager(sqlite_storage)
+else:
+    members_manager = MembersManager(persistence=persistence, message_retention_days=MEMBER_MESSAGES_RETENTION_DAYS)
+    rating_manager = RatingManager(persistence=persistence)
+    daily_stats = DailyStatsManager(persistence=persistence)
+    achievements_manager = AchievementsManager(persistence=persistence)
 knowledge_manager = KnowledgeManager()
 smart_ai = SmartLocalAI(knowledge_manager)
-settings_manager = SettingsManager()
-rating_manager = RatingManager()
-daily_stats = DailyStatsManager()
+settings_manager = SettingsManager(persistence=persistence)
+# Персона, правила и профили в промпте собираются заново только после их изменения
+prompt_cache = PromptSegmentCache()
+settings_manager.add_change_listener(prompt_cache.invalidate_chat)
+knowledge_manager.add_change_listener(prompt_cache.on_knowledge_change)
 levels_manager = LevelsManager()
-achievements_manager = AchievementsManager()
-mood_manager = MoodManager()
+mood_manager = MoodManager(persistence=persistence)
 human_behavior = HumanBehavior()
 casino_manager = CasinoManager()
 
 
-# Система очередей для обработки запросов (чтобы не было багов при множественных запросах)
-chat_locks = defaultdict(asyncio.Lock)
-chat_queues = defaultdict(asyncio.Queue)
+# Система очередей: апдейты разных чатов обрабатываются параллельно,
+# а внутри одного чата - строго по порядку (чтобы не было багов при множественных запросах)
+chat_dispatcher = ChatDispatcher(max_backlog=CHAT_BACKLOG_LIMIT)
+# Многочастные ответы с паузами "печатает" отправляются в фоне, не держа очередь чата
+delivery_scheduler = DeliveryScheduler()
+# Все исходящие запросы к Telegram: лимиты на бота и на чат, приоритеты, повтор после 429
+outbound_limiter = PriorityRateLimiter(
+    overall_rate=TELEGRAM_GLOBAL_RATE,
+    private_chat_rate=TELEGRAM_PRIVATE_CHAT_RATE,
+    group_chat_per_minute=TELEGRAM_GROUP_CHAT_PER_MINUTE,
+    chat_burst=TELEGRAM_CHAT_BURST,
+    max_retries=TELEGRAM_MAX_RETRIES
+)
+# Серия сообщений боту подряд (и всё, что пришло, пока он отвечал) - один запрос к GLM
+# Пачка обрабатывается в очереди своего чата, как и апдейты: следующие сообщения ждут ответа на нее
+message_coalescer = MessageCoalescer(
+    lambda chat_id, batch: chat_dispatcher.run(chat_id, lambda: process_message(chat_id, batch)),
+    debounce=COALESCE_DEBOUNCE_MS / 1000,
+    max_wait=COALESCE_MAX_WAIT_MS / 1000,
+    max_batch=COALESCE_MAX_BATCH
+)
 
 # Хранилище для фоновых задач (напоминания и т.д.), чтобы они не были удалены сборщиком мусора
 background_tasks = set()
@@ -143,18 +292,28 @@ async def send_reminder(application, chat_id: int, user_id: int, username: str,
 
 Твое напоминание:"""
         
+        reminder_message = None
         try:
             # Генерируем ответ через AI
-            ai_response = await glm_client.generate_response(
-                prompt=ai_prompt,
-                history=[],
-                max_tokens=100,
-                temperature=0.9
+            # Не успел - напоминаем по шаблону, поздний ответ останется только в кэше
+            _, ai_response = await run_with_deadline(
+                glm_client.chat_completion(
+                    [{"role": "user", "content": ai_prompt}],
+                    max_tokens=100,
+                    temperature=0.9,
+                    call_site="reminder",
+                    chat_id=chat_id
+                ),
+                settings_manager.get_deadline(chat_id, "reminder", GLM_DEADLINES),
+                label=f"reminder in chat {chat_id}"
             )
-            reminder_message = ai_response.strip()
-            logger.info(f"[REMINDER] AI generated: {reminder_message[:50]}...")
+            if ai_response:
+                reminder_message = ai_response.strip()
+                logger.info(f"[REMINDER] AI generated: {reminder_message[:50]}...")
         except Exception as e:
             logger.error(f"Error generating AI reminder: {e}")
+
+        if not reminder_message:
             # Fallback на простое напоминание
             if reminder_text:
                 reminder_message = f"⏰ Эй, {user_name}! Напоминаю про: {reminder_text} 😉"
@@ -284,6 +443,8 @@ async def clear_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Очистить историю диалога"""
     chat_id = update.effective_chat.id
     history_manager.clear_history(chat_id)
+    message_coalescer.cancel(chat_id)  # Сообщения, ждущие ответа, относятся к старой истории
+    delivery_scheduler.cancel(chat_id)  # Недоотправленный ответ больше не нужен
     await update.message.reply_text("🗑 История диалога очищена!")
 
 
@@ -772,7 +933,7 @@ async def auto_learn_facts(message, user_text: str):
     knowledge_manager.add_raw_message(user_text, user.id, username)
 
 
-async def check_and_unlock_achievements(chat_id: int, user_id: int, username: str, old_rating: int, new_rating: int):
+async def check_and_unlock_achievements(bot, chat_id: int, user_id: int, username: str, old_rating: int, new_rating: int):
     """Проверяет и разблокирует ачивки при изменении рейтинга"""
     try:
         # Проверяем достижения по рейтингу
@@ -799,9 +960,10 @@ async def check_and_unlock_achievements(chat_id: int, user_id: int, username: st
 
             # Отправляем уведомление в чат (asynchronously)
             try:
-                from telegram import Bot
-                bot = Bot(token=TELEGRAM_BOT_TOKEN)
-                await bot.send_message(chat_id=chat_id, text=message, parse_mode='HTML')
+                await bot.send_message(
+                    chat_id=chat_id, text=message, parse_mode='HTML',
+                    rate_limit_args=priority(PRIORITY_ANNOUNCEMENT)
+                )
             except Exception as e:
                 logger.error(f"Error sending level up message: {e}")
 
@@ -809,46 +971,25 @@ async def check_and_unlock_achievements(chat_id: int, user_id: int, username: st
         logger.error(f"Error checking achievements: {e}")
 
 
-async def check_rating_request(update: Update, user_text: str, chat_id: int, user_id: int, username: str) -> bool:
+async def check_rating_request(update: Update, features: MessageFeatures, chat_id: int, user_id: int, username: str) -> bool:
     """
     Проверяет просьбы о начислении очков и начисляет их.
     Возвращает True если очки были начислены.
     """
-    import re
-
-    text_lower = user_text.lower()
-
-    # Ищем фразы просьбы о начислении очков
-    rating_request_patterns = [
-        r'дай\s+(?:мне\s+)?(?:\d+\s+)?очк',  # дай очки, дай 5 очков
-        r'начисл[и|ь]\s+(?:мне\s+)?(?:\d+\s+)?(?:рейтинг|очк)',  # начисли очки, начисли рейтинг
-        r'добав[ь|и]\s+(?:мне\s+)?(?:\d+\s+)?(?:рейтинг|очк)',  # добавь очки
-        r'очк[и|а|ов]\s+(?:плиз|пожалуйста)',  # очки плиз, очки пожалуйста
-        r'начисл(?:и|ь)\s+(?:мне\s+)?рейтинг',  # начисли рейтинг
-        r'плюс\s+\d+\s+(?:рейтинг|очк)',  # плюс 5 очков
-    ]
-
-    # Проверяем, содержит ли сообщение просьбу о начислении очков
-    has_rating_request = any(re.search(pattern, text_lower) for pattern in rating_request_patterns)
-
-    if not has_rating_request:
+    # Просьба и ее параметры уже разобраны в MessageFeatures
+    if not features.rating_request:
         return False
 
-    # Пытаемся извлечь количество очков из текста
-    points_match = re.search(r'(\d+)\s+(?:очк|рейтинг)', text_lower)
-    points = int(points_match.group(1)) if points_match else 1
-
     # Ограничиваем максимум 5 очков за одну просьбу
-    points = min(points, 5)
+    points = min(features.rating_points, 5)
 
     # Пытаемся найти упоминание другого пользователя (@username или имя)
     target_user_id = user_id
     target_username = username
 
     # Ищем @mention
-    mention_match = re.search(r'@(\w+)', user_text)
-    if mention_match:
-        mentioned_user = mention_match.group(1)
+    mentioned_user = features.rating_mention
+    if mentioned_user:
         # Пытаемся найти этого пользователя в базе членов
         if chat_id in members_manager.members:
             for member in members_manager.members[chat_id]:
@@ -858,9 +999,8 @@ async def check_rating_request(update: Update, user_text: str, chat_id: int, use
                     break
 
     # Ищем имя в тексте (после "дай", "начисли" и т.д.)
-    name_match = re.search(r'(?:дай|начисл|добав|плюс)\s+(?:\d+\s+)?(?:очк|рейтинг)?\s*(?:для\s+)?(\w+)', user_text)
-    if name_match and not mention_match:  # Приоритет @mention
-        potential_name = name_match.group(1)
+    potential_name = features.rating_target
+    if potential_name and not mentioned_user:  # Приоритет @mention
         if chat_id in members_manager.members:
             for member in members_manager.members[chat_id]:
                 if member.get('username') == potential_name or member.get('first_name', '').lower() == potential_name.lower():
@@ -894,7 +1034,7 @@ async def check_rating_request(update: Update, user_text: str, chat_id: int, use
         new_rating = rating_manager.get_user_rating(chat_id, target_user_id)
 
         # Проверяем уровень и ачивки
-        await check_and_unlock_achievements(chat_id, target_user_id, target_username, old_rating, new_rating)
+        await check_and_unlock_achievements(update.get_bot(), chat_id, target_user_id, target_username, old_rating, new_rating)
 
         # Отправляем подтверждение
         remaining = 10 - (daily_manual_grants + points)
@@ -945,14 +1085,18 @@ async def evaluate_message(update: Update, user_text: str, username: str, chat_i
             announcement = f"{emoji} <b>{username}</b> получил <b>+{points} очков</b>!\n⭐ Новый рейтинг: <b>{new_rating}</b> очков"
 
             try:
-                await update.message.chat.send_message(announcement, parse_mode='HTML')
+                # rate_limit_args принимают только методы самого бота, не Chat.send_message
+                await update.get_bot().send_message(
+                    chat_id=chat_id, text=announcement, parse_mode='HTML',
+                    rate_limit_args=priority(PRIORITY_ANNOUNCEMENT)
+                )
             except Exception as e:
                 logger.warning(f"[RATING] Could not send rating announcement: {e}")
 
             # Проверяем ачивки
             old_rating = new_rating - points
             asyncio.create_task(check_and_unlock_achievements(
-                chat_id, user_id, username, old_rating, new_rating
+                update.get_bot(), chat_id, user_id, username, old_rating, new_rating
             ))
         else:
             logger.info(f"[RATING] 25% check failed - no points this time")
@@ -961,9 +1105,9 @@ async def evaluate_message(update: Update, user_text: str, username: str, chat_i
         logger.error(f"[RATING] Error: {e}", exc_info=True)
 
 
-async def handle_persona_change(message, user_text: str, chat_id: int) -> bool:
+async def handle_persona_change(message, features: MessageFeatures, chat_id: int) -> bool:
     """Обработка смены личности"""
-    new_persona, is_reset = smart_ai.detect_persona_change(user_text)
+    new_persona, is_reset = features.analysis['persona'], features.analysis['persona_reset']
     if is_reset:
         settings_manager.update_setting(chat_id, "custom_persona", None)
         history_manager.clear_history(chat_id)
@@ -976,9 +1120,9 @@ async def handle_persona_change(message, user_text: str, chat_id: int) -> bool:
     return False
 
 
-async def handle_behavioral_instruction(message, user_text: str, chat_id: int, user_id: int, username: str) -> bool:
+async def handle_behavioral_instruction(message, features: MessageFeatures, chat_id: int, user_id: int, username: str) -> bool:
     """Обработка поведенческих инструкций"""
-    behavioral_instruction = smart_ai.detect_behavioral_instruction(user_text)
+    behavioral_instruction = features.analysis['instruction']
     if behavioral_instruction:
         knowledge_manager.add_behavioral_rule(chat_id, behavioral_instruction, user_id, username)
         await message.reply_text(f"✅ Запомнил! Теперь буду: {behavioral_instruction}\n\nПроверь - спроси меня что-нибудь! 😉")
@@ -986,10 +1130,11 @@ async def handle_behavioral_instruction(message, user_text: str, chat_id: int, u
     return False
 
 
-async def handle_reminder_request(message, context: ContextTypes.DEFAULT_TYPE, user_text: str, chat_id: int, user_id: int, username: str) -> bool:
+async def handle_reminder_request(message, context: ContextTypes.DEFAULT_TYPE, features: MessageFeatures, chat_id: int, user_id: int, username: str) -> bool:
     """Обработка запросов на напоминание"""
+    user_text = features.reply_text
     logger.info(f"[DEBUG] Checking for reminder in message: '{user_text[:50]}...'")
-    reminder_request = smart_ai.detect_reminder_request(user_text)
+    reminder_request = features.analysis['reminder']
     logger.info(f"[DEBUG] Reminder detection result: {reminder_request}")
     if reminder_request:
         seconds = reminder_request['seconds']
@@ -1031,25 +1176,27 @@ async def handle_reminder_request(message, context: ContextTypes.DEFAULT_TYPE, u
     return False
 
 
-async def process_message(update: Update, context: ContextTypes.DEFAULT_TYPE, user_text: str, username: str):
-    """Обработка сообщения с генерацией ответа"""
+async def answer_locally(update: Update, context: ContextTypes.DEFAULT_TYPE, features: MessageFeatures, username: str) -> bool:
+    """
+    Ответ без GLM: смена личности, инструкции, напоминания, поиск, простые вопросы
+    Returns: True если сообщение обработано
+    """
     chat_id = update.effective_chat.id
     message = update.message
     user = message.from_user
-
-    chat_history = history_manager.get_history(chat_id)[:-1]
+    user_text = features.reply_text
 
     # 1. Проверка на смену личности
-    if await handle_persona_change(message, user_text, chat_id):
-        return
+    if await handle_persona_change(message, features, chat_id):
+        return True
 
     # 2. Проверка на поведенческую инструкцию
-    if await handle_behavioral_instruction(message, user_text, chat_id, user.id, username):
-        return
+    if await handle_behavioral_instruction(message, features, chat_id, user.id, username):
+        return True
 
     # 3. Проверка на запрос напоминания
-    if await handle_reminder_request(message, context, user_text, chat_id, user.id, username):
-        return
+    if await handle_reminder_request(message, context, features, chat_id, user.id, username):
+        return True
 
     # Если пользователь просит найти что-то в интернете - честно говорим что не умеем
     if needs_web_search(user_text):
@@ -1058,51 +1205,91 @@ async def process_message(update: Update, context: ContextTypes.DEFAULT_TYPE, us
             "Могу ответить только на основе своих знаний и того, что обсуждалось в этой беседе. "
             "Для свежей инфы лучше загугли! 🌐"
         )
-        return
+        return True
 
     # Сначала пробуем локальную AI для простых вопросов
     is_complex = is_complex_task(user_text)
     if not is_complex:
-        local_response, confidence = smart_ai.generate_smart_response(user_text, user.id, username)
+        local_response, confidence = smart_ai.generate_smart_response(user_text, user.id, username, analysis=features.analysis)
         if confidence > 0.8:
             history_manager.add_message(chat_id, "assistant", local_response, context.bot.username or "Assistant")
             # 🌍 Обновляем настроение на основе сентимента
-            sentiment = smart_ai.detect_sentiment(user_text)
-            mood_manager.update_mood(chat_id, sentiment)
+            mood_manager.update_mood(chat_id, features.sentiment)
             await message.reply_text(local_response)
-            return
+            return True
 
-    knowledge_context = knowledge_manager.get_context_for_prompt(user_text)
-    user_context = knowledge_manager.get_user_context(user.id)
-    user_name = knowledge_manager.get_user_name(user.id)
+    return False
 
-    settings = settings_manager.get_chat_settings(chat_id)
-    style = settings.get("response_style", "concise")
 
-    style_instruction = ""
-    if style == "concise":
-        style_instruction = "\nПРАВИЛО: ОТВЕЧАЙ МАКСИМАЛЬНО КРАТКО (1-2 предложения, по существу)."
-    elif style == "full":
-        style_instruction = "\nПРАВИЛО: ОТВЕЧАЙ РАЗВЕРНУТО и подробно, делись деталями."
+async def process_message(chat_id: int, batch: list):
+    """
+    Обработка пачки сообщений чата с генерацией ответа
 
-    custom_persona = settings.get("custom_persona")
-    persona_instruction = ""
-    if custom_persona:
-        persona_instruction = f"\nТЕКУЩАЯ РОЛЬ: Тебе приказали быть: {custom_persona}. На время этого разговора твоя личность меняется. Веди себя, отвечай и шути именно как {custom_persona}."
+    Сообщения серии, которые не обработаны локально, уходят в GLM одним
+    запросом, и бот отвечает один раз - на последнее из них.
+    """
+    context = batch[-1]['context']
+    pending = []
+    for item in batch:
+        if not await answer_locally(item['update'], context, item['features'], item['username']):
+            pending.append(item)
+
+    if pending:
+        await answer_with_glm(chat_id, context, pending)
+
+    params = settings_manager.get_intervention_params(chat_id)
+    if history_manager.should_intervene(chat_id, probability=params['probability'], min_delay=params['min_delay']):
+        # Дополнительная проверка: не спамим чаще чем каждые 5 минут
+        if history_manager.can_send_proactive_message(chat_id, min_interval_seconds=300):
+            history = history_manager.get_history(chat_id)
+            opinion = smart_ai.generate_proactive_hook(history)
+            if opinion:
+                await context.bot.send_message(
+                    chat_id=chat_id, text=opinion, rate_limit_args=priority(PRIORITY_PROACTIVE)
+                )
+                history_manager.add_message(chat_id, "assistant", opinion, context.bot.username or "Assistant")
+
+
+async def answer_with_glm(chat_id: int, context: ContextTypes.DEFAULT_TYPE, items: list):
+    """Один запрос к GLM на все сообщения серии, ответ - на последнее"""
+    message = items[-1]['update'].message
+
+    # Сообщения серии уже в истории - в контекст идет всё, кроме них и реплик, написанных после серии
+    own_entries = {id(item['history_entry']) for item in items}
+    last_seq = items[-1]['history_entry']['seq']
+    chat_history = [
+        m for m in history_manager.get_history(chat_id)
+        if id(m) not in own_entries and not (m.get('role') == 'user' and m.get('seq', 0) > last_seq)
+    ]
+    # Старые реплики, уже сжатые в сводку, заменяются ею
+    summary, chat_history = summarizer.split(chat_id, chat_history) if summarizer else ("", chat_history)
+
+    user_text = "\n".join(item['features'].reply_text for item in items)
+    search_words = [word for item in items for word in item['features'].search_words]
+    facts = knowledge_manager.get_context_facts(user_text, search_words)
+    user_ids = list(dict.fromkeys(item['update'].message.from_user.id for item in items))
+    user_context = "".join(
+        prompt_cache.user_segment(user_id, lambda user_id=user_id: knowledge_manager.get_user_context(user_id))
+        for user_id in user_ids
+    )
+
+    # Персона со стилем и ролью чата и 🧠 поведенческие правила - из кэша
+    persona_prompt = prompt_cache.chat_segment(chat_id, "persona", lambda: build_persona_prompt(chat_id))
+    behavioral_context = prompt_cache.chat_segment(
+        chat_id, "rules", lambda: knowledge_manager.get_behavioral_context(chat_id))
 
     # 🌍 Добавляем контекст настроения и времени суток
     mood_context = mood_manager.get_mood_prompt_context(chat_id)
     time_context = get_time_context()
-    
-    # 🧠 Добавляем поведенческие правила
-    behavioral_context = knowledge_manager.get_behavioral_context(chat_id)
 
-    enhanced_prompt = SYSTEM_PROMPT + style_instruction + persona_instruction + "\n" + mood_context + "\n" + time_context + "\n" + behavioral_context + "\n" + user_context + "\n" + knowledge_context
+    # Несколько сообщений подряд - одна реплика, каждая строка со своим автором
+    user_message = "\n".join(f"{item['username']}: {item['features'].reply_text}" for item in items)
+    # Болтовне хватит быстрой модели, код и сложные вопросы - большой
+    request_class = "complex_task" if is_complex_task(user_text) else "simple_reply"
 
     try:
-        # Оптимизация контекста: отправляем только последние 10-12 сообщений для экономии токенов
-        # Полная история хранится локально, но в AI отправляем только недавние
-        recent_history = chat_history[-10:] if len(chat_history) > 10 else chat_history
+        # Полная история хранится локально, в AI идут недавние сообщения в пределах бюджета
+        recent_history = chat_history[-PROMPT_HISTORY_CANDIDATES:]
 
         formatted_history = []
         for m in recent_history:
@@ -1114,77 +1301,226 @@ async def process_message(update: Update, context: ContextTypes.DEFAULT_TYPE, us
             else:
                 formatted_history.append({"role": "assistant", "content": content})
 
-        response = await glm_client.chat_completion_with_history(
-            user_message=f"{username}: {user_text}",
-            chat_history=formatted_history,
-            system_prompt=enhanced_prompt
+        # 📦 Укладываем промпт в бюджет токенов: лишние факты и старые реплики не по теме отбрасываются
+        query_tokens = set(tokenize(user_text))
+        packer = PromptPacker(PROMPT_MAX_INPUT_TOKENS, PROMPT_SECTION_BUDGETS)
+        packer.add_text("persona", persona_prompt, priority=0, required=True)
+        packer.add_text("message", user_message, priority=0, required=True)
+        packer.add_text("mood", mood_context, priority=3)
+        packer.add_text("time", time_context, priority=3)
+        packer.add_text("rules", behavioral_context, priority=1)
+        packer.add_text("user", user_context, priority=2)
+        packer.add_text(
+            "summary", f"\nКРАТКО О ТОМ, ЧТО ОБСУЖДАЛИ РАНЬШЕ:\n{summary}\n" if summary else "", priority=2)
+        packer.add_items(
+            "knowledge", facts, priority=4,
+            scores=[len(facts) - i for i in range(len(facts))],  # Уже по убыванию релевантности
+            render=knowledge_manager.format_facts_context,
+            cost=lambda item: estimate_tokens(item['fact']['fact']) + 10
+        )
+        packer.add_items(
+            "history", formatted_history, priority=2,
+            scores=[len(query_tokens & set(tokenize(m['content']))) for m in formatted_history],
+            cost=message_tokens, keep_last=PROMPT_HISTORY_KEEP_LAST
         )
+        packed = packer.pack()
+        logger.info(f"[PROMPT] chat {chat_id}: {packed.describe()}")
+
+        # Сначала то, что не меняется от сообщения к сообщению, в конце - самое изменчивое:
+        # одинаковое начало промпта провайдер может не обрабатывать заново
+        enhanced_prompt = "\n".join([
+            packed.text("persona"), packed.text("rules"), packed.text("time"),
+            packed.text("summary"), packed.text("user"), packed.text("knowledge"), packed.text("mood")
+        ])
+        formatted_history = packed.items("history")
+
+        if STREAM_RESPONSES:
+            # Ответ появляется в чате по мере генерации
+            response = await stream_to_message(
+                message,
+                glm_client.stream_completion_with_history(
+                    user_message=user_message,
+                    chat_history=formatted_history,
+                    system_prompt=enhanced_prompt,
+                    call_site="process_message",
+                    chat_id=chat_id,
+                    request_class=request_class
+                ),
+                edit_interval=STREAM_EDIT_INTERVAL
+            )
+        else:
+            # Не успел к дедлайну - отвечаем без GLM, а поздний ответ досылаем, если он еще к месту
+            fallback_entry = None
+
+            async def send_late(late_response):
+                await send_late_reply(chat_id, context, message, fallback_entry, late_response)
+
+            finished, response = await run_with_deadline(
+                glm_client.chat_completion_with_history(
+                    user_message=user_message,
+                    chat_history=formatted_history,
+                    system_prompt=enhanced_prompt,
+                    call_site="process_message",
+                    chat_id=chat_id,
+                    request_class=request_class
+                ),
+                settings_manager.get_deadline(chat_id, "process_message", GLM_DEADLINES),
+                on_late=send_late,
+                label=f"reply in chat {chat_id}"
+            )
+            if not finished:
+                fallback_entry = reply_without_glm(chat_id, context, items)
+                # Поздний ответ GLM относится к той же серии - она учтена здесь один раз
+                await learn_from_batch(chat_id, items)
+                return
 
         if response:
-            # 🌍 Обновляем настроение на основе сентимента
-            sentiment = smart_ai.detect_sentiment(user_text)
-            mood_manager.update_mood(chat_id, sentiment)
-
-            # 🌍 Разбиваем на несколько сообщений если текст длинный
-            messages_to_send = human_behavior.split_into_messages(str(response), max_length=200)
-
             history_manager.add_message(chat_id, "assistant", str(response), context.bot.username or "Assistant")
-            await auto_learn_facts(message, user_text)
-
-            # Отправляем сообщения по очереди
-            last_sent_message = None
-            for i, msg_part in enumerate(messages_to_send):
-                # 🌍 Добавляем typing pause перед каждым сообщением
-                await human_behavior.typing_pause(context, chat_id, len(msg_part))
-
-                # 🌍 Добавляем опечатки только к последнему сообщению
-                if i == len(messages_to_send) - 1:
-                    msg_with_typos, needs_fix = human_behavior.add_typos(msg_part, typo_chance=0.05)
-                    msg_with_typos = human_behavior.add_filler_words(msg_with_typos)
-                else:
-                    msg_with_typos = msg_part
-                    needs_fix = False
-
-                # Отправляем сообщение
-                last_sent_message = await message.reply_text(msg_with_typos)
-
-                # Небольшая пауза между сообщениями (1-2 сек)
-                if i < len(messages_to_send) - 1:
-                    await asyncio.sleep(random.uniform(1.0, 2.0))
-
-            # 🌍 Редкое исправление (3% шанс) только для последнего сообщения
-            if last_sent_message and needs_fix and human_behavior.should_fix_typo(needs_fix):
-                await asyncio.sleep(random.uniform(1, 2))
-                try:
-                    await last_sent_message.edit_text(messages_to_send[-1] + " *исправил")
-                except Exception:
-                    pass  # Если сообщение нельзя редактировать, пропускаем
+            await learn_from_batch(chat_id, items)
+
+            # В потоковом режиме ответ уже в чате
+            if not STREAM_RESPONSES:
+                # 🌍 Разбиение, паузы "печатает" и опечатки рассчитываются сразу,
+                # а отправка идет в фоне - чат не ждет косметических задержек
+                delivery_scheduler.schedule(
+                    chat_id,
+                    human_behavior.plan_reply(str(response), max_length=200),
+                    send=message.reply_text,
+                    send_typing=lambda: context.bot.send_chat_action(chat_id, action="typing")
+                )
 
         else:
-            # Если ответ None - используем fallback вместо ошибки
-            fallback_responses = FALLBACK_RESPONSES.get('unknown', ["Не уверен... давай ещё раз? 🤔"])
-            fallback = random.choice(fallback_responses)
-            user_name = username or "дружище"
-            fallback = fallback.format(name=user_name)
-
-            # 🌍 Добавляем typing pause и для fallback
-            await human_behavior.typing_pause(context, chat_id, len(fallback))
-            await message.reply_text(fallback)
-            history_manager.add_message(chat_id, "assistant", fallback, context.bot.username or "Assistant")
+            # Если ответ None (ошибка, GLM недоступен) - отвечаем без него вместо ошибки
+            reply_without_glm(chat_id, context, items)
+            await learn_from_batch(chat_id, items)
             
     except Exception as e:
         logger.error(f"Error: {e}")
         await message.reply_text("Что-то пошло не так...")
 
-    params = settings_manager.get_intervention_params(chat_id)
-    if history_manager.should_intervene(chat_id, probability=params['probability'], min_delay=params['min_delay']):
-        # Дополнительная проверка: не спамим чаще чем каждые 5 минут
-        if history_manager.can_send_proactive_message(chat_id, min_interval_seconds=300):
-            history = history_manager.get_history(chat_id)
-            opinion = smart_ai.generate_proactive_hook(history)
-            if opinion:
-                await context.bot.send_message(chat_id=chat_id, text=opinion)
-                history_manager.add_message(chat_id, "assistant", opinion, context.bot.username or "Assistant")
+
+async def send_random_reaction(chat_id: int, context: ContextTypes.DEFAULT_TYPE, message, recent_history: list):
+    """Случайная реакция на сообщение в группе: короткая реплика GLM с паузой "подумать" 3-8 секунд"""
+    started = time.monotonic()
+    messages = [{"role": "system", "content": SYSTEM_PERSONA + "\n\nТы случайно услышал разговор в чате и хочешь коротко прокомментировать или вставить свое слово. Будь естественным, дерзким и уместным. Ответь ОЧЕНЬ коротко (5-15 слов максимум), как будто просто вставляешь реплику в разговор."}]
+    for msg in recent_history:
+        messages.append({"role": msg["role"], "content": msg["content"]})
+
+    try:
+        response = await glm_client.chat_completion(messages, max_tokens=50, temperature=0.9, call_site="random_reaction", chat_id=chat_id)
+        if not response:
+            return
+
+        # Опечатки и "печатает" - как у обычного ответа, а перед первой частью еще пауза "подумать"
+        plan = human_behavior.plan_reply(response, max_length=200)
+        plan[0]['typing'] += max(0.0, random.uniform(3, 8) - (time.monotonic() - started))
+        delivery_scheduler.schedule(
+            chat_id,
+            plan,
+            send=lambda text: context.bot.send_message(
+                chat_id=chat_id, text=text, reply_to_message_id=message.message_id,
+                rate_limit_args=priority(PRIORITY_PROACTIVE)
+            ),
+            send_typing=lambda: context.bot.send_chat_action(chat_id, action="typing")
+        )
+        history_manager.add_message(chat_id, "assistant", response, "Chupapi")
+        logger.info(f"Random reaction in chat {chat_id}: {response[:50]}...")
+    except Exception as e:
+        logger.error(f"Error generating random reaction: {e}")
+
+
+async def learn_from_batch(chat_id: int, items: list):
+    """Настроение и автообучение по сообщениям серии - при любом ответе на нее, с GLM или без"""
+    # 🌍 Обновляем настроение на основе сентимента
+    for item in items:
+        mood_manager.update_mood(chat_id, item['features'].sentiment)
+    for item in items:
+        await auto_learn_facts(item['update'].message, item['features'].reply_text)
+
+
+async def summarize_with_glm(chat_id: int, previous: str, turns: list) -> str:
+    """Сводка старой переписки через GLM (низкий приоритет, быстрая модель)"""
+    lines = "\n".join(f"{m.get('sender', 'Unknown')}: {m.get('content', '')}" for m in turns)
+    prompt = f"""Сожми переписку чата в короткую сводку (3-5 предложений): о чем говорили, кто что сказал, о чем договорились, важные факты и имена. Без вступлений и оценок.
+
+Прежняя сводка:
+{previous or "нет"}
+
+Новые сообщения:
+{lines}
+
+Сводка:"""
+    return await glm_client.chat_completion(
+        [{"role": "user", "content": prompt}],
+        max_tokens=300,
+        temperature=0.3,
+        call_site="summary",
+        chat_id=chat_id
+    )
+
+
+def build_persona_prompt(chat_id: int) -> str:
+    """Начало системного промпта чата: персона, стиль ответов и назначенная роль"""
+    settings = settings_manager.get_chat_settings(chat_id)
+    style = settings.get("response_style", "concise")
+
+    style_instruction = ""
+    if style == "concise":
+        style_instruction = "\nПРАВИЛО: ОТВЕЧАЙ МАКСИМАЛЬНО КРАТКО (1-2 предложения, по существу)."
+    elif style == "full":
+        style_instruction = "\nПРАВИЛО: ОТВЕЧАЙ РАЗВЕРНУТО и подробно, делись деталями."
+
+    custom_persona = settings.get("custom_persona")
+    persona_instruction = ""
+    if custom_persona:
+        persona_instruction = f"\nТЕКУЩАЯ РОЛЬ: Тебе приказали быть: {custom_persona}. На время этого разговора твоя личность меняется. Веди себя, отвечай и шути именно как {custom_persona}."
+
+    return SYSTEM_PROMPT + style_instruction + persona_instruction
+
+
+def reply_without_glm(chat_id: int, context: ContextTypes.DEFAULT_TYPE, items: list) -> dict:
+    """
+    Ответ, когда GLM не ответил или не успел: локальный ответ SmartLocalAI,
+    если он достаточно уверенный, иначе заготовка из FALLBACK_RESPONSES
+    Returns: запись ответа в истории
+    """
+    last = items[-1]
+    message = last['update'].message
+    features = last['features']
+    username = last['username']
+
+    response, confidence = smart_ai.generate_smart_response(
+        features.reply_text, message.from_user.id, username, analysis=features.analysis
+    )
+    if not response or confidence < LOCAL_FALLBACK_MIN_CONFIDENCE:
+        fallback_responses = FALLBACK_RESPONSES.get('unknown', ["Не уверен... давай ещё раз? 🤔"])
+        response = random.choice(fallback_responses).format(name=username or "дружище")
+
+    # 🌍 Добавляем typing pause и для fallback
+    delivery_scheduler.schedule(
+        chat_id,
+        human_behavior.plan_reply(response, typos=False),
+        send=message.reply_text,
+        send_typing=lambda: context.bot.send_chat_action(chat_id, action="typing")
+    )
+    return history_manager.add_message(chat_id, "assistant", response, context.bot.username or "Assistant")
+
+
+async def send_late_reply(chat_id: int, context: ContextTypes.DEFAULT_TYPE, message, fallback_entry, response):
+    """Дослать ответ GLM, не успевший к дедлайну, если после запасного ответа в чате тихо"""
+    history = history_manager.get_history(chat_id)
+    if not response or not history or history[-1] is not fallback_entry:
+        logger.info(f"[DEADLINE] Late reply in chat {chat_id} is no longer relevant, dropped")
+        return
+
+    logger.info(f"[DEADLINE] Sending late reply in chat {chat_id} as a follow-up")
+    history_manager.add_message(chat_id, "assistant", str(response), context.bot.username or "Assistant")
+    delivery_scheduler.schedule(
+        chat_id,
+        human_behavior.plan_reply(str(response), max_length=200),
+        send=message.reply_text,
+        send_typing=lambda: context.bot.send_chat_action(chat_id, action="typing")
+    )
 
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1202,10 +1538,14 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     username = user.username or user.first_name or f"User_{user.id}"
-    user_text = message.text.strip()
+    # Признаки сообщения считаются один раз и передаются всем обработчикам
+    features = MessageFeatures(message.text, smart_ai.analyze, context.bot.username)
+    user_text = features.text
 
     # Всегда добавляем сообщение в историю для контекста
-    history_manager.add_message(chat_id, "user", user_text, username)
+    history_entry = history_manager.add_message(chat_id, "user", user_text, username)
+    if summarizer:
+        summarizer.maybe_schedule(chat_id)
     daily_stats.add_message(chat_id)
     await auto_learn_facts(message, user_text)
 
@@ -1213,18 +1553,11 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     asyncio.create_task(evaluate_message(update, user_text, username, chat_id, user.id))
 
     # Проверяем просьбы о начислении очков (не блокирует дальнейший ответ)
-    rating_request_processed = await check_rating_request(update, user_text, chat_id, user.id, username)
+    rating_request_processed = await check_rating_request(update, features, chat_id, user.id, username)
 
     # Определяем, нужно ли отвечать на сообщение
     should_respond = False
 
-    # Проверяем, обращение ли это к боту с помощью word boundaries
-    import re
-    text_lower = user_text.lower()
-
-    # Варианты обращения к боту
-    bot_names = ['чупапи', 'чупа', 'чупик']
-
     # 1. В личке - отвечаем только @godstress
     if chat_type == 'private':
         if user.username and user.username.lower() == 'godstress':
@@ -1238,17 +1571,16 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
     # 2. Упоминание через @username
-    elif context.bot.username and f"@{context.bot.username}" in text_lower:
+    elif features.mentions_bot:
         should_respond = True
-        user_text = user_text.replace(f"@{context.bot.username}", "").strip()
+        features.strip_bot_mention()
 
     # 3. Обращение по имени - проверяем с word boundaries
     # Ищем имя в начале или с запятой/пробелом
-    elif re.search(r'\b(чупапи|чупа|чупик)(?:\s|,|!|\?|:|$)', text_lower):
+    elif features.addresses_bot:
         should_respond = True
         # Удаляем обращение из начала текста
-        for word in bot_names:
-            user_text = re.sub(rf'\b{word}\b(?:\s+|,\s*)', '', user_text, flags=re.IGNORECASE).strip()
+        features.strip_bot_name()
 
     # 4. Ответ на сообщение бота
     elif message.reply_to_message and message.reply_to_message.from_user.id == context.bot.id:
@@ -1259,44 +1591,27 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # В группах бот иногда реагирует на сообщения (15% шанс)
         if chat_type in ['group', 'supergroup'] and random.random() < 0.15:
             # Проверяем что сообщение достаточно содержательное (не короткое)
-            if len(user_text.split()) >= 5:
-                # Небольшая пауза перед реакцией (от 3 до 8 секунд)
-                await asyncio.sleep(random.uniform(3, 8))
-
-                # Анализируем настроение сообщения и реагируем
-                await message.chat.send_action('typing')
-
-                # Используем небольшую задержку для имитации "думания"
-                pause_duration = await human_behavior.calculate_response_time(user_text)
-                await asyncio.sleep(pause_duration)
-
-                # Генерируем короткую реакцию через GLM
-                recent_history = history_manager.get_history(chat_id, limit=5)
-                messages = [{"role": "system", "content": SYSTEM_PERSONA + "\n\nТы случайно услышал разговор в чате и хочешь коротко прокомментировать или вставить свое слово. Будь естественным, дерзким и уместным. Ответь ОЧЕНЬ коротко (5-15 слов максимум), как будто просто вставляешь реплику в разговор."}]
-
-                for msg in recent_history:
-                    messages.append({"role": msg["role"], "content": msg["content"]})
-
-                try:
-                    response = await glm_client.chat_completion(messages, max_tokens=50, temperature=0.9)
-                    if response:
-                        # Применяем человеческое поведение к реакции
-                        response = await human_behavior.apply_human_behavior(response, mood_manager.get_current_mood())
-
-                        await message.reply_text(response)
-                        history_manager.add_message(chat_id, "assistant", response, "Chupapi")
-                        logger.info(f"Random reaction in chat {chat_id}: {response[:50]}...")
-                except Exception as e:
-                    logger.error(f"Error generating random reaction: {e}")
+            if len(features.words) >= 5:
+                # В очереди чата только решаем и снимаем историю - GLM и паузы идут в фоне,
+                # следующие апдейты чата (упоминания, команды) реакцию не ждут
+                recent_history = list(history_manager.get_history(chat_id, limit=5))
+                task = asyncio.create_task(send_random_reaction(chat_id, context, message, recent_history))
+                background_tasks.add(task)
+                task.add_done_callback(background_tasks.discard)
         return
 
-    if not user_text:
+    if not features.reply_text:
         return
 
-    # Используем блокировку для каждого чата чтобы обрабатывать запросы последовательно
-    async with chat_locks[chat_id]:
-        await message.chat.send_action('typing')
-        await process_message(update, context, user_text, username)
+    # Ответ генерируется в фоне: сообщения, пришедшие следом, попадут в тот же запрос
+    await message.chat.send_action('typing')
+    message_coalescer.submit(chat_id, {
+        'update': update,
+        'context': context,
+        'features': features,
+        'username': username,
+        'history_entry': history_entry
+    })
 
 
 async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1622,10 +1937,12 @@ async def silence_checker_loop(application: Application):
                     ]
                     
                     try:
-                        hook = await glm_client.chat_completion(prompt, max_tokens=100, temperature=0.8)
+                        hook = await glm_client.chat_completion(prompt, max_tokens=100, temperature=0.8, call_site="silence_hook", chat_id=chat_id)
                         if hook:
                             history_manager.add_message(chat_id, "assistant", hook, application.bot.username or "Assistant")
-                            await application.bot.send_message(chat_id=chat_id, text=hook)
+                            await application.bot.send_message(
+                                chat_id=chat_id, text=hook, rate_limit_args=priority(PRIORITY_PROACTIVE)
+                            )
                     except Exception as e:
                         logger.error(f"Error sending silence hook: {e}")
         except Exception as e:
@@ -1633,6 +1950,18 @@ async def silence_checker_loop(application: Application):
             await asyncio.sleep(10)
 
 
+async def knowledge_compaction_loop(application: Application):
+    """Периодически сжимает журнал знаний в полный снимок"""
+    logger.info("Knowledge compaction loop started")
+    while True:
+        try:
+            await asyncio.sleep(KNOWLEDGE_COMPACT_INTERVAL)
+            await knowledge_manager.compact()
+        except Exception as e:
+            logger.error(f"Error in knowledge compaction loop: {e}")
+            await asyncio.sleep(10)
+
+
 async def morning_greeting_scheduler(application: Application):
     """Отправляет утреннее приветствие в 8:00 в стиле Чупапи"""
     logger.info("Morning greeting scheduler started")
@@ -1674,12 +2003,13 @@ async def morning_greeting_scheduler(application: Application):
                 ]
 
                 try:
-                    greeting = await glm_client.chat_completion(prompt, max_tokens=100, temperature=0.9)
+                    greeting = await glm_client.chat_completion(prompt, max_tokens=100, temperature=0.9, call_site="morning_greeting", chat_id=chat_id)
 
                     if greeting:
                         await application.bot.send_message(
                             chat_id=chat_id,
-                            text=greeting
+                            text=greeting,
+                            rate_limit_args=priority(PRIORITY_ANNOUNCEMENT)
                         )
                         logger.info(f"Morning greeting sent to chat {chat_id}")
                     else:
@@ -1687,7 +2017,8 @@ async def morning_greeting_scheduler(application: Application):
                         fallback = "☀️ Доброе утро, пацаны! Выспались? Желаю вам сегодня всё порвать! 🔥"
                         await application.bot.send_message(
                             chat_id=chat_id,
-                            text=fallback
+                            text=fallback,
+                            rate_limit_args=priority(PRIORITY_ANNOUNCEMENT)
                         )
                 except Exception as e:
                     logger.error(f"Error sending morning greeting to chat {chat_id}: {e}")
@@ -1954,9 +2285,21 @@ async def roast_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 Давай, подколи {target_name} в своём стиле!"""
 
-        response = await glm_client.chat_completion_with_history(
-            user_message="Подколи этого чела!",
-            system_prompt=roast_prompt
+        async def send_late(late_response):
+            # Запасной подкол уже в чате - меняем его на настоящий
+            if late_response:
+                await query.edit_message_text(f"🔥 <b>Подкол для {target_name}:</b>\n\n{late_response}")
+
+        _, response = await run_with_deadline(
+            glm_client.chat_completion_with_history(
+                user_message="Подколи этого чела!",
+                system_prompt=roast_prompt,
+                call_site="roast",
+                chat_id=chat_id
+            ),
+            settings_manager.get_deadline(chat_id, "roast", GLM_DEADLINES),
+            on_late=send_late,
+            label=f"roast in chat {chat_id}"
         )
 
         if response:
@@ -2077,7 +2420,7 @@ async def roulette_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Проверяем достижения
     old_rating = new_rating - result
     asyncio.create_task(check_and_unlock_achievements(
-        chat_id, user_id, username, old_rating, new_rating
+        update.get_bot(), chat_id, user_id, username, old_rating, new_rating
     ))
 
 
@@ -2113,6 +2456,10 @@ async def post_init(application: Application):
     # Запускаем планировщик ежедневной статистики
     # Запускаем планировщик ежедневной статистики
     asyncio.create_task(daily_stats_scheduler(application))
+    # Запускаем фоновое сжатие журнала знаний
+    asyncio.create_task(knowledge_compaction_loop(application))
+    # Запускаем фоновое сохранение JSON-менеджеров
+    asyncio.create_task(persistence.run())
     # Запускаем планировщик утреннего приветствия (ОТКЛЮЧЕНО)
     # asyncio.create_task(morning_greeting_scheduler(application))
 
@@ -2139,6 +2486,32 @@ async def post_init(application: Application):
     await application.bot.set_my_commands(commands)
 
 
+async def post_shutdown(application: Application):
+    """Действия при остановке бота (сброс состояния на диск, закрытие соединений)"""
+    await chat_dispatcher.close()
+    await message_coalescer.close()
+    await cancel_late_requests()
+    if summarizer:
+        await summarizer.close()
+        logger.info(f"Conversation summarizer stats: {summarizer.stats()}")
+    await delivery_scheduler.close()
+    knowledge_manager.save_knowledge()
+    await persistence.close()
+    if sqlite_storage:
+        sqlite_storage.close()
+    if glm_client.cache:
+        logger.info(f"GLM cache stats: {glm_client.cache.stats()}")
+    if glm_client.scheduler:
+        logger.info(f"GLM scheduler stats: {glm_client.scheduler.stats()}")
+    logger.info(f"GLM resilience stats: {glm_client.resilience_stats()}")
+    if glm_client.router:
+        logger.info(f"GLM model router stats: {glm_client.router.stats()}")
+    logger.info(f"Prompt segment cache stats: {prompt_cache.stats()}")
+    logger.info(f"Telegram send queue stats: {outbound_limiter.stats()}")
+    logger.info(f"Message coalescing stats: {message_coalescer.stats()}")
+    await glm_client.aclose()
+
+
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик ошибок"""
     logger.error(f"Ошибка: {context.error}")
@@ -2174,41 +2547,52 @@ def main():
         return
 
     # Создаем приложение
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).post_init(post_init).build()
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .concurrent_updates(TELEGRAM_CONCURRENT_UPDATES)
+        .rate_limiter(outbound_limiter)
+        .build()
+    )
+
+    # Апдейты чата обрабатываются по порядку, разные чаты - параллельно
+    in_chat_order = chat_dispatcher.wrap
 
     # Регистрируем обработчики команд
-    application.add_handler(CommandHandler("start", start_command))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("clear", clear_command))
-    application.add_handler(CommandHandler("members", members_command))
-    application.add_handler(CommandHandler("userinfo", userinfo_command))
-    application.add_handler(CommandHandler("stats", stats_command))
-    application.add_handler(CommandHandler("export", export_command))
-    application.add_handler(CommandHandler("search", search_command))
-    application.add_handler(CommandHandler("learn", learn_command))
-    application.add_handler(CommandHandler("forget", forget_command))
-    application.add_handler(CommandHandler("facts", facts_command))
-    application.add_handler(CommandHandler("myinfo", myinfo_command))
-    application.add_handler(CommandHandler("rules", rules_command))
-    application.add_handler(CommandHandler("forget_rule", forget_rule_command))
-    application.add_handler(CommandHandler("settings", settings_command))
-    application.add_handler(CommandHandler("rating", rating_command))
-    application.add_handler(CommandHandler("level", level_command))
-    application.add_handler(CommandHandler("achievements", achievements_command))
-    application.add_handler(CommandHandler("roast", roast_command))
-    application.add_handler(CommandHandler("roulette", roulette_command))
-    application.add_handler(CommandHandler("casino", roulette_command))  # Алиас
-    application.add_handler(CommandHandler("casinostats", casinostats_command))
+    application.add_handler(CommandHandler("start", in_chat_order(start_command)))
+    application.add_handler(CommandHandler("help", in_chat_order(help_command)))
+    application.add_handler(CommandHandler("clear", in_chat_order(clear_command)))
+    application.add_handler(CommandHandler("members", in_chat_order(members_command)))
+    application.add_handler(CommandHandler("userinfo", in_chat_order(userinfo_command)))
+    application.add_handler(CommandHandler("stats", in_chat_order(stats_command)))
+    application.add_handler(CommandHandler("export", in_chat_order(export_command)))
+    application.add_handler(CommandHandler("search", in_chat_order(search_command)))
+    application.add_handler(CommandHandler("learn", in_chat_order(learn_command)))
+    application.add_handler(CommandHandler("forget", in_chat_order(forget_command)))
+    application.add_handler(CommandHandler("facts", in_chat_order(facts_command)))
+    application.add_handler(CommandHandler("myinfo", in_chat_order(myinfo_command)))
+    application.add_handler(CommandHandler("rules", in_chat_order(rules_command)))
+    application.add_handler(CommandHandler("forget_rule", in_chat_order(forget_rule_command)))
+    application.add_handler(CommandHandler("settings", in_chat_order(settings_command)))
+    application.add_handler(CommandHandler("rating", in_chat_order(rating_command)))
+    application.add_handler(CommandHandler("level", in_chat_order(level_command)))
+    application.add_handler(CommandHandler("achievements", in_chat_order(achievements_command)))
+    application.add_handler(CommandHandler("roast", in_chat_order(roast_command)))
+    application.add_handler(CommandHandler("roulette", in_chat_order(roulette_command)))
+    application.add_handler(CommandHandler("casino", in_chat_order(roulette_command)))  # Алиас
+    application.add_handler(CommandHandler("casinostats", in_chat_order(casinostats_command)))
 
     # Обработчики callback'ов с фильтрами по паттернам
-    application.add_handler(CallbackQueryHandler(roast_callback, pattern='^roast_'))
-    application.add_handler(CallbackQueryHandler(settings_callback, pattern='^(set_|toggle_)'))
+    application.add_handler(CallbackQueryHandler(in_chat_order(roast_callback), pattern='^roast_'))
+    application.add_handler(CallbackQueryHandler(in_chat_order(settings_callback), pattern='^(set_|toggle_)'))
 
     # Регистрируем обработчик текстовых сообщений
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, in_chat_order(handle_message)))
     
     # Приветствие новых участников
-    application.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, welcome_new_member))
+    application.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, in_chat_order(welcome_new_member)))
 
     # Регистрируем обработчик ошибок
     application.add_error_handler(error_handler)
@@ -0,0 +1,105 @@
+"""
+Параллельная обработка апдейтов разных чатов со строгим порядком внутри чата
+"""
+import asyncio
+import functools
+import logging
+from typing import Awaitable, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class ChatDispatcher:
+    """Актор на каждый чат: очередь апдейтов и один обработчик
+
+    Telegram-приложение запускается с concurrent_updates, а каждый
+    обработчик оборачивается через wrap(): апдейт кладется в очередь
+    своего чата и обрабатывается воркером этого чата по порядку. Паузы
+    "печатает" и задержки в одном чате не тормозят остальные, а сообщения
+    одного чата по-прежнему обрабатываются строго одно за другим.
+
+    Очередь чата ограничена max_backlog апдейтами - лишние отбрасываются с
+    предупреждением. Воркер живет, пока в очереди есть работа, и вместе с
+    очередью удаляется, когда чат затихает.
+    """
+
+    def __init__(self, max_backlog: int = 20):
+        """
+        Args:
+            max_backlog: Сколько апдейтов может ждать обработки в одном чате
+        """
+        self.max_backlog = max_backlog
+        self.chat_queues: Dict[int, asyncio.Queue] = {}
+        self.workers: Dict[int, asyncio.Task] = {}
+
+    def submit(self, chat_id: int, job: Callable[[], Awaitable]) -> bool:
+        """
+        Поставить задачу в очередь чата
+        Returns: False если очередь чата переполнена и задача отброшена
+        """
+        queue = self.chat_queues.get(chat_id)
+        if queue is None:
+            queue = self.chat_queues[chat_id] = asyncio.Queue(maxsize=self.max_backlog)
+
+        try:
+            queue.put_nowait(job)
+        except asyncio.QueueFull:
+            logger.warning(f"[DISPATCH] Chat {chat_id} backlog is full ({self.max_backlog}), update dropped")
+            return False
+
+        if chat_id not in self.workers:
+            self.workers[chat_id] = asyncio.create_task(self._work(chat_id, queue))
+        return True
+
+    async def run(self, chat_id: int, job: Callable[[], Awaitable]) -> bool:
+        """
+        Выполнить задачу в очереди чата и дождаться ее завершения
+        Returns: False если очередь чата переполнена и задача отброшена
+        """
+        done = asyncio.get_running_loop().create_future()
+
+        async def tracked():
+            try:
+                await job()
+            finally:
+                if not done.done():
+                    done.set_result(None)
+
+        if not self.submit(chat_id, tracked):
+            return False
+        await done
+        return True
+
+    async def _work(self, chat_id: int, queue: asyncio.Queue):
+        """Обработать очередь чата по порядку и завершиться, когда она опустеет"""
+        try:
+            while not queue.empty():
+                job = queue.get_nowait()
+                try:
+                    await job()
+                except Exception as e:
+                    logger.error(f"[DISPATCH] Error in chat {chat_id}: {e}", exc_info=True)
+                finally:
+                    queue.task_done()
+        finally:
+            # Между проверкой пустоты и выходом нет await - новых задач не пропустим
+            del self.workers[chat_id]
+            del self.chat_queues[chat_id]
+
+    def wrap(self, handler: Callable) -> Callable:
+        """Обернуть обработчик python-telegram-bot: апдейты чата идут через его очередь"""
+        @functools.wraps(handler)
+        async def dispatch(update, context):
+            chat = update.effective_chat
+            if chat is None:
+                await handler(update, context)
+                return
+            self.submit(chat.id, lambda: handler(update, context))
+        return dispatch
+
+    async def close(self):
+        """Остановить воркеры (необработанные апдейты отбрасываются)"""
+        workers = list(self.workers.values())
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
@@ -0,0 +1,124 @@
+"""
+Склейка серий сообщений одного чата в один запрос к GLM
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+class MessageCoalescer:
+    """Копит сообщения чата, адресованные боту, и отдает их пачкой
+
+    В группах к боту часто пишут три-четыре короткие строки подряд. Вместо
+    отдельного запроса к GLM на каждую сообщения кладутся в буфер чата, а
+    фоновая задача чата передает обработчику сразу всю пачку:
+
+    - после debounce секунд тишины с последнего сообщения (но не позже
+      max_wait секунд с первого);
+    - всё, что пришло, пока обработчик отвечал на предыдущую пачку,
+      уходит следующей пачкой.
+
+    Пачки одного чата обрабатываются строго по очереди, в пачке - не больше
+    max_batch сообщений. debounce=0 склеивает только сообщения, пришедшие
+    во время ответа.
+    """
+
+    def __init__(self, handler: Callable[[int, List[Any]], Awaitable], debounce: float = 0.7,
+                 max_wait: float = 3.0, max_batch: int = 8):
+        """
+        Args:
+            handler: Обработчик пачки: handler(chat_id, items)
+            debounce: Сколько секунд ждать следующего сообщения серии
+            max_wait: Дольше этого (сек с первого сообщения) пачку не держим
+            max_batch: Максимум сообщений в одной пачке
+        """
+        self.handler = handler
+        self.debounce = debounce
+        self.max_wait = max_wait
+        self.max_batch = max_batch
+
+        self.buffers: Dict[int, List[Any]] = {}  # chat_id -> ждущие сообщения
+        self.tasks: Dict[int, asyncio.Task] = {}
+        self._first_at: Dict[int, float] = {}
+        self._last_at: Dict[int, float] = {}
+
+        # Метрики
+        self.messages = 0
+        self.batches = 0
+
+    def submit(self, chat_id: int, item: Any):
+        """Добавить сообщение в буфер чата"""
+        now = time.monotonic()
+        buffer = self.buffers.setdefault(chat_id, [])
+        if not buffer:
+            self._first_at[chat_id] = now
+        buffer.append(item)
+        self._last_at[chat_id] = now
+        self.messages += 1
+
+        if chat_id not in self.tasks:
+            self.tasks[chat_id] = asyncio.create_task(self._run(chat_id))
+
+    def cancel(self, chat_id: int) -> int:
+        """Забыть неотправленные сообщения чата. Returns: сколько отброшено"""
+        buffer = self.buffers.get(chat_id)
+        if not buffer:
+            return 0
+        dropped = len(buffer)
+        buffer.clear()
+        return dropped
+
+    async def _wait_for_quiet(self, chat_id: int):
+        """Дождаться конца серии: debounce тишины или max_wait с первого сообщения"""
+        while True:
+            now = time.monotonic()
+            deadline = min(self._last_at[chat_id] + self.debounce, self._first_at[chat_id] + self.max_wait)
+            if now >= deadline:
+                return
+            await asyncio.sleep(deadline - now)
+
+    async def _run(self, chat_id: int):
+        try:
+            while True:
+                await self._wait_for_quiet(chat_id)
+                buffer = self.buffers.get(chat_id)
+                if not buffer:
+                    return
+
+                batch = buffer[:self.max_batch]
+                del buffer[:self.max_batch]
+                if buffer:
+                    self._first_at[chat_id] = time.monotonic()
+                self.batches += 1
+                if len(batch) > 1:
+                    logger.info(f"[COALESCE] Chat {chat_id}: {len(batch)} messages in one request")
+
+                try:
+                    await self.handler(chat_id, batch)
+                except Exception as e:
+                    logger.error(f"[COALESCE] Error in chat {chat_id}: {e}", exc_info=True)
+        finally:
+            # Между проверкой буфера и выходом нет await - новых сообщений не пропустим
+            del self.tasks[chat_id]
+            self.buffers.pop(chat_id, None)
+            self._first_at.pop(chat_id, None)
+            self._last_at.pop(chat_id, None)
+
+    def stats(self) -> Dict:
+        """Сколько сообщений пришло и сколько пачек ушло обработчику"""
+        return {
+            "messages": self.messages,
+            "batches": self.batches,
+            "saved_requests": self.messages - self.batches,
+            "pending": sum(len(buffer) for buffer in self.buffers.values()),
+        }
+
+    async def close(self):
+        """Остановить задачи чатов (неотправленные сообщения отбрасываются)"""
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -33,3 +33,163 @@ ALLOWED_CHAT_IDS = [
 DEFAULT_MODEL = os.getenv("GLM_MODEL", "glm-4.6")
 MAX_TOKENS = int(os.getenv("MAX_TOKENS", "2000"))
 TEMPERATURE = float(os.getenv("TEMPERATURE", "0.7"))
+
+# Выбор модели по классу запроса: короткие реплики - быстрой модели, сложные
+# задачи - большой. Уровень из маршрута пропускается, если промпт для него
+# слишком длинный или модель нездорова (больше GLM_ROUTER_MAX_ERROR_RATE ошибок
+# в окне последних запросов либо медианная задержка выше бюджета класса)
+GLM_ROUTER_ENABLED = os.getenv("GLM_ROUTER_ENABLED", "true").lower() in ("1", "true", "yes")
+GLM_MODEL_TIERS = {
+    "fast": os.getenv("GLM_FAST_MODEL", "glm-4-flash"),
+    "large": DEFAULT_MODEL,
+}
+GLM_MODEL_ROUTES = {  # класс запроса -> уровни по предпочтению (остальные - "large")
+    "random_reaction": ("fast", "large"),
+    "silence_hook": ("fast", "large"),
+    "simple_reply": ("fast", "large"),
+    "complex_task": ("large", "fast"),
+    "summary": ("fast", "large"),
+}
+GLM_LATENCY_BUDGETS = {  # класс запроса -> допустимая медианная задержка модели, сек
+    "random_reaction": 3,
+    "silence_hook": 5,
+    "simple_reply": 5,
+    "complex_task": 30,
+    "summary": 10,
+}
+GLM_MAX_PROMPT_CHARS = {  # длиннее - уровень пропускается
+    "fast": int(os.getenv("GLM_FAST_MAX_PROMPT_CHARS", "8000")),
+}
+GLM_ROUTER_MAX_ERROR_RATE = float(os.getenv("GLM_ROUTER_MAX_ERROR_RATE", "0.3"))
+
+# HTTP-клиент GLM: таймауты (сек), пул keep-alive соединений и HTTP/2 (нужен пакет h2)
+GLM_TIMEOUT = float(os.getenv("GLM_TIMEOUT", "60"))
+GLM_CONNECT_TIMEOUT = float(os.getenv("GLM_CONNECT_TIMEOUT", "10"))
+GLM_MAX_CONNECTIONS = int(os.getenv("GLM_MAX_CONNECTIONS", "10"))
+GLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("GLM_MAX_KEEPALIVE_CONNECTIONS", "5"))
+GLM_KEEPALIVE_EXPIRY = float(os.getenv("GLM_KEEPALIVE_EXPIRY", "30"))
+GLM_HTTP2 = os.getenv("GLM_HTTP2", "false").lower() in ("1", "true", "yes")
+
+# Кэш ответов GLM (выключен по умолчанию): лимит размера в байтах и TTL (сек)
+# для каждого места вызова. Места, которых нет в политике, не кэшируются -
+# в том числе обычные ответы на сообщения (process_message)
+GLM_CACHE_ENABLED = os.getenv("GLM_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+GLM_CACHE_MAX_BYTES = int(os.getenv("GLM_CACHE_MAX_BYTES", "1000000"))
+GLM_CACHE_POLICY = {
+    "weather": 6 * 3600,
+    "morning_greeting": 3600,
+    "reminder": 24 * 3600,
+    "roast": 600,
+    "random_reaction": 300,
+}
+
+# Планировщик запросов GLM: одновременно идет не больше limit запросов, limit
+# растет, пока GLM отвечает быстрее GLM_LATENCY_TARGET сек, и падает при ошибках
+# и медленных ответах. Политика: место вызова -> (приоритет, меньше - раньше;
+# сколько секунд запрос может ждать в очереди, None - без ограничения)
+GLM_SCHEDULER_ENABLED = os.getenv("GLM_SCHEDULER_ENABLED", "true").lower() in ("1", "true", "yes")
+GLM_CONCURRENCY_INITIAL = float(os.getenv("GLM_CONCURRENCY_INITIAL", "4"))
+GLM_CONCURRENCY_MIN = float(os.getenv("GLM_CONCURRENCY_MIN", "1"))
+GLM_CONCURRENCY_MAX = float(os.getenv("GLM_CONCURRENCY_MAX", str(GLM_MAX_CONNECTIONS)))
+GLM_LATENCY_TARGET = float(os.getenv("GLM_LATENCY_TARGET", "20"))
+GLM_PRIORITY_POLICY = {
+    "process_message": (0, None),
+    "reminder": (1, 120),
+    "weather": (1, 600),
+    "morning_greeting": (1, 600),
+    "roast": (2, 30),
+    "random_reaction": (3, 15),
+    "silence_hook": (4, 60),
+    "summary": (5, 120),
+}
+
+# Сбои GLM: повторы после 429/5xx и обрывов соединения (пауза растет от
+# GLM_RETRY_BASE_DELAY до GLM_RETRY_MAX_DELAY сек со случайным разбросом),
+# дубль запроса, который идет дольше p95 недавних ответов (выключен по умолчанию),
+# и автомат отключения: после GLM_BREAKER_FAILURES неудач подряд запросы
+# GLM_BREAKER_RESET сек сразу уходят в запасные ответы
+GLM_MAX_RETRIES = int(os.getenv("GLM_MAX_RETRIES", "2"))
+GLM_RETRY_BASE_DELAY = float(os.getenv("GLM_RETRY_BASE_DELAY", "0.5"))
+GLM_RETRY_MAX_DELAY = float(os.getenv("GLM_RETRY_MAX_DELAY", "8"))
+GLM_HEDGE_ENABLED = os.getenv("GLM_HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+GLM_BREAKER_ENABLED = os.getenv("GLM_BREAKER_ENABLED", "true").lower() in ("1", "true", "yes")
+GLM_BREAKER_FAILURES = int(os.getenv("GLM_BREAKER_FAILURES", "5"))
+GLM_BREAKER_RESET = float(os.getenv("GLM_BREAKER_RESET", "30"))
+
+# Сколько секунд ждать GLM, прежде чем ответить без него (локальный ответ или
+# заготовка). Опоздавший ответ GLM досылается, если еще к месту. 0 - ждать сколько
+# угодно. Для отдельного чата можно переопределить в настройках ("deadlines")
+GLM_DEADLINES = {
+    "process_message": float(os.getenv("GLM_DEADLINE_REPLY", "15")),
+    "roast": float(os.getenv("GLM_DEADLINE_ROAST", "20")),
+    "reminder": float(os.getenv("GLM_DEADLINE_REMINDER", "30")),
+}
+# Локальный ответ SmartLocalAI вместо заготовки, если он не менее уверенный
+LOCAL_FALLBACK_MIN_CONFIDENCE = float(os.getenv("LOCAL_FALLBACK_MIN_CONFIDENCE", "0.5"))
+
+# Потоковые ответы: первое сообщение после первого предложения, дальше правки.
+# Выключено по умолчанию - в этом режиме нет пауз "печатает", опечаток и разбиения
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "false").lower() in ("1", "true", "yes")
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))  # сек между правками
+
+# Бюджет промпта ответа в чате (оценка токенов, см. prompt_packer): жесткий
+# лимит входа на запрос и бюджеты секций. При превышении первыми урезаются
+# факты, затем настроение и время, профиль и история; персона и само
+# сообщение не урезаются
+PROMPT_MAX_INPUT_TOKENS = int(os.getenv("PROMPT_MAX_INPUT_TOKENS", "3500"))
+PROMPT_SECTION_BUDGETS = {
+    "mood": 150,
+    "time": 100,
+    "rules": 500,
+    "user": 200,
+    "knowledge": int(os.getenv("PROMPT_KNOWLEDGE_TOKENS", "800")),
+    "history": int(os.getenv("PROMPT_HISTORY_TOKENS", "1200")),
+    "summary": 300,
+}
+PROMPT_HISTORY_CANDIDATES = 20  # Из скольких последних сообщений выбирается история
+PROMPT_HISTORY_KEEP_LAST = 4  # Столько последних сообщений истории - в первую очередь
+
+# Сводка старой переписки: последние SUMMARY_KEEP_RECENT сообщений идут в
+# промпт дословно, а когда более старых набирается SUMMARY_BATCH, они в фоне
+# сжимаются в сводку до SUMMARY_MAX_CHARS символов (GLM с низким приоритетом
+# или, если он выключен либо не ответил, локально) и заменяют собой реплики
+SUMMARY_ENABLED = os.getenv("SUMMARY_ENABLED", "true").lower() in ("1", "true", "yes")
+SUMMARY_USE_GLM = os.getenv("SUMMARY_USE_GLM", "true").lower() in ("1", "true", "yes")
+SUMMARY_KEEP_RECENT = int(os.getenv("SUMMARY_KEEP_RECENT", "8"))
+SUMMARY_BATCH = int(os.getenv("SUMMARY_BATCH", "8"))
+SUMMARY_MAX_CHARS = int(os.getenv("SUMMARY_MAX_CHARS", "800"))
+
+# Хранилище знаний: как часто (в секундах) журнал сжимается в полный снимок
+KNOWLEDGE_COMPACT_INTERVAL = int(os.getenv("KNOWLEDGE_COMPACT_INTERVAL", "300"))
+
+# JSON-менеджеры (рейтинг, участники, настроение, статистика, ачивки, настройки)
+# копят изменения и сбрасывают их на диск раз в указанное число миллисекунд
+PERSISTENCE_FLUSH_INTERVAL_MS = int(os.getenv("PERSISTENCE_FLUSH_INTERVAL_MS", "500"))
+
+# Параллельная обработка апдейтов: сколько апдейтов Telegram обрабатывается
+# одновременно и сколько может ждать в очереди одного чата (внутри чата - по порядку)
+TELEGRAM_CONCURRENT_UPDATES = int(os.getenv("TELEGRAM_CONCURRENT_UPDATES", "64"))
+CHAT_BACKLOG_LIMIT = int(os.getenv("CHAT_BACKLOG_LIMIT", "20"))
+
+# Хранилище рейтинга, участников, ачивок и дневной статистики: "json" или "sqlite".
+# Перед переходом на sqlite перенесите данные: python migrate_to_sqlite.py
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json").lower()
+SQLITE_DB_FILE = os.getenv("SQLITE_DB_FILE", "bot_data.db")
+# Сколько дней хранится активность участников (дневные корзины / сообщения в SQLite)
+MEMBER_MESSAGES_RETENTION_DAYS = int(os.getenv("MEMBER_MESSAGES_RETENTION_DAYS", "90"))
+
+# Исходящие запросы к Telegram: общий лимит на бота (в секунду), лимиты на чат
+# (личный - в секунду, группа - в минуту), сколько сообщений в чат можно подряд
+# и сколько раз повторять запрос после ответа 429 (flood wait)
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+TELEGRAM_PRIVATE_CHAT_RATE = float(os.getenv("TELEGRAM_PRIVATE_CHAT_RATE", "1"))
+TELEGRAM_GROUP_CHAT_PER_MINUTE = float(os.getenv("TELEGRAM_GROUP_CHAT_PER_MINUTE", "20"))
+TELEGRAM_CHAT_BURST = float(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "3"))
+
+# Склейка сообщений: серия сообщений боту подряд уходит в GLM одним запросом.
+# Серия заканчивается после COALESCE_DEBOUNCE_MS тишины (0 - не ждать, склеивать
+# только пришедшее во время ответа), но ждем не дольше COALESCE_MAX_WAIT_MS
+COALESCE_DEBOUNCE_MS = int(os.getenv("COALESCE_DEBOUNCE_MS", "700"))
+COALESCE_MAX_WAIT_MS = int(os.getenv("COALESCE_MAX_WAIT_MS", "3000"))
+COALESCE_MAX_BATCH = int(os.getenv("COALESCE_MAX_BATCH", "8"))
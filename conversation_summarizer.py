@@ -0,0 +1,175 @@
+"""
+Скользящая сводка старой части переписки чата вместо дословных реплик
+"""
+import asyncio
+import logging
+import math
+from collections import Counter
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from relevance_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+
+def extractive_summary(previous: str, turns: List[Dict], max_chars: int = 800,
+                       max_lines: int = 3, max_line_chars: int = 160) -> str:
+    """
+    Локальная сводка без GLM: самые содержательные реплики пачки
+
+    Реплика тем важнее, чем больше в ней слов, частых в этой части
+    разговора (тема), с поправкой на длину. Выбранные реплики дописываются
+    к прежней сводке в порядке разговора; самые старые строки сводки
+    вытесняются, когда она длиннее max_chars.
+    """
+    tokenized = [set(tokenize(turn.get("content", ""))) for turn in turns]
+    frequency = Counter(token for tokens in tokenized for token in tokens)
+
+    scored = []
+    for i, tokens in enumerate(tokenized):
+        if len(tokens) < 3:  # "ок", "ахах", "+" - сводке не нужны
+            continue
+        score = sum(frequency[token] for token in tokens) / math.sqrt(len(tokens))
+        scored.append((score, i))
+    chosen = sorted(i for _, i in sorted(scored, reverse=True)[:max_lines])
+
+    lines = previous.splitlines() if previous else []
+    for i in chosen:
+        text = " ".join(turns[i].get("content", "").split())
+        if len(text) > max_line_chars:
+            text = text[:max_line_chars - 1].rstrip() + "…"
+        lines.append(f"{turns[i].get('sender', 'Unknown')}: {text}")
+
+    while len(lines) > 1 and len("\n".join(lines)) > max_chars:
+        lines.pop(0)
+    return "\n".join(lines)[-max_chars:]
+
+
+class ConversationSummarizer:
+    """Сжимает старые реплики чата в короткую сводку в фоне
+
+    Последние keep_recent сообщений истории всегда идут в промпт дословно.
+    Когда более старых несжатых сообщений набирается batch, фоновая задача
+    чата сжимает их вместе с прежней сводкой: через summarize (обычно GLM с
+    низким приоритетом), а если его нет или он не ответил - локально
+    (extractive_summary). Сжатые сообщения дальше заменяются сводкой (split).
+
+    Сообщения отличаются по seq из HistoryManager. Очистка истории чата
+    (команда, протухание) сбрасывает и сводку; сводка, посчитанная для уже
+    очищенной истории, выбрасывается.
+    """
+
+    def __init__(self, history_manager,
+                 summarize: Optional[Callable[[int, str, List[Dict]], Awaitable[Optional[str]]]] = None,
+                 keep_recent: int = 8, batch: int = 8, max_chars: int = 800):
+        """
+        Args:
+            history_manager: HistoryManager, чью историю сжимаем
+            summarize: summarize(chat_id, прежняя сводка, реплики) -> новая сводка или None
+            keep_recent: Сколько последних сообщений не сжимать
+            batch: Со скольких несжатых старых сообщений начинать сжатие
+            max_chars: Максимальная длина сводки
+        """
+        self.history_manager = history_manager
+        self.summarize = summarize
+        self.keep_recent = keep_recent
+        self.batch = batch
+        self.max_chars = max_chars
+
+        self.summaries: Dict[int, str] = {}  # chat_id -> сводка
+        self.summarized_upto: Dict[int, int] = {}  # chat_id -> seq последнего сжатого сообщения
+        self.tasks: Dict[int, asyncio.Task] = {}
+        self._generation: Dict[int, int] = {}  # Растет при каждой очистке истории чата
+
+        history_manager.add_clear_listener(self.reset)
+
+        # Метрики
+        self.runs = 0
+        self.glm_summaries = 0
+        self.local_summaries = 0
+        self.turns_summarized = 0
+
+    def _pending(self, chat_id: int) -> List[Dict]:
+        """Несжатые сообщения старше keep_recent последних"""
+        upto = self.summarized_upto.get(chat_id, 0)
+        fresh = [m for m in self.history_manager.get_history(chat_id) if m.get("seq", 0) > upto]
+        return fresh[:-self.keep_recent] if self.keep_recent else fresh
+
+    def maybe_schedule(self, chat_id: int):
+        """Запустить сжатие, если старых несжатых сообщений набралось на пачку"""
+        task = self.tasks.get(chat_id)
+        if task is not None and not task.done():
+            return
+        if len(self._pending(chat_id)) >= self.batch:
+            self.tasks[chat_id] = asyncio.create_task(self._run(chat_id))
+
+    async def _run(self, chat_id: int):
+        try:
+            while True:
+                turns = self._pending(chat_id)
+                if len(turns) < self.batch:
+                    return
+                generation = self._generation.get(chat_id, 0)
+                previous = self.summaries.get(chat_id, "")
+                summary = await self._summarize(chat_id, previous, turns)
+                if self._generation.get(chat_id, 0) != generation:
+                    return  # История очищена, пока считали сводку
+
+                self.summaries[chat_id] = summary
+                self.summarized_upto[chat_id] = turns[-1].get("seq", 0)
+                self.runs += 1
+                self.turns_summarized += len(turns)
+                logger.info(f"[SUMMARY] Chat {chat_id}: {len(turns)} old messages -> {len(summary)} chars summary")
+        except Exception as e:
+            logger.error(f"[SUMMARY] Error summarizing chat {chat_id}: {e}", exc_info=True)
+        finally:
+            if self.tasks.get(chat_id) is asyncio.current_task():
+                del self.tasks[chat_id]
+
+    async def _summarize(self, chat_id: int, previous: str, turns: List[Dict]) -> str:
+        if self.summarize is not None:
+            try:
+                summary = await self.summarize(chat_id, previous, turns)
+            except Exception as e:
+                logger.warning(f"[SUMMARY] GLM summary failed for chat {chat_id}: {e}")
+                summary = None
+            if summary:
+                self.glm_summaries += 1
+                return summary.strip()[:self.max_chars]
+        self.local_summaries += 1
+        return extractive_summary(previous, turns, self.max_chars)
+
+    def split(self, chat_id: int, history: List[Dict]) -> Tuple[str, List[Dict]]:
+        """
+        Сводка и сообщения, которые она не покрывает
+
+        Returns:
+            (сводка или "", сообщения history новее сжатых)
+        """
+        upto = self.summarized_upto.get(chat_id)
+        if upto is None:
+            return "", history
+        return self.summaries.get(chat_id, ""), [m for m in history if m.get("seq", 0) > upto]
+
+    def reset(self, chat_id: int):
+        """Забыть сводку чата (история очищена)"""
+        self._generation[chat_id] = self._generation.get(chat_id, 0) + 1
+        self.summaries.pop(chat_id, None)
+        self.summarized_upto.pop(chat_id, None)
+
+    def stats(self) -> Dict:
+        return {
+            "chats": len(self.summaries),
+            "runs": self.runs,
+            "glm": self.glm_summaries,
+            "local": self.local_summaries,
+            "turns_summarized": self.turns_summarized,
+        }
+
+    async def close(self):
+        """Остановить фоновые задачи сжатия"""
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.tasks.clear()
@@ -6,18 +6,24 @@ import os
 from datetime import datetime
 from typing import Dict, List
 
+from persistence import write_json_atomic
+
 
 class DailyStatsManager:
     """Управляет ежедневной статистикой чатов"""
 
-    def __init__(self, stats_file: str = "daily_stats.json"):
+    def __init__(self, stats_file: str = "daily_stats.json", persistence=None):
         """
         Args:
             stats_file: Путь к файлу со статистикой
+            persistence: PersistenceService для отложенного сохранения (без него - сразу на диск)
         """
         self.stats_file = stats_file
         self.stats: Dict[int, Dict] = {}  # chat_id -> {date: stats_data}
+        self.persistence = persistence
         self.load_stats()
+        if persistence:
+            persistence.register(self.stats_file, self._snapshot_data)
 
     def load_stats(self):
         """Загрузить статистику из файла"""
@@ -35,13 +41,18 @@ class DailyStatsManager:
 
     def save_stats(self):
         """Сохранить статистику в файл"""
+        if self.persistence:
+            self.persistence.mark_dirty(self.stats_file)
+            return
         try:
-            data = {str(chat_id): chat_stats for chat_id, chat_stats in self.stats.items()}
-            with open(self.stats_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            write_json_atomic(self.stats_file, self._snapshot_data())
         except Exception as e:
             print(f"Error saving daily stats: {e}")
 
+    def _snapshot_data(self) -> Dict:
+        """Данные для записи в файл"""
+        return {str(chat_id): chat_stats for chat_id, chat_stats in self.stats.items()}
+
     def get_today_key(self) -> str:
         """Получить ключ дня в формате YYYY-MM-DD"""
         return datetime.now().strftime("%Y-%m-%d")
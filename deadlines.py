@@ -0,0 +1,76 @@
+"""
+Ограничение времени ожидания ответа GLM с досылкой опоздавшего результата
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Запросы, которые продолжают работать после дедлайна (чтобы их не собрал сборщик мусора)
+_late_tasks: Set[asyncio.Task] = set()
+
+
+async def run_with_deadline(
+    request: Awaitable,
+    deadline: Optional[float],
+    on_late: Optional[Callable[[Any], Awaitable]] = None,
+    label: str = "request"
+) -> Tuple[bool, Any]:
+    """
+    Дождаться запроса, но не дольше deadline секунд
+
+    Если запрос не успел, он не отменяется: работает дальше в фоне (его
+    результат, например, попадет в кэш GLM), а по завершении вызывается
+    on_late(результат) - вызывающий код решает, досылать ли его.
+
+    Args:
+        request: Корутина запроса (например, glm_client.chat_completion)
+        deadline: Сколько секунд ждать (None или 0 - без ограничения)
+        on_late: Что сделать с результатом, пришедшим после дедлайна
+        label: Имя запроса для логов
+
+    Returns:
+        (успел ли запрос, результат или None)
+    """
+    if not deadline:
+        return True, await request
+
+    task = asyncio.ensure_future(request)
+    done, _ = await asyncio.wait({task}, timeout=deadline)
+    if done:
+        return True, task.result()
+
+    logger.info(f"[DEADLINE] {label} did not finish in {deadline:.0f}s, answering without it")
+    _late_tasks.add(task)
+    task.add_done_callback(lambda t: _finish_late(t, on_late, label))
+    return False, None
+
+
+def _finish_late(task: asyncio.Task, on_late: Optional[Callable[[Any], Awaitable]], label: str):
+    _late_tasks.discard(task)
+    if task.cancelled():
+        return
+    if task.exception() is not None:
+        logger.error(f"[DEADLINE] Late {label} failed: {task.exception()}")
+        return
+    if on_late is None:
+        return
+
+    async def deliver():
+        try:
+            await on_late(task.result())
+        except Exception as e:
+            logger.error(f"[DEADLINE] Error handling late {label}: {e}", exc_info=True)
+
+    follow_up = asyncio.ensure_future(deliver())
+    _late_tasks.add(follow_up)
+    follow_up.add_done_callback(_late_tasks.discard)
+
+
+async def cancel_late_requests():
+    """Отменить запросы и досылки, оставшиеся после дедлайнов (при остановке бота)"""
+    tasks = list(_late_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,128 @@
+"""
+Отложенная отправка многочастных "человеческих" ответов
+"""
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class DeliveryScheduler:
+    """Отправляет заранее рассчитанный план ответа по таймеру, не держа чат
+
+    Обработчик сообщения строит план (HumanBehavior.plan_reply) и сразу
+    возвращается, а части ответа с паузами "печатает" отправляет фоновая
+    задача чата. Следующее сообщение того же чата обрабатывается, не
+    дожидаясь косметических задержек.
+
+    Если в чат приходит новый план, пока старый еще отправляется, планы
+    сливаются: оставшиеся части старого уходят сразу, без пауз, а за ними
+    по своему расписанию идет новый. cancel() отменяет неотправленные части.
+    """
+
+    def __init__(self):
+        self.plans: Dict[int, Deque[Dict]] = {}  # chat_id -> неотправленные части
+        self.tasks: Dict[int, asyncio.Task] = {}
+        self._hurry: Dict[int, asyncio.Event] = {}  # Прервать текущую паузу чата
+
+    def schedule(self, chat_id: int, plan: List[Dict],
+                 send: Callable[[str], Awaitable], send_typing: Callable[[], Awaitable]):
+        """
+        Запланировать отправку частей ответа
+
+        Args:
+            chat_id: ID чата
+            plan: Части ответа (см. HumanBehavior.plan_reply)
+            send: Отправка текста, возвращает отправленное сообщение
+            send_typing: Отправка индикатора "печатает"
+        """
+        parts = [dict(part, send=send, send_typing=send_typing) for part in plan]
+
+        pending = self.plans.get(chat_id)
+        if pending is not None:
+            # Слияние: недоотправленный ответ досылаем без пауз
+            for part in pending:
+                part['typing'] = part['pause'] = 0.0
+                part['fix'] = None
+            pending.extend(parts)
+            self._hurry[chat_id].set()
+            return
+
+        self.plans[chat_id] = deque(parts)
+        self._hurry[chat_id] = asyncio.Event()
+        self.tasks[chat_id] = asyncio.create_task(self._deliver(chat_id))
+
+    def cancel(self, chat_id: int) -> int:
+        """Отменить неотправленные части ответа. Returns: сколько частей отменено"""
+        # Сразу забываем план: новый schedule() того же чата начнет свой, а не сольется с отмененным
+        task = self.tasks.pop(chat_id, None)
+        if task is None:
+            return 0
+        dropped = len(self.plans.pop(chat_id))
+        self._hurry.pop(chat_id)
+        task.cancel()
+        return dropped
+
+    def is_pending(self, chat_id: int) -> bool:
+        return chat_id in self.tasks
+
+    @staticmethod
+    async def _pause(hurry: asyncio.Event, seconds: float):
+        """Подождать, но проснуться раньше, если план чата слили с новым"""
+        if seconds <= 0:
+            return
+        try:
+            await asyncio.wait_for(hurry.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _deliver(self, chat_id: int):
+        parts = self.plans[chat_id]
+        hurry = self._hurry[chat_id]
+        try:
+            while parts:
+                # Флаг слияния относится к уже отправленным частям
+                hurry.clear()
+                part = parts[0]
+                if part['typing'] > 0:
+                    try:
+                        await part['send_typing']()
+                    except Exception:
+                        pass  # Без индикатора просто ждем
+                    await self._pause(hurry, part['typing'])
+
+                parts.popleft()
+                try:
+                    sent: Optional[object] = await part['send'](part['text'])
+                except Exception as e:
+                    # Одна неотправленная часть не должна терять остальные (и слитый с ней новый ответ)
+                    logger.error(f"[DELIVERY] Error sending reply part in chat {chat_id}: {e}")
+                    continue
+
+                if part['fix'] and sent is not None:
+                    await self._pause(hurry, part['fix_delay'])
+                    try:
+                        await sent.edit_text(part['fix'])
+                    except Exception:
+                        pass  # Если сообщение нельзя редактировать, пропускаем
+
+                await self._pause(hurry, part['pause'])
+        except asyncio.CancelledError:
+            logger.info(f"[DELIVERY] Pending reply in chat {chat_id} cancelled ({len(parts)} parts)")
+        except Exception as e:
+            logger.error(f"[DELIVERY] Error delivering reply in chat {chat_id}: {e}")
+        finally:
+            # После cancel() чат мог уже получить новый план - его записи не трогаем
+            if self.tasks.get(chat_id) is asyncio.current_task():
+                del self.plans[chat_id]
+                del self.tasks[chat_id]
+                del self._hurry[chat_id]
+
+    async def close(self):
+        """Отменить все неотправленные ответы"""
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -1,13 +1,61 @@
+import asyncio
 import httpx
+import importlib.util
+import json
 import logging
-from typing import List, Dict, Optional
+import time
+from typing import AsyncIterator, List, Dict, Optional
+
+from glm_resilience import CircuitBreaker, LatencyTracker, is_overload, is_retryable, parse_retry_after, retry_delay
+from glm_scheduler import GLMScheduler
+from model_router import ModelRouter
+from response_cache import ResponseCache, make_key
 
 logger = logging.getLogger(__name__)
 
 class GLMClient:
-    """Клиент для работы с GLM API (ZhipuAI / ChatGLM)"""
+    """Клиент для работы с GLM API (ZhipuAI / ChatGLM)
+
+    Держит одно долгоживущее соединение (пул keep-alive) на весь срок
+    работы бота, чтобы не платить за TCP+TLS рукопожатие на каждый ответ.
+    Перед остановкой нужно вызвать aclose().
+
+    С планировщиком (scheduler) запросы ждут слот по приоритету места
+    вызова; запрос, отброшенный планировщиком, возвращает None, как ошибка.
+
+    Сбои провайдера: 429/5xx и обрывы соединения повторяются до max_retries
+    раз с экспоненциальной паузой со случайным разбросом (или Retry-After).
+    С hedge=True запрос, который идет дольше hedge_quantile (p95) недавних
+    ответов, дублируется, и берется первый ответ. Автомат отключения
+    (breaker) после серии неудач сразу возвращает None, пока провайдер не
+    оживет, - вызывающий код отвечает своим запасным вариантом без ожидания.
 
-    def __init__(self, api_key: str, api_url: str, model: str = "glm-4"):
+    С маршрутизатором (router) модель выбирается для каждого запроса по его
+    классу (request_class, по умолчанию call_site), длине промпта и недавним
+    задержкам и ошибкам моделей; без него все запросы идут на model.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        api_url: str,
+        model: str = "glm-4",
+        timeout: float = 60.0,
+        connect_timeout: float = 10.0,
+        max_connections: int = 10,
+        max_keepalive_connections: int = 5,
+        keepalive_expiry: float = 30.0,
+        http2: bool = False,
+        cache: Optional[ResponseCache] = None,
+        scheduler: Optional[GLMScheduler] = None,
+        max_retries: int = 2,
+        retry_base_delay: float = 0.5,
+        retry_max_delay: float = 8.0,
+        hedge: bool = False,
+        hedge_quantile: float = 0.95,
+        breaker: Optional[CircuitBreaker] = None,
+        router: Optional[ModelRouter] = None
+    ):
         self.api_key = api_key
         self.api_url = api_url
         self.model = model
@@ -15,13 +63,70 @@ class GLMClient:
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json"
         }
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+
+        # HTTP/2 в httpx требует пакет h2 - без него остаемся на HTTP/1.1
+        if http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("HTTP/2 для GLM API недоступен (нет пакета h2), используем HTTP/1.1")
+            http2 = False
+        self.http2 = http2
+
+        self._client: Optional[httpx.AsyncClient] = None
+
+        # Кэш ответов (опционально) - используется только для call_site из его политики
+        self.cache = cache
+        # Планировщик (опционально) - лимит одновременных запросов и приоритеты call_site
+        self.scheduler = scheduler
+
+        # Повторы, хеджирование и автомат отключения
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.breaker = breaker
+        self.latency = LatencyTracker()
+        self.retries = 0
+        self.hedged = 0
+
+        # Маршрутизатор моделей (опционально) - быстрая модель для коротких реплик
+        self.router = router
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Общий клиент с пулом соединений (создается при первом запросе)"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=self._timeout(self.timeout),
+                limits=self.limits,
+                http2=self.http2
+            )
+        return self._client
+
+    def _timeout(self, total: float) -> httpx.Timeout:
+        return httpx.Timeout(total, connect=min(self.connect_timeout, total))
+
+    async def aclose(self):
+        """Закрыть пул соединений"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
 
     async def chat_completion(
         self,
         messages: List[Dict[str, str]],
         max_tokens: int = 2000,
         temperature: float = 0.7,
-        stream: bool = False
+        stream: bool = False,
+        timeout: Optional[float] = None,
+        call_site: Optional[str] = None,
+        chat_id: Optional[int] = None,
+        request_class: Optional[str] = None
     ) -> Optional[str]:
         """
         Отправить запрос к GLM API
@@ -30,72 +135,337 @@ class GLMClient:
             messages: Список сообщений в формате [{"role": "user", "content": "..."}]
             max_tokens: Максимальное количество токенов в ответе
             temperature: Температура (креативность) от 0 до 1
-            stream: Потоковая передача ответа
+            stream: Потоковая передача ответа (куски собираются в одну строку,
+                для получения по мере генерации есть stream_chat_completion)
+            timeout: Таймаут запроса в секундах (по умолчанию self.timeout)
+            call_site: Откуда вызван запрос (например "weather") - по нему
+                кэш решает, можно ли вернуть сохраненный ответ, а планировщик
+                выбирает приоритет
+            chat_id: Для какого чата запрос (доля чата в очереди планировщика)
+            request_class: Класс запроса для выбора модели (simple_reply,
+                complex_task; по умолчанию call_site)
 
         Returns:
             Текст ответа или None в случае ошибки
         """
+        model = self._model_for(request_class or call_site, messages)
+        ttl = self.cache.ttl_for(call_site) if self.cache else 0
+        if not ttl:
+            return await self._chat_completion(
+                messages, max_tokens, temperature, stream, timeout, call_site, chat_id, model)
+
+        key = make_key(model, messages, temperature, max_tokens)
+        cached = self.cache.get(key, call_site)
+        if cached is not None:
+            logger.info(f"GLM cache hit ({call_site})")
+            return cached
+
+        content = await self._chat_completion(
+            messages, max_tokens, temperature, stream, timeout, call_site, chat_id, model)
+        if content:
+            self.cache.put(key, content, ttl)
+        return content
+
+    async def _chat_completion(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int,
+        temperature: float,
+        stream: bool,
+        timeout: Optional[float],
+        call_site: Optional[str] = None,
+        chat_id: Optional[int] = None,
+        model: Optional[str] = None
+    ) -> Optional[str]:
+        if stream:
+            chunks = [delta async for delta in self.stream_chat_completion(
+                messages, max_tokens=max_tokens, temperature=temperature, timeout=timeout,
+                call_site=call_site, chat_id=chat_id, model=model
+            )]
+            content = "".join(chunks).strip()
+            return content if content else None
+
         payload = {
-            "model": self.model,
+            "model": model or self.model,
             "messages": messages,
             "max_tokens": max_tokens,
             "temperature": temperature,
             "stream": stream
         }
 
+        if not self._breaker_allows():
+            return None
+        started = await self._acquire(call_site, chat_id)
+        if started is False:
+            return None
+
+        ok = overload = False
         try:
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                logger.info(f"GLM API request to {self.api_url}")
-                response = await client.post(
-                    self.api_url,
-                    headers=self.headers,
-                    json=payload
-                )
-                logger.info(f"GLM API response status: {response.status_code}")
-                response.raise_for_status()
-
-                response_text = response.text
-                logger.info(f"GLM API raw response: {response_text[:500]}")
-
-                data = response.json()
-                logger.info(f"GLM API parsed response: {data}")
-
-                # Проверяем структуру ответа
-                if "choices" in data and len(data["choices"]) > 0:
-                    message = data["choices"][0]["message"]
-                    # Берем ТОЛЬКО actual content, не reasoning_content
-                    content = message.get("content", "").strip()
-
-                    logger.info(f"GLM API returned content length: {len(content)} chars")
-                    return content if content else None
-
-                logger.warning(f"GLM API response has no choices: {data}")
-                return None
+            response = await self._post_resilient(payload, timeout or self.timeout)
+
+            response_text = response.text
+            logger.info(f"GLM API raw response: {response_text[:500]}")
+
+            data = response.json()
+            logger.info(f"GLM API parsed response: {data}")
+            ok = True
+
+            # Проверяем структуру ответа
+            if "choices" in data and len(data["choices"]) > 0:
+                message = data["choices"][0]["message"]
+                # Берем ТОЛЬКО actual content, не reasoning_content
+                content = message.get("content", "").strip()
+
+                logger.info(f"GLM API returned content length: {len(content)} chars")
+                return content if content else None
+
+            logger.warning(f"GLM API response has no choices: {data}")
+            return None
 
         except httpx.HTTPStatusError as e:
             logger.error(f"HTTP ошибка: {e.response.status_code} - {e.response.text}")
+            overload = is_overload(e)
             return None
         except Exception as e:
             logger.error(f"Ошибка при запросе к GLM API: {e}", exc_info=True)
+            overload = is_overload(e)
             return None
+        finally:
+            self._release(started, ok, chat_id, overload)
 
-    async def chat_completion_with_history(
+    async def _post(self, payload: Dict, timeout: float) -> httpx.Response:
+        """Один POST к GLM API (ошибка HTTP - исключение)"""
+        start = time.monotonic()
+        logger.info(f"GLM API request to {self.api_url} ({payload['model']})")
+        try:
+            response = await self._get_client().post(
+                self.api_url,
+                headers=self.headers,
+                json=payload,
+                timeout=self._timeout(timeout)
+            )
+            logger.info(f"GLM API response status: {response.status_code}")
+            response.raise_for_status()
+        except Exception:
+            self._record_model(payload["model"], time.monotonic() - start, False)
+            raise
+        self.latency.record(time.monotonic() - start)
+        self._record_model(payload["model"], time.monotonic() - start, True)
+        return response
+
+    async def _post_hedged(self, payload: Dict, timeout: float) -> httpx.Response:
+        """POST, который дублируется, если ответ задерживается дольше обычного"""
+        latency = self.router.latency_for(payload["model"]) if self.router else self.latency
+        hedge_after = latency.percentile(self.hedge_quantile) if self.hedge else None
+        tasks = {asyncio.ensure_future(self._post(payload, timeout))}
+        try:
+            if hedge_after is None:
+                return await next(iter(tasks))
+
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if not done:
+                self.hedged += 1
+                logger.info(f"GLM API response is slower than usual ({hedge_after:.1f}s), sending a duplicate request")
+                tasks.add(asyncio.ensure_future(self._post(payload, timeout)))
+
+            # Первый успешный ответ; ошибка - только если упали оба запроса
+            error = None
+            pending = tasks
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _post_resilient(self, payload: Dict, timeout: float) -> httpx.Response:
+        """
+        POST с хеджированием и повторами после сбоев провайдера
+        Raises: последняя ошибка, если запрос так и не удался
+        """
+        attempt = 0
+        while True:
+            try:
+                response = await self._post_hedged(payload, timeout)
+            except Exception as e:
+                await self._wait_before_retry(e, attempt)
+                attempt += 1
+                continue
+            if self.breaker:
+                self.breaker.record_success()
+            return response
+
+    async def _wait_before_retry(self, error: Exception, attempt: int):
+        """
+        Пауза перед повтором запроса после ошибки
+        Raises: error, если ее не повторяют или попытки кончились
+        """
+        retryable = is_retryable(error)
+        if not retryable or attempt >= self.max_retries:
+            # Автомат считает только признаки недоступности провайдера, не ошибки запроса
+            if self.breaker and (retryable or isinstance(error, httpx.TimeoutException)):
+                self.breaker.record_failure()
+            raise error
+
+        retry_after = parse_retry_after(error.response) if isinstance(error, httpx.HTTPStatusError) else None
+        delay = retry_delay(attempt, self.retry_base_delay, self.retry_max_delay, retry_after)
+        self.retries += 1
+        reason = f"HTTP {error.response.status_code}" if isinstance(error, httpx.HTTPStatusError) else type(error).__name__
+        logger.warning(f"GLM API error ({reason}), retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+        await asyncio.sleep(delay)
+
+    def _breaker_allows(self) -> bool:
+        if self.breaker is None or self.breaker.allow():
+            return True
+        logger.warning("GLM API is unavailable (circuit open), failing fast")
+        return False
+
+    def _model_for(self, request_class: Optional[str], messages: List[Dict[str, str]]) -> str:
+        """Модель для запроса: выбор маршрутизатора или self.model"""
+        if self.router is None:
+            return self.model
+        prompt_chars = sum(len(m.get("content") or "") for m in messages)
+        return self.router.choose(request_class, prompt_chars)
+
+    def _record_model(self, model: str, seconds: float, ok: bool):
+        if self.router:
+            self.router.record(model, seconds, ok)
+
+    def resilience_stats(self) -> Dict:
+        """Повторы, хеджирование, p95 ответа и состояние автомата отключения"""
+        p95 = self.latency.percentile(0.95)
+        return {
+            "retries": self.retries,
+            "hedged": self.hedged,
+            "p95": round(p95, 2) if p95 is not None else None,
+            "breaker": self.breaker.stats() if self.breaker else None,
+        }
+
+    async def _acquire(self, call_site: Optional[str], chat_id: Optional[int]):
+        """Слот планировщика: время начала, None без планировщика, False если запрос отброшен"""
+        if self.scheduler is None:
+            return None
+        started = await self.scheduler.acquire(call_site, chat_id)
+        return False if started is None else started
+
+    def _release(self, started, ok: bool, chat_id: Optional[int], overload: bool = False):
+        if started is not None:
+            self.scheduler.release(started, ok, chat_id, overload)
+
+    async def stream_chat_completion(
         self,
-        user_message: str,
-        chat_history: List[Dict[str, str]] = None,
-        system_prompt: str = None
-    ) -> Optional[str]:
+        messages: List[Dict[str, str]],
+        max_tokens: int = 2000,
+        temperature: float = 0.7,
+        timeout: Optional[float] = None,
+        call_site: Optional[str] = None,
+        chat_id: Optional[int] = None,
+        request_class: Optional[str] = None,
+        model: Optional[str] = None
+    ) -> AsyncIterator[str]:
         """
-        Отправить запрос с историей диалога
+        Потоковый запрос к GLM API (Server-Sent Events)
+
+        Отдает куски текста ответа по мере генерации. При ошибке пишет в лог
+        и просто завершается - вызывающий код видит это по пустому ответу.
 
         Args:
-            user_message: Сообщение от пользователя
-            chat_history: История предыдущих сообщений
-            system_prompt: Системный промпт для настройки поведения
+            messages: Список сообщений в формате [{"role": "user", "content": "..."}]
+            max_tokens: Максимальное количество токенов в ответе
+            temperature: Температура (креативность) от 0 до 1
+            timeout: Таймаут в секундах на соединение и на паузу между кусками
+            call_site: Откуда вызван запрос (приоритет в планировщике)
+            chat_id: Для какого чата запрос (доля чата в очереди планировщика)
+            request_class: Класс запроса для выбора модели (по умолчанию call_site)
+            model: Модель, если уже выбрана (иначе выбирает маршрутизатор)
 
-        Returns:
-            Текст ответа или None в случае ошибки
+        Yields:
+            Очередной кусок текста ответа
         """
+        payload = {
+            "model": model or self._model_for(request_class or call_site, messages),
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "stream": True
+        }
+
+        if not self._breaker_allows():
+            return
+        started = await self._acquire(call_site, chat_id)
+        if started is False:
+            return
+
+        ok = overload = False
+        try:
+            attempt = 0
+            while True:
+                yielded = False
+                start = time.monotonic()
+                try:
+                    logger.info(f"GLM API stream request to {self.api_url} ({payload['model']})")
+                    async with self._get_client().stream(
+                        "POST",
+                        self.api_url,
+                        headers=self.headers,
+                        json=payload,
+                        timeout=self._timeout(timeout or self.timeout)
+                    ) as response:
+                        if response.status_code >= 400:
+                            await response.aread()
+                        response.raise_for_status()
+
+                        async for line in response.aiter_lines():
+                            # Строки SSE: "data: {...}", пустые строки разделяют события
+                            if not line.startswith("data:"):
+                                continue
+                            data = line[len("data:"):].strip()
+                            if data == "[DONE]":
+                                break
+
+                            chunk = json.loads(data)
+                            choices = chunk.get("choices") or []
+                            if not choices:
+                                continue
+                            # Берем ТОЛЬКО actual content, не reasoning_content
+                            delta = (choices[0].get("delta") or {}).get("content")
+                            if delta:
+                                yielded = True
+                                yield delta
+                    self._record_model(payload["model"], time.monotonic() - start, True)
+                    break
+                except Exception as e:
+                    self._record_model(payload["model"], time.monotonic() - start, False)
+                    # Часть ответа уже в чате - повтор начал бы его заново
+                    if yielded:
+                        raise
+                    await self._wait_before_retry(e, attempt)
+                    attempt += 1
+
+            ok = True
+            if self.breaker:
+                self.breaker.record_success()
+
+        except httpx.HTTPStatusError as e:
+            logger.error(f"HTTP ошибка: {e.response.status_code} - {e.response.text}")
+            overload = is_overload(e)
+        except Exception as e:
+            logger.error(f"Ошибка при потоковом запросе к GLM API: {e}", exc_info=True)
+            overload = is_overload(e)
+        finally:
+            self._release(started, ok, chat_id, overload)
+
+    def _build_messages(
+        self,
+        user_message: str,
+        chat_history: List[Dict[str, str]] = None,
+        system_prompt: str = None
+    ) -> List[Dict[str, str]]:
+        """Собрать список сообщений: системный промпт, история, текущее сообщение"""
         messages = []
 
         # Добавляем системный промпт если указан
@@ -109,13 +479,59 @@ class GLMClient:
         # Добавляем текущее сообщение
         messages.append({"role": "user", "content": user_message})
 
-        return await self.chat_completion(messages)
+        return messages
+
+    async def chat_completion_with_history(
+        self,
+        user_message: str,
+        chat_history: List[Dict[str, str]] = None,
+        system_prompt: str = None,
+        call_site: Optional[str] = None,
+        chat_id: Optional[int] = None,
+        request_class: Optional[str] = None
+    ) -> Optional[str]:
+        """
+        Отправить запрос с историей диалога
+
+        Args:
+            user_message: Сообщение от пользователя
+            chat_history: История предыдущих сообщений
+            system_prompt: Системный промпт для настройки поведения
+            call_site: Откуда вызван запрос (см. chat_completion)
+            chat_id: Для какого чата запрос (см. chat_completion)
+            request_class: Класс запроса для выбора модели (см. chat_completion)
+
+        Returns:
+            Текст ответа или None в случае ошибки
+        """
+        return await self.chat_completion(
+            self._build_messages(user_message, chat_history, system_prompt),
+            call_site=call_site,
+            chat_id=chat_id,
+            request_class=request_class
+        )
+
+    def stream_completion_with_history(
+        self,
+        user_message: str,
+        chat_history: List[Dict[str, str]] = None,
+        system_prompt: str = None,
+        call_site: Optional[str] = None,
+        chat_id: Optional[int] = None,
+        request_class: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """Потоковый вариант chat_completion_with_history (куски текста по мере генерации)"""
+        return self.stream_chat_completion(
+            self._build_messages(user_message, chat_history, system_prompt),
+            call_site=call_site, chat_id=chat_id, request_class=request_class
+        )
 
     async def web_search(
         self,
         query: str,
         max_tokens: int = 2000,
-        temperature: float = 0.7
+        temperature: float = 0.7,
+        timeout: float = 120.0
     ) -> Optional[str]:
         """
         Веб-поиск через GLM API
@@ -124,6 +540,7 @@ class GLMClient:
             query: Поисковый запрос
             max_tokens: Максимальное количество токенов в ответе
             temperature: Температура (креативность) от 0 до 1
+            timeout: Таймаут запроса в секундах
 
         Returns:
             Текст ответа с результатами поиска или None в случае ошибки
@@ -147,21 +564,21 @@ class GLMClient:
         }
 
         try:
-            async with httpx.AsyncClient(timeout=120.0) as client:
-                response = await client.post(
-                    self.api_url,
-                    headers=self.headers,
-                    json=payload
-                )
-                response.raise_for_status()
+            response = await self._get_client().post(
+                self.api_url,
+                headers=self.headers,
+                json=payload,
+                timeout=self._timeout(timeout)
+            )
+            response.raise_for_status()
 
-                data = response.json()
+            data = response.json()
 
-                # Проверяем структуру ответа
-                if "choices" in data and len(data["choices"]) > 0:
-                    return data["choices"][0]["message"]["content"]
+            # Проверяем структуру ответа
+            if "choices" in data and len(data["choices"]) > 0:
+                return data["choices"][0]["message"]["content"]
 
-                return None
+            return None
 
         except httpx.HTTPStatusError as e:
             logger.error(f"HTTP ошибка при поиске: {e.response.status_code} - {e.response.text}")
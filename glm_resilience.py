@@ -0,0 +1,160 @@
+"""
+Повторы, задержка перед хеджированием и автомат отключения для запросов к GLM
+"""
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Ответы, после которых запрос стоит повторить: лимит запросов и сбои на стороне провайдера
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Стоит ли повторять запрос после этой ошибки
+
+    Повторяем 429/5xx и обрывы соединения (не удалось подключиться, сервер
+    закрыл соединение). Таймаут чтения не повторяем: запрос уже отнял
+    полный таймаут, а с медленными ответами справляется хеджирование.
+    """
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRY_STATUSES
+    if isinstance(error, httpx.ReadTimeout):
+        return False
+    return isinstance(error, httpx.TransportError)
+
+
+def is_overload(error: Exception) -> bool:
+    """
+    Признак перегрузки провайдера: таймаут, 429 или 5xx
+
+    Остальные ошибки (400, 401 и т.п.) - ошибки самого запроса, по ним
+    снижать число одновременных запросов незачем.
+    """
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(error, (httpx.TimeoutException, asyncio.TimeoutError))
+
+
+def retry_delay(attempt: int, base: float, cap: float, retry_after: Optional[float] = None) -> float:
+    """
+    Пауза перед повтором: экспоненциальная с полным джиттером
+
+    Args:
+        attempt: Номер повтора (с 0)
+        base: Пауза перед первым повтором (верхняя граница)
+        cap: Максимальная пауза
+        retry_after: Пауза, которую попросил сервер (Retry-After), если есть
+    """
+    if retry_after is not None:
+        return min(cap, retry_after)
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def parse_retry_after(response: httpx.Response) -> Optional[float]:
+    """Заголовок Retry-After в секундах (форму с датой не поддерживаем)"""
+    value = response.headers.get("Retry-After")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class LatencyTracker:
+    """Скользящее окно времен успешных ответов для оценки перцентилей"""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        """
+        Args:
+            window: Сколько последних ответов помнить
+            min_samples: Меньше ответов - перцентиль не считаем (слишком шумно)
+        """
+        self.samples: Deque[float] = deque(maxlen=window)
+        self.min_samples = min_samples
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Перцентиль q (0..1) или None, если данных мало"""
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class CircuitBreaker:
+    """Автомат отключения: пока провайдер лежит, запросы сразу получают отказ
+
+    closed - запросы идут как обычно; после failure_threshold неудач подряд
+    автомат размыкается (open) и reset_timeout секунд отказывает сразу, не
+    тратя время пользователя на заведомо неудачный запрос. Потом пропускает
+    один пробный запрос (half_open): успех замыкает автомат, неудача снова
+    размыкает его. Если пробный запрос пропал без результата (отменен),
+    через reset_timeout пропускается следующий.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        """
+        Args:
+            failure_threshold: Сколько неудач подряд размыкают автомат
+            reset_timeout: Сколько секунд отказывать перед пробным запросом
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_started: Optional[float] = None
+
+        # Метрики
+        self.rejected = 0
+        self.trips = 0
+
+    def allow(self) -> bool:
+        """Можно ли отправить запрос сейчас"""
+        if self.state == self.CLOSED:
+            return True
+        now = time.monotonic()
+        if self.state == self.OPEN and now - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self._probe_started = None
+        if self.state == self.HALF_OPEN and (
+                self._probe_started is None or now - self._probe_started >= self.reset_timeout):
+            self._probe_started = now
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info("[GLM_BREAKER] Provider is back, circuit closed")
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_started = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.trips += 1
+                logger.warning(f"[GLM_BREAKER] {self.failures} failures in a row, "
+                               f"failing fast for {self.reset_timeout:.0f}s")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self._probe_started = None
+
+    def stats(self) -> Dict:
+        return {"state": self.state, "failures": self.failures, "trips": self.trips, "rejected": self.rejected}
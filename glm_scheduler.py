@@ -0,0 +1,212 @@
+"""
+Адаптивный лимит одновременных запросов к GLM с приоритетами и сроками ожидания
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PRIORITY = 2  # Для мест вызова, которых нет в политике
+
+
+class GLMScheduler:
+    """Пропускает к GLM не больше limit запросов одновременно, остальные ждут в очереди
+
+    limit подстраивается под провайдера по схеме AIMD: каждый быстрый
+    успешный ответ немного увеличивает его (+1/limit, то есть примерно +1
+    за "круг" запросов), а признак перегрузки (таймаут, 429, 5xx) или ответ
+    дольше latency_target уменьшает в backoff раз. Ошибки самого запроса
+    (400, 401) лимит не меняют. Запросы, отправленные до последнего уменьшения, limit
+    повторно не уменьшают - одна перегрузка не обнуляет его серией ошибок.
+
+    Очередь упорядочена по приоритету места вызова (call_site), внутри
+    приоритета - по справедливой очереди чатов. У места вызова может быть срок
+    ожидания: запрос, не дождавшийся слота за это время, отбрасывается -
+    случайная реакция через минуту уже никому не нужна.
+
+    Политика: call_site -> (приоритет, срок ожидания в секундах или None).
+    Меньший приоритет обслуживается раньше.
+
+    Внутри приоритета очередь честно делится между чатами (взвешенная
+    справедливая очередь с самосинхронизацией, SCFQ): запрос чата получает
+    метку "финиша" max(виртуальное время, метка прошлого запроса чата) +
+    1/вес, и слоты выдаются по возрастанию меток. Чат, заваливший очередь
+    запросами, обслуживается через раз с остальными, а не впереди них, и
+    тихие чаты почти не ждут. Вес чата дает weight_for(chat_id).
+    """
+
+    FINISH_CLEANUP_THRESHOLD = 1000  # Чистить метки чатов, когда их больше
+
+    def __init__(self, policy: Dict[str, Tuple[int, Optional[float]]], initial_limit: float = 4,
+                 min_limit: float = 1, max_limit: float = 10, latency_target: float = 20.0,
+                 backoff: float = 0.5, weight_for: Optional[Callable[[Any], float]] = None):
+        """
+        Args:
+            policy: Приоритет и срок ожидания для каждого места вызова
+            initial_limit: Начальный лимит одновременных запросов
+            min_limit: Ниже этого лимит не опускается
+            max_limit: Выше этого лимит не поднимается (не больше пула соединений)
+            latency_target: Ответ дольше стольких секунд считается признаком перегрузки
+            backoff: Во сколько раз уменьшать лимит при перегрузке
+            weight_for: Вес чата в очереди (по умолчанию у всех 1)
+        """
+        self.policy = dict(policy)
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.weight_for = weight_for
+
+        self.in_flight = 0
+        self._waiting: List[tuple] = []  # (приоритет, метка финиша, номер, call_site, chat_id, future)
+        self._counter = itertools.count()
+        self._last_decrease = 0.0
+
+        # Справедливая очередь по чатам
+        self._virtual_time = 0.0
+        self._finish: Dict[Any, float] = {}  # chat_id -> метка последнего запроса
+        self.chat_in_flight: Dict[Any, int] = {}
+
+        # Метрики
+        self.completed = 0
+        self.failed = 0
+        self.dropped: Dict[str, int] = {}
+        self.latency_ewma: Optional[float] = None
+
+    def _policy_for(self, call_site: Optional[str]) -> Tuple[int, Optional[float]]:
+        return self.policy.get(call_site, (DEFAULT_PRIORITY, None))
+
+    def _weight(self, chat_id) -> float:
+        if self.weight_for is None or chat_id is None:
+            return 1.0
+        try:
+            return max(0.01, float(self.weight_for(chat_id)))
+        except Exception as e:
+            logger.warning(f"[GLM_SCHED] Bad weight for chat {chat_id}: {e}")
+            return 1.0
+
+    async def acquire(self, call_site: Optional[str], chat_id=None) -> Optional[float]:
+        """
+        Дождаться слота для запроса
+
+        Args:
+            call_site: Место вызова (приоритет и срок ожидания из политики)
+            chat_id: Чат, для которого запрос (для справедливой очереди)
+
+        Returns:
+            Время начала запроса (передать в release) или None, если запрос
+            не дождался слота за срок ожидания и отброшен
+        """
+        level, max_wait = self._policy_for(call_site)
+        # Метка идет за последним выданным и всеми ждущими запросами чата, а в _finish
+        # попадает только при выдаче слота: отброшенный запрос чат не штрафует
+        previous = max(self._finish.get(chat_id, 0.0), self._queued_finish(chat_id))
+        finish = max(self._virtual_time, previous) + 1 / self._weight(chat_id)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (level, finish, next(self._counter), call_site, chat_id, future))
+        self._dispatch()  # Есть свободный слот - получим его сразу
+        try:
+            await asyncio.wait_for(future, timeout=max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # Слот уже выдан, но запрос не успел проснуться: по сроку - все равно берем слот,
+                # при отмене (дедлайн ответа, остановка) - возвращаем, иначе он потерян навсегда
+                if isinstance(e, asyncio.TimeoutError):
+                    return time.monotonic()
+                self._free_slot(chat_id)
+                self._dispatch()
+                raise
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            # Будущее отменено - диспетчер пропустит его запись в очереди
+            self.dropped[call_site] = self.dropped.get(call_site, 0) + 1
+            logger.warning(f"[GLM_SCHED] Dropped stale {call_site} request after {max_wait:.0f}s in queue")
+            return None
+        return time.monotonic()
+
+    def _queued_finish(self, chat_id) -> float:
+        """Наибольшая метка ждущих запросов чата (0, если их нет)"""
+        return max((entry[1] for entry in self._waiting if entry[4] == chat_id and not entry[5].done()), default=0.0)
+
+    def _free_slot(self, chat_id):
+        self.in_flight -= 1
+        if self.chat_in_flight.get(chat_id, 0) <= 1:
+            self.chat_in_flight.pop(chat_id, None)
+        else:
+            self.chat_in_flight[chat_id] -= 1
+
+    def release(self, started: float, ok: bool, chat_id=None, overload: Optional[bool] = None):
+        """
+        Освободить слот и подстроить лимит
+
+        Args:
+            started: Значение, которое вернул acquire
+            ok: Запрос завершился без ошибки
+            chat_id: Тот же чат, что и в acquire
+            overload: Ошибка - признак перегрузки провайдера (таймаут, 429, 5xx);
+                None - считать так любую ошибку
+        """
+        now = time.monotonic()
+        latency = now - started
+        self._free_slot(chat_id)
+
+        if ok:
+            self.completed += 1
+            self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+        else:
+            self.failed += 1
+
+        overloaded = (not ok and overload is not False) or latency > self.latency_target
+        if ok and not overloaded:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        elif overloaded and started >= self._last_decrease:
+            old_limit = self.limit
+            self.limit = max(self.min_limit, self.limit * self.backoff)
+            self._last_decrease = now
+            reason = "overload error" if not ok else f"slow response {latency:.1f}s"
+            logger.warning(f"[GLM_SCHED] {reason}: concurrency limit {old_limit:.1f} -> {self.limit:.1f}")
+
+        self._dispatch()
+
+    def _dispatch(self):
+        """Выдать освободившиеся слоты самым приоритетным ожидающим"""
+        while self._waiting and self.in_flight < int(self.limit):
+            _, finish, _, _, chat_id, future = heapq.heappop(self._waiting)
+            if future.done():  # Не дождался и уже отброшен
+                continue
+            self._virtual_time = max(self._virtual_time, finish)
+            self._finish[chat_id] = max(self._finish.get(chat_id, 0.0), finish)
+            self.in_flight += 1
+            self.chat_in_flight[chat_id] = self.chat_in_flight.get(chat_id, 0) + 1
+            future.set_result(None)
+
+        if not self._waiting and len(self._finish) > self.FINISH_CLEANUP_THRESHOLD:
+            # Метки не впереди виртуального времени ничем не отличаются от отсутствующих
+            self._finish = {chat: tag for chat, tag in self._finish.items() if tag > self._virtual_time}
+
+    def chat_stats(self) -> Dict[Any, Dict[str, int]]:
+        """Запросы в работе и в очереди по чатам (только активные чаты)"""
+        chats = {chat_id: {"in_flight": count, "queued": 0} for chat_id, count in self.chat_in_flight.items()}
+        for *_, chat_id, future in self._waiting:
+            if not future.done():
+                chats.setdefault(chat_id, {"in_flight": 0, "queued": 0})["queued"] += 1
+        return chats
+
+    def stats(self) -> Dict:
+        """Текущий лимит, загрузка и счетчики"""
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queued": sum(1 for *_, future in self._waiting if not future.done()),
+            "chats": self.chat_stats(),
+            "completed": self.completed,
+            "failed": self.failed,
+            "dropped": dict(self.dropped),
+            "latency_ewma": round(self.latency_ewma, 2) if self.latency_ewma is not None else None,
+        }
@@ -1,4 +1,5 @@
-from typing import Dict, List
+from typing import Callable, Dict, List
+import itertools
 import json
 from datetime import datetime
 
@@ -18,9 +19,15 @@ class HistoryManager:
         self.counters: Dict[int, int] = {}
         self.bot_messages_unanswered: Dict[int, int] = {}  # Счетчик игнорируемых сообщений бота
         self.last_bot_message_time: Dict[int, datetime] = {}  # Когда бот последний раз писал
+        self._seq = itertools.count(1)  # Сквозной номер сообщения (seq в записи)
+        self._clear_listeners: List[Callable[[int], None]] = []  # Кто хранит производное от истории
+
+    def add_clear_listener(self, listener: Callable[[int], None]):
+        """Подписаться на очистку истории: listener(chat_id) после clear_history"""
+        self._clear_listeners.append(listener)
 
     def add_message(self, chat_id: int, role: str, content: str, sender_name: str = "Assistant"):
-        """Добавить сообщение в историю чата"""
+        """Добавить сообщение в историю чата. Returns: добавленная запись"""
         if chat_id not in self.chats:
             self.chats[chat_id] = []
             self.counters[chat_id] = 0
@@ -32,12 +39,14 @@ class HistoryManager:
             if diff > self.expiration_minutes:
                 self.clear_history(chat_id)
 
-        self.chats[chat_id].append({
+        entry = {
             "role": role,
             "content": content,
             "sender": sender_name,
-            "timestamp": now.isoformat()
-        })
+            "timestamp": now.isoformat(),
+            "seq": next(self._seq)
+        }
+        self.chats[chat_id].append(entry)
         
         # Обновляем время последнего взаимодействия
         self.last_interactions[chat_id] = now
@@ -58,6 +67,8 @@ class HistoryManager:
         if len(self.chats[chat_id]) > self.max_history:
             self.chats[chat_id] = self.chats[chat_id][-self.max_history:]
 
+        return entry
+
     def should_intervene(self, chat_id: int, probability: float = 0.1, min_delay: int = 5) -> bool:
         """
         Проверить, стоит ли боту проявить инициативу и «оживить» беседу.
@@ -126,7 +137,13 @@ class HistoryManager:
         """Очистить историю чата"""
         if chat_id in self.chats:
             self.chats[chat_id] = []
+        for listener in self._clear_listeners:
+            listener(chat_id)
 
     def clear_all_history(self):
         """Очистить всю историю"""
+        chat_ids = list(self.chats)
         self.chats.clear()
+        for chat_id in chat_ids:
+            for listener in self._clear_listeners:
+                listener(chat_id)
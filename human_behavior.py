@@ -1,6 +1,6 @@
 import asyncio
 import random
-from typing import Tuple
+from typing import Dict, List, Tuple
 
 # Карта соседних букв на русской клавиатуре
 KEYBOARD_NEIGHBORS = {
@@ -48,11 +48,8 @@ class HumanBehavior:
     """Естественное человеческое поведение для бота"""
 
     @staticmethod
-    async def typing_pause(context, chat_id: int, text_length: int, variance: bool = True) -> float:
-        """
-        Отправить индикатор печати и подождать естественное время.
-        Возвращает время паузы в секундах.
-        """
+    def typing_delay(text_length: int, variance: bool = True) -> float:
+        """Естественное время набора текста такой длины, в секундах"""
         # Базовое время: 2 секунды на начало
         base_delay = 2.0
         # 0.02 сек на символ
@@ -65,6 +62,16 @@ class HumanBehavior:
             variance_amount = random.uniform(-0.5, 0.5)
             total = max(1.0, total + variance_amount)
 
+        return total
+
+    @staticmethod
+    async def typing_pause(context, chat_id: int, text_length: int, variance: bool = True) -> float:
+        """
+        Отправить индикатор печати и подождать естественное время.
+        Возвращает время паузы в секундах.
+        """
+        total = HumanBehavior.typing_delay(text_length, variance)
+
         try:
             await context.bot.send_chat_action(chat_id, action="typing")
             await asyncio.sleep(total)
@@ -159,6 +166,47 @@ class HumanBehavior:
         """1% шанс добавить лишний пробел"""
         return random.random() < 0.01
 
+    @classmethod
+    def plan_reply(cls, text: str, max_length: int = 200, typos: bool = True) -> List[Dict]:
+        """
+        Заранее рассчитать "человеческую" отправку ответа (для DeliveryScheduler).
+
+        Args:
+            text: Текст ответа
+            max_length: Максимальная длина одного сообщения
+            typos: Добавлять ли опечатки и словесные паразиты в последнее сообщение
+
+        Returns:
+            Части ответа по порядку: {'text', 'typing' - сколько "печатать" перед
+            отправкой, 'pause' - пауза после, 'fix' - текст исправления опечатки
+            или None, 'fix_delay' - через сколько исправить}
+        """
+        messages_to_send = cls.split_into_messages(text, max_length=max_length)
+        plan = []
+        for i, msg_part in enumerate(messages_to_send):
+            is_last = i == len(messages_to_send) - 1
+            fix = None
+
+            # Опечатки только в последнем сообщении
+            if is_last and typos:
+                msg_with_typos, needs_fix = cls.add_typos(msg_part, typo_chance=0.05)
+                msg_with_typos = cls.add_filler_words(msg_with_typos)
+                # Редкое исправление (3% шанс)
+                if needs_fix and cls.should_fix_typo(needs_fix):
+                    fix = msg_part + " *исправил"
+            else:
+                msg_with_typos = msg_part
+
+            plan.append({
+                'text': msg_with_typos,
+                'typing': cls.typing_delay(len(msg_part)),
+                # Небольшая пауза между сообщениями (1-2 сек)
+                'pause': 0.0 if is_last else random.uniform(1.0, 2.0),
+                'fix': fix,
+                'fix_delay': random.uniform(1, 2)
+            })
+        return plan
+
     @staticmethod
     def split_into_messages(text: str, max_length: int = 200) -> list:
         """
@@ -0,0 +1,49 @@
+"""
+Однопроходный фильтр ключевых слов для детекторов SmartLocalAI
+"""
+import re
+from typing import Dict, Iterable, Set
+
+
+class KeywordPrefilter:
+    """Находит за один проход все группы ключевых слов, встретившиеся в тексте
+
+    Каждому детектору соответствует группа ключевых слов - подстрок, без
+    которых ни один его паттерн не может сработать. Все слова собраны в одно
+    регулярное выражение с просмотром вперед, которое пробует каждую позицию
+    текста, поэтому перекрывающиеся совпадения не теряются. Если слово
+    содержит в себе другое ключевое слово, его совпадение засчитывается и за
+    группы вложенного слова.
+
+    Детектор запускает свои (уже скомпилированные) паттерны, только если его
+    группа попала в результат, поэтому результат детекторов не меняется.
+    """
+
+    def __init__(self, groups: Dict[str, Iterable[str]]):
+        """
+        Args:
+            groups: Имя группы -> ключевые слова (в нижнем регистре)
+        """
+        keyword_groups: Dict[str, Set[str]] = {}
+        for group, keywords in groups.items():
+            for keyword in keywords:
+                keyword_groups.setdefault(keyword, set()).add(group)
+
+        # Совпадение длинного слова означает и совпадение всех вложенных в него
+        self.keyword_groups: Dict[str, frozenset] = {
+            keyword: frozenset().union(*(
+                keyword_groups[inner] for inner in keyword_groups if inner in keyword
+            ))
+            for keyword in keyword_groups
+        }
+
+        # Длинные слова первыми, чтобы на каждой позиции бралось самое длинное
+        alternation = '|'.join(re.escape(k) for k in sorted(self.keyword_groups, key=len, reverse=True))
+        self.pattern = re.compile(f'(?=({alternation}))')
+
+    def scan(self, text_lower: str) -> Set[str]:
+        """Группы, ключевые слова которых встречаются в тексте"""
+        found: Set[str] = set()
+        for keyword in {match.group(1) for match in self.pattern.finditer(text_lower)}:
+            found |= self.keyword_groups[keyword]
+        return found
@@ -0,0 +1,164 @@
+"""
+Инвертированный индекс фактов для KnowledgeManager
+"""
+import re
+from typing import Dict, Optional, Set
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text: str) -> Set[str]:
+    """Нормализованные токены текста (нижний регистр, только буквы/цифры)"""
+    return set(TOKEN_RE.findall(text.lower()))
+
+
+class KnowledgeIndex:
+    """Инвертированный индекс: токен -> факты и ключи, где он встречается
+
+    Поиск в KnowledgeManager исторически ищет подстроку (слово запроса
+    внутри текста факта или ключа). Подстрока из букв/цифр целиком лежит
+    внутри одного токена, поэтому кандидатов можно найти через словарь
+    токенов: сначала токены, содержащие подстроку (через би- и
+    триграммы словаря), затем их списки фактов. Так проверяются только факты-
+    кандидаты, а не вся база.
+    """
+
+    GRAM_SIZES = (2, 3)
+
+    def __init__(self):
+        self.fact_postings: Dict[str, Set[int]] = {}  # токен -> id фактов
+        self.key_postings: Dict[str, Set[str]] = {}  # токен -> ключи
+        self.untokenized_keys: Set[str] = set()  # ключи без единого токена (пустые, эмодзи)
+        self._gram_tokens: Dict[str, Set[str]] = {}  # би/триграмма -> токены словаря
+
+    # --- Словарь токенов ---
+
+    def _grams(self, token: str) -> Set[str]:
+        grams = set()
+        for size in self.GRAM_SIZES:
+            grams.update(token[i:i + size] for i in range(len(token) - size + 1))
+        return grams
+
+    def _add_token(self, token: str):
+        for gram in self._grams(token):
+            self._gram_tokens.setdefault(gram, set()).add(token)
+
+    def _drop_token(self, token: str):
+        """Убрать токен из словаря, если на него больше ничего не ссылается"""
+        if token in self.fact_postings or token in self.key_postings:
+            return
+        for gram in self._grams(token):
+            tokens = self._gram_tokens.get(gram)
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self._gram_tokens[gram]
+
+    def tokens_containing(self, fragment: str) -> Set[str]:
+        """Токены словаря, содержащие fragment как подстроку"""
+        if len(fragment) == 1:
+            # Однобуквенные куски редки - проще пройти по словарю
+            vocabulary = set(self.fact_postings) | set(self.key_postings)
+            return {token for token in vocabulary if fragment in token}
+
+        size = min(len(fragment), max(self.GRAM_SIZES))
+        grams = {fragment[i:i + size] for i in range(len(fragment) - size + 1)}
+
+        candidates = None
+        for gram in sorted(grams, key=lambda g: len(self._gram_tokens.get(g, ()))):
+            tokens = self._gram_tokens.get(gram)
+            if not tokens:
+                return set()
+            candidates = set(tokens) if candidates is None else candidates & tokens
+            if not candidates:
+                return set()
+        return {token for token in candidates if fragment in token}
+
+    # --- Обновление ---
+
+    def add_fact(self, fact_id: int, text: str):
+        for token in tokenize(text):
+            postings = self.fact_postings.get(token)
+            if postings is None:
+                postings = self.fact_postings[token] = set()
+                self._add_token(token)
+            postings.add(fact_id)
+
+    def remove_fact(self, fact_id: int, text: str):
+        for token in tokenize(text):
+            postings = self.fact_postings.get(token)
+            if postings is None:
+                continue
+            postings.discard(fact_id)
+            if not postings:
+                del self.fact_postings[token]
+                self._drop_token(token)
+
+    def add_key(self, key: str):
+        tokens = tokenize(key)
+        if not tokens:
+            self.untokenized_keys.add(key)
+        for token in tokens:
+            postings = self.key_postings.get(token)
+            if postings is None:
+                postings = self.key_postings[token] = set()
+                self._add_token(token)
+            postings.add(key)
+
+    def remove_key(self, key: str):
+        self.untokenized_keys.discard(key)
+        for token in tokenize(key):
+            postings = self.key_postings.get(token)
+            if postings is None:
+                continue
+            postings.discard(key)
+            if not postings:
+                del self.key_postings[token]
+                self._drop_token(token)
+
+    # --- Поиск ---
+
+    def _lookup(self, fragment: str, postings: Dict[str, Set]) -> Optional[Set]:
+        """Кандидаты, чей текст может содержать fragment
+
+        Возвращает None, если в fragment нет ни одной буквы/цифры -
+        такой запрос индекс не сужает, и вызывающий код проверяет всё.
+        """
+        runs = TOKEN_RE.findall(fragment)
+        if not runs:
+            return None
+
+        # Самый длинный кусок - самый избирательный
+        run = max(runs, key=len)
+        result = set()
+        for token in self.tokens_containing(run):
+            result |= postings.get(token, set())
+        return result
+
+    def facts_with(self, fragment: str) -> Optional[Set[int]]:
+        """id фактов, текст которых может содержать fragment"""
+        return self._lookup(fragment, self.fact_postings)
+
+    def keys_with(self, fragment: str) -> Optional[Set[str]]:
+        """Ключи, которые могут содержать fragment"""
+        return self._lookup(fragment, self.key_postings)
+
+    def keys_inside(self, text: str, max_work: int = 20000) -> Optional[Set[str]]:
+        """Ключи, которые могут целиком входить в text как подстрока
+
+        Каждый токен такого ключа - подстрока одного из кусков text,
+        поэтому достаточно перебрать подстроки кусков. Для очень длинного
+        text возвращает None (дешевле проверить все ключи напрямую).
+        """
+        runs = TOKEN_RE.findall(text)
+        if sum(len(run) ** 2 for run in runs) > max_work:
+            return None
+
+        result = set(self.untokenized_keys)
+        for run in runs:
+            for i in range(len(run)):
+                for j in range(i + 1, len(run) + 1):
+                    keys = self.key_postings.get(run[i:j])
+                    if keys:
+                        result |= keys
+        return result
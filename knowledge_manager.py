@@ -1,93 +1,323 @@
+import asyncio
 import json
 import os
+import tempfile
+import threading
+from collections import OrderedDict
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
+
+from knowledge_index import KnowledgeIndex
 
 class KnowledgeManager:
-    """Менеджер знаний для обучения бота"""
+    """Менеджер знаний для обучения бота
+
+    Изменения пишутся в журнал (одна компактная JSON-строка на операцию),
+    а полный снимок в data_file пересобирается фоновым сжатием (compact).
+    При старте загружается снимок и поверх него проигрывается журнал.
+    """
 
     MAX_FACTS = 5500  # Максимальное количество сохранённых фактов
+    CONTEXT_WINDOW = 3  # Сколько последних фактов каждого ключа участвует в контексте промпта
 
-    def __init__(self, data_file: str = "bot_knowledge.json"):
+    def __init__(self, data_file: str = "bot_knowledge.json", journal_file: str = None):
         self.data_file = data_file
+        self.journal_file = journal_file or f"{data_file}.log"
         self.facts: Dict[str, List[Dict]] = {}
         self.user_info: Dict[int, Dict] = {}  # Персональная информация по user_id
         self.behavioral_rules: Dict[int, List[Dict]] = {}  # Поведенческие правила по chat_id
+
+        # Все факты в порядке добавления: id(факта) -> (ключ, факт).
+        # Самый старый факт всегда первый, поэтому вытеснение не требует сортировки.
+        self._order: "OrderedDict[int, Tuple[str, Dict]]" = OrderedDict()
+        self._total = 0
+        self.index = KnowledgeIndex()
+        self._listeners: List = []  # Внешние индексы, следящие за фактами
+        self._change_listeners: List = []  # Кэши, следящие за правилами и профилями
+
+        self._journal = None  # Открытый на дозапись файл журнала
+        self._journal_seq = 0  # Номер последней записи журнала
+        self._journal_records = 0  # Записей в журнале с момента последнего снимка
+        self._replaying = False
+        self._compacting = False
+        # Снимок пишут и фоновое сжатие (в потоке), и save_knowledge при остановке
+        self._snapshot_lock = threading.Lock()
+        self._written_seq = -1  # journal_seq последнего записанного снимка
         self.load_knowledge()
 
     def load_knowledge(self):
-        """Загрузка знаний из файла"""
+        """Загрузка знаний: снимок из файла + проигрывание журнала"""
+        snapshot_seq = 0
         if os.path.exists(self.data_file):
             try:
                 with open(self.data_file, 'r', encoding='utf-8') as f:
                     data = json.load(f)
                     self.facts = data.get('facts', {})
-                    self.user_info = data.get('user_info', {})
-                    # Загружаем поведенческие правила, конвертируя ключи обратно в int
+                    # Ключи JSON всегда строки - конвертируем user_id и chat_id обратно в int
+                    self.user_info = {int(k): v for k, v in data.get('user_info', {}).items()}
                     behavioral_rules_raw = data.get('behavioral_rules', {})
                     self.behavioral_rules = {int(k): v for k, v in behavioral_rules_raw.items()}
+                    snapshot_seq = data.get('journal_seq', 0)
             except Exception as e:
                 print(f"Ошибка загрузки знаний: {e}")
                 self.facts = {}
                 self.user_info = {}
                 self.behavioral_rules = {}
 
+        self._rebuild_order()
+        self._journal_seq = snapshot_seq
+        replayed = 0
+        # .old остаётся, только если сжатие было прервано - он старше основного журнала
+        for path in (self._old_journal_file(), self.journal_file):
+            replayed += self._replay_journal(path, snapshot_seq)
+
+        if replayed or os.path.exists(self._old_journal_file()):
+            print(f"Проиграно {replayed} записей журнала знаний")
+            self.save_knowledge()
+
+    def add_listener(self, listener):
+        """Подписать внешний индекс на изменения фактов
+
+        listener должен реализовать rebuild(facts), add_fact(key, fact)
+        и remove_fact(key, fact). rebuild вызывается сразу и при каждой
+        полной перезагрузке фактов.
+        """
+        self._listeners.append(listener)
+        listener.rebuild(self.facts)
+
+    def add_change_listener(self, listener):
+        """Подписаться на изменение правил и профилей
+
+        listener(kind, target_id) вызывается с kind "rules" и chat_id после
+        добавления или удаления поведенческого правила и с kind "user_info"
+        и user_id после сохранения информации о пользователе.
+        """
+        self._change_listeners.append(listener)
+
+    def _notify_change(self, kind: str, target_id: int):
+        for listener in self._change_listeners:
+            listener(kind, target_id)
+
+    def _rebuild_order(self):
+        """Построить глобальный порядок фактов по времени добавления"""
+        entries = [(key, fact) for key, fact_list in self.facts.items() for fact in fact_list]
+        entries.sort(key=lambda item: item[1].get('timestamp', ''))
+
+        self._order = OrderedDict((id(fact), (key, fact)) for key, fact in entries)
+        self._total = len(entries)
+
+        self.index = KnowledgeIndex()
+        for key in self.facts:
+            self.index.add_key(key.lower())
+        for key, fact in entries:
+            self.index.add_fact(id(fact), fact.get('fact', ''))
+
+        for listener in self._listeners:
+            listener.rebuild(self.facts)
+
+    def _old_journal_file(self) -> str:
+        return f"{self.journal_file}.old"
+
+    def _replay_journal(self, path: str, snapshot_seq: int) -> int:
+        """Применить записи журнала, которых ещё нет в снимке"""
+        if not os.path.exists(path):
+            return 0
+
+        applied = 0
+        self._replaying = True
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Недописанная последняя строка после аварийной остановки
+                        print(f"Журнал знаний {path}: повреждённая запись, остаток пропущен")
+                        break
+
+                    seq = record.get('seq', 0)
+                    if seq <= snapshot_seq:
+                        continue
+                    self._apply_record(record)
+                    self._journal_seq = max(self._journal_seq, seq)
+                    applied += 1
+        except Exception as e:
+            print(f"Ошибка чтения журнала знаний {path}: {e}")
+        finally:
+            self._replaying = False
+        return applied
+
+    def _apply_record(self, record: Dict):
+        """Повторить операцию из журнала"""
+        op = record.get('op')
+        if op == 'fact':
+            self._apply_fact(record['key'], record['data'])
+        elif op == 'delete_fact':
+            self.delete_fact(record['key'], record['user_id'])
+        elif op == 'user_info':
+            self._apply_user_info(record['user_id'], record['type'], record['data'])
+        elif op == 'rule':
+            self._apply_behavioral_rule(record['chat_id'], record['data'])
+        elif op == 'rule_off':
+            self.remove_behavioral_rule(record['chat_id'], record['index'])
+
+    def _journal_append(self, record: Dict):
+        """Дописать операцию в журнал (вместо полной перезаписи файла)"""
+        if self._replaying:
+            return
+
+        self._journal_seq += 1
+        record['seq'] = self._journal_seq
+        try:
+            if self._journal is None:
+                self._journal = open(self.journal_file, 'a', encoding='utf-8')
+            self._journal.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+            self._journal.flush()
+            self._journal_records += 1
+        except Exception as e:
+            print(f"Ошибка записи журнала знаний: {e}")
+
+    def _close_journal(self):
+        if self._journal is not None:
+            try:
+                self._journal.close()
+            except Exception:
+                pass
+            self._journal = None
+
+    def _snapshot_data(self) -> Dict:
+        """Снимок состояния для записи на диск
+
+        Словари фактов после добавления не меняются, поэтому достаточно
+        скопировать списки - дальше снимок можно сериализовать в другом потоке.
+        """
+        return {
+            'facts': {key: list(facts) for key, facts in self.facts.items()},
+            'user_info': {user_id: dict(info) for user_id, info in self.user_info.items()},
+            'behavioral_rules': {chat_id: [dict(rule) for rule in rules]
+                                 for chat_id, rules in self.behavioral_rules.items()},
+            'last_updated': datetime.now().isoformat(),
+            'total_facts': self.get_total_count(),
+            'journal_seq': self._journal_seq
+        }
+
+    def _write_snapshot(self, data: Dict) -> bool:
+        """Атомарно записать снимок: свой временный файл + rename
+
+        Записи идут по одной под замком. Снимок старше уже записанного (сжатие,
+        закончившееся после save_knowledge) не пишется - иначе он затер бы
+        более свежий снимок, журнал к которому уже удален.
+
+        Returns: записан ли снимок
+        """
+        with self._snapshot_lock:
+            if data['journal_seq'] < self._written_seq:
+                return False
+            folder = os.path.dirname(os.path.abspath(self.data_file))
+            fd, tmp_file = tempfile.mkstemp(prefix=f"{os.path.basename(self.data_file)}.", suffix=".tmp", dir=folder)
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+                os.replace(tmp_file, self.data_file)
+            except BaseException:
+                if os.path.exists(tmp_file):
+                    os.remove(tmp_file)
+                raise
+            self._written_seq = data['journal_seq']
+            return True
+
     def save_knowledge(self):
-        """Сохранение знаний в файл"""
+        """Синхронно записать полный снимок и очистить журнал"""
         try:
-            data = {
-                'facts': self.facts,
-                'user_info': self.user_info,
-                'behavioral_rules': self.behavioral_rules,
-                'last_updated': datetime.now().isoformat(),
-                'total_facts': self.get_total_count()
-            }
-            with open(self.data_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            self._write_snapshot(self._snapshot_data())
+            self._close_journal()
+            for path in (self.journal_file, self._old_journal_file()):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._journal_records = 0
         except Exception as e:
             print(f"Ошибка сохранения знаний: {e}")
 
+    async def compact(self):
+        """Фоновое сжатие: снимок пишется в отдельном потоке, журнал ротируется
+
+        Новые записи во время сжатия идут в свежий журнал, а старый
+        удаляется только после того, как снимок надёжно лёг на диск.
+        """
+        if self._compacting or self._journal_records == 0:
+            return
+
+        self._compacting = True
+        try:
+            data = self._snapshot_data()
+            self._rotate_journal()
+            self._journal_records = 0
+
+            await asyncio.to_thread(self._write_snapshot, data)
+
+            if os.path.exists(self._old_journal_file()):
+                os.remove(self._old_journal_file())
+        except Exception as e:
+            print(f"Ошибка сжатия журнала знаний: {e}")
+        finally:
+            self._compacting = False
+
+    def _rotate_journal(self):
+        """Перенести текущий журнал в .old, чтобы новые записи шли в чистый файл"""
+        self._close_journal()
+        if not os.path.exists(self.journal_file):
+            return
+
+        old_file = self._old_journal_file()
+        if os.path.exists(old_file):
+            # Прошлое сжатие не завершилось - дописываем, чтобы не потерять записи
+            with open(self.journal_file, 'r', encoding='utf-8') as src, \
+                    open(old_file, 'a', encoding='utf-8') as dst:
+                dst.write(src.read())
+            os.remove(self.journal_file)
+        else:
+            os.replace(self.journal_file, old_file)
+
     def get_total_count(self) -> int:
         """Получить общее количество фактов"""
-        return sum(len(facts) for facts in self.facts.values())
+        return self._total
 
     def cleanup_old_facts(self):
         """Удалить самые старые факты при достижении лимита"""
-        total = self.get_total_count()
-
-        if total > self.MAX_FACTS:
-            # Собираем все факты с датами
-            all_facts = []
-            for key, fact_list in self.facts.items():
-                for fact in fact_list:
-                    all_facts.append({
-                        'key': key,
-                        'fact': fact,
-                        'timestamp': fact.get('timestamp', '')
-                    })
-
-            # Сортируем по дате (самые старые первые)
-            all_facts.sort(key=lambda x: x['timestamp'])
-
-            # Удаляем самые старые факты
-            to_remove = total - self.MAX_FACTS
-            removed = 0
-
-            for item in all_facts:
-                if removed >= to_remove:
-                    break
-
-                key = item['key']
-                fact_to_remove = item['fact']
+        removed = 0
 
-                if key in self.facts and fact_to_remove in self.facts[key]:
-                    self.facts[key].remove(fact_to_remove)
-                    if not self.facts[key]:
-                        del self.facts[key]
-                    removed += 1
+        while self._total > self.MAX_FACTS and self._order:
+            _, (key, fact) = self._order.popitem(last=False)
+            self._remove_from_key(key, fact)
+            removed += 1
 
+        if removed and not self._replaying:
             print(f"Удалено {removed} старых фактов для соблюдения лимита")
-            self.save_knowledge()
+
+    def _remove_from_key(self, key: str, fact: Dict):
+        """Убрать конкретный факт из списка ключа"""
+        fact_list = self.facts.get(key)
+        if fact_list is None:
+            return
+
+        # Внутри ключа факты тоже идут по времени, так что вытесняемый обычно первый
+        if fact_list and fact_list[0] is fact:
+            fact_list.pop(0)
+        else:
+            for i, item in enumerate(fact_list):
+                if item is fact:
+                    del fact_list[i]
+                    break
+            else:
+                return
+
+        self._total -= 1
+        self.index.remove_fact(id(fact), fact.get('fact', ''))
+        for listener in self._listeners:
+            listener.remove_fact(key, fact)
+        if not fact_list:
+            del self.facts[key]
+            self.index.remove_key(key.lower())
 
     def add_fact(self, key: str, fact: str, user_id: int, username: str = None):
         """
@@ -101,9 +331,6 @@ class KnowledgeManager:
         """
         key = key.lower().strip()
 
-        if key not in self.facts:
-            self.facts[key] = []
-
         fact_data = {
             'fact': fact,
             'added_by': user_id,
@@ -111,15 +338,29 @@ class KnowledgeManager:
             'timestamp': datetime.now().isoformat()
         }
 
+        self._apply_fact(key, fact_data)
+        self._journal_append({'op': 'fact', 'key': key, 'data': fact_data})
+        return True
+
+    def _apply_fact(self, key: str, fact_data: Dict):
+        """Добавить готовую запись факта в память"""
+        if key not in self.facts:
+            self.facts[key] = []
+            self.index.add_key(key.lower())
+
         # Добавляем факт (дубликаты тоже сохраняем)
         self.facts[key].append(fact_data)
-
-        # Проверяем лимит и удаляем старые при необходимости
+        self._order[id(fact_data)] = (key, fact_data)
+        self._total += 1
+        self.index.add_fact(id(fact_data), fact_data.get('fact', ''))
+        for listener in self._listeners:
+            listener.add_fact(key, fact_data)
+
+        # Проверяем лимит и удаляем старые при необходимости.
+        # Вытеснение детерминировано, поэтому при проигрывании журнала
+        # оно повторяется само и отдельной записи не требует.
         self.cleanup_old_facts()
 
-        self.save_knowledge()
-        return True
-
     def add_raw_message(self, message: str, user_id: int, username: str = None):
         """
         Добавить необработанное сообщение
@@ -163,7 +404,21 @@ class KnowledgeManager:
         query = query.lower().strip()
         results = []
 
-        for key, facts in self.facts.items():
+        # Кандидаты из индекса; None - индекс не помогает, проверяем всё
+        keys_with_query = self.index.keys_with(query)
+        keys_inside_query = self.index.keys_inside(query)
+        facts_with_query = self.index.facts_with(query)
+
+        if keys_with_query is None or keys_inside_query is None or facts_with_query is None:
+            candidate_keys = list(self.facts)
+        else:
+            candidate_keys = keys_with_query | keys_inside_query
+            candidate_keys.update(self._order[fact_id][0] for fact_id in facts_with_query)
+            # Порядок ключей как в self.facts, чтобы при равной релевантности ничего не менялось
+            candidate_keys = [key for key in self.facts if key in candidate_keys]
+
+        for key in candidate_keys:
+            facts = self.facts[key]
             key_lower = key.lower()
             relevance = 0
             
@@ -179,6 +434,8 @@ class KnowledgeManager:
             
             # Проверяем совпадения в фактах
             for fact in facts:
+                if facts_with_query is not None and id(fact) not in facts_with_query:
+                    continue
                 fact_text = fact.get('fact', '').lower()
                 if query in fact_text:
                     relevance += 10
@@ -206,65 +463,114 @@ class KnowledgeManager:
             # Проверяем, является ли пользователь автором
             for fact in self.facts[key]:
                 if fact['added_by'] == user_id:
-                    self.facts[key].remove(fact)
-                    if not self.facts[key]:
-                        del self.facts[key]
-                    self.save_knowledge()
+                    self._order.pop(id(fact), None)
+                    self._remove_from_key(key, fact)
+                    self._journal_append({'op': 'delete_fact', 'key': key, 'user_id': user_id})
                     return True
 
         return False
 
-    def get_context_for_prompt(self, query: str = "") -> str:
+    def _in_window(self, key: str, fact: Dict) -> bool:
+        """Входит ли факт в последние CONTEXT_WINDOW фактов своего ключа"""
+        return any(f is fact for f in self.facts.get(key, [])[-self.CONTEXT_WINDOW:])
+
+    def _recent_window_facts(self, limit: int) -> List[Dict]:
+        """Самые свежие факты из окна ключей (очередь _order идет по времени)"""
+        result = []
+        for key, fact in reversed(self._order.values()):
+            if self._in_window(key, fact):
+                result.append({'key': key, 'fact': fact})
+                if len(result) >= limit:
+                    break
+        result.sort(key=lambda x: x['fact'].get('timestamp', ''), reverse=True)
+        return result
+
+    @staticmethod
+    def search_words(query: str) -> List[str]:
+        """Слова запроса для поиска релевантных фактов"""
+        return [word for word in query.lower().split() if len(word) > 2]  # Игнорируем короткие слова
+
+    def _relevant_window_facts(self, query: str, words: Optional[List[str]] = None) -> List[Dict]:
+        """Факты из окна ключей с ненулевой релевантностью, лучшие первые"""
+        if words is None:
+            words = self.search_words(query)
+        if not words:
+            return []
+
+        # Кандидаты из индекса: факты с подходящим ключом или текстом
+        candidates: Dict[int, Tuple[str, Dict]] = {}
+        for word in words:
+            keys = self.index.keys_with(word)
+            fact_ids = self.index.facts_with(word)
+            if keys is None or fact_ids is None:
+                keys, fact_ids = self.facts.keys(), ()
+
+            for key in keys:
+                for fact in self.facts.get(key, [])[-self.CONTEXT_WINDOW:]:
+                    candidates[id(fact)] = (key, fact)
+            for fact_id in fact_ids:
+                if fact_id not in candidates:
+                    key, fact = self._order[fact_id]
+                    if self._in_window(key, fact):
+                        candidates[fact_id] = (key, fact)
+
+        relevant = []
+        for key, fact in candidates.values():
+            key_lower = key.lower()
+            fact_text_lower = fact['fact'].lower()
+
+            # Подсчитываем релевантность
+            relevance = 0
+            for word in words:
+                if word in key_lower:
+                    relevance += 3  # Ключ более важен
+                if word in fact_text_lower:
+                    relevance += 1
+
+            if relevance > 0:
+                relevant.append({'key': key, 'fact': fact, 'relevance': relevance})
+
+        # Сортируем по релевантности, затем по времени
+        relevant.sort(key=lambda x: (x['relevance'], x['fact'].get('timestamp', '')), reverse=True)
+        return relevant
+
+    def get_context_for_prompt(self, query: str = "", words: Optional[List[str]] = None) -> str:
         """Получить контекст из фактов для добавления в промпт
         
         Args:
             query: Поисковый запрос для фильтрации релевантных фактов
+            words: Уже посчитанные search_words(query)
         """
-        if not self.facts:
-            return ""
+        return self.format_facts_context(self.get_context_facts(query, words))
 
-        # Собираем все факты и сортируем по времени
-        all_facts = []
-        for key, fact_list in self.facts.items():
-            for fact in fact_list[-3:]:  # Берем последние 3 для каждого ключа
-                all_facts.append({
-                    'key': key,
-                    'fact': fact,
-                    'relevance': 0
-                })
+    def get_context_facts(self, query: str = "", words: Optional[List[str]] = None) -> List[Dict]:
+        """Факты для промпта: сначала релевантные запросу (с 'relevance'), затем свежие
+
+        Args:
+            query: Поисковый запрос для фильтрации релевантных фактов
+            words: Уже посчитанные search_words(query)
+        """
+        if not self.facts:
+            return []
 
-        # Если есть запрос, ищем релевантные факты
+        # Берем последние CONTEXT_WINDOW фактов каждого ключа. Свежие факты
+        # идут с конца очереди добавления, релевантные - из индекса, так что
+        # вся база не перебирается и не сортируется на каждый запрос.
         if query:
-            query_lower = query.lower()
-            for item in all_facts:
-                key_lower = item['key'].lower()
-                fact_text_lower = item['fact']['fact'].lower()
-                
-                # Подсчитываем релевантность
-                relevance = 0
-                for word in query_lower.split():
-                    if len(word) > 2:  # Игнорируем короткие слова
-                        if word in key_lower:
-                            relevance += 3  # Ключ более важен
-                        if word in fact_text_lower:
-                            relevance += 1
-                
-                item['relevance'] = relevance
-            
-            # Сортируем по релевантности, затем по времени
-            all_facts.sort(key=lambda x: (x['relevance'], x['fact'].get('timestamp', '')), reverse=True)
-            # Берем топ 50 релевантных + 50 последних
-            relevant_facts = [f for f in all_facts if f['relevance'] > 0][:50]
-            recent_facts = sorted(all_facts, key=lambda x: x['fact'].get('timestamp', ''), reverse=True)[:50]
-            
+            relevant_facts = self._relevant_window_facts(query, words)[:50]
+            recent_facts = self._recent_window_facts(50)
+
             # Объединяем и убираем дубликаты
-            combined = {id(f): f for f in relevant_facts + recent_facts}
+            combined = {id(f['fact']): f for f in relevant_facts + recent_facts}
             facts_to_show = list(combined.values())[:100]
         else:
-            # Сортируем по времени (самые свежие первые)
-            all_facts.sort(key=lambda x: x['fact'].get('timestamp', ''), reverse=True)
-            facts_to_show = all_facts[:100]
+            # Самые свежие первые
+            facts_to_show = self._recent_window_facts(100)
+        return facts_to_show
 
+    @staticmethod
+    def format_facts_context(facts_to_show: List[Dict]) -> str:
+        """Текст блока фактов для промпта (факты сгруппированы по ключам)"""
         if not facts_to_show:
             return ""
 
@@ -303,18 +609,23 @@ class KnowledgeManager:
             value: Значение
             username: Имя пользователя
         """
-        if user_id not in self.user_info:
-            self.user_info[user_id] = {}
-
-        self.user_info[user_id][info_type] = {
+        data = {
             'value': value,
             'username': username,
             'timestamp': datetime.now().isoformat()
         }
 
-        self.save_knowledge()
+        self._apply_user_info(user_id, info_type, data)
+        self._journal_append({'op': 'user_info', 'user_id': user_id, 'type': info_type, 'data': data})
         return True
 
+    def _apply_user_info(self, user_id: int, info_type: str, data: Dict):
+        if user_id not in self.user_info:
+            self.user_info[user_id] = {}
+
+        self.user_info[user_id][info_type] = data
+        self._notify_change("user_info", user_id)
+
     def get_user_info(self, user_id: int) -> Dict:
         """Получить всю информацию о пользователе"""
         return self.user_info.get(user_id, {})
@@ -394,9 +705,6 @@ class KnowledgeManager:
         Returns:
             True если правило добавлено успешно
         """
-        if chat_id not in self.behavioral_rules:
-            self.behavioral_rules[chat_id] = []
-        
         rule_data = {
             'rule': rule,
             'added_by': user_id,
@@ -405,9 +713,16 @@ class KnowledgeManager:
             'active': True
         }
         
-        self.behavioral_rules[chat_id].append(rule_data)
-        self.save_knowledge()
+        self._apply_behavioral_rule(chat_id, rule_data)
+        self._journal_append({'op': 'rule', 'chat_id': chat_id, 'data': rule_data})
         return True
+
+    def _apply_behavioral_rule(self, chat_id: int, rule_data: Dict):
+        if chat_id not in self.behavioral_rules:
+            self.behavioral_rules[chat_id] = []
+
+        self.behavioral_rules[chat_id].append(rule_data)
+        self._notify_change("rules", chat_id)
     
     def get_behavioral_rules(self, chat_id: int) -> List[Dict]:
         """Получить активные поведенческие правила для чата
@@ -439,7 +754,8 @@ class KnowledgeManager:
         
         if 0 <= rule_index < len(self.behavioral_rules[chat_id]):
             self.behavioral_rules[chat_id][rule_index]['active'] = False
-            self.save_knowledge()
+            self._journal_append({'op': 'rule_off', 'chat_id': chat_id, 'index': rule_index})
+            self._notify_change("rules", chat_id)
             return True
         
         return False
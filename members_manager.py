@@ -3,14 +3,29 @@ from datetime import datetime, timedelta
 from typing import Dict, List, Optional
 import os
 
+from persistence import write_json_atomic
+
 class MembersManager:
-    """Менеджер для отслеживания активности участников"""
+    """Менеджер для отслеживания активности участников
+
+    Активность хранится по дням: activity[chat_id][YYYY-MM-DD][user_id] =
+    {'count', 'username'}, так что статистика за N дней читает не больше
+    N корзин. Корзины старше message_retention_days удаляются. В messages
+    остаются только последние MAX_MESSAGES сообщений (для экспорта).
+    """
 
-    def __init__(self, data_file: str = "members_data.json"):
+    MAX_MESSAGES = 1000
+
+    def __init__(self, data_file: str = "members_data.json", persistence=None, message_retention_days: int = 90):
         self.data_file = data_file
         self.members: Dict[int, Dict] = {}
         self.messages: List[Dict] = []
+        self.activity: Dict[int, Dict[str, Dict[int, Dict]]] = {}
+        self.message_retention_days = message_retention_days
+        self.persistence = persistence  # PersistenceService (без него - сохранение сразу)
         self.load_data()
+        if persistence:
+            persistence.register(self.data_file, self._snapshot_data)
 
     def load_data(self):
         """Загрузка данных из файла"""
@@ -18,22 +33,71 @@ class MembersManager:
             try:
                 with open(self.data_file, 'r', encoding='utf-8') as f:
                     data = json.load(f)
-                    self.members = data.get('members', {})
+                    # JSON хранит ключи строками - возвращаем int
+                    self.members = {int(user_id): member for user_id, member in data.get('members', {}).items()}
                     self.messages = data.get('messages', [])
+                    if 'activity' in data:
+                        self.activity = {
+                            int(chat_id): {
+                                day: {int(user_id): counter for user_id, counter in users.items()}
+                                for day, users in days.items()
+                            }
+                            for chat_id, days in data['activity'].items()
+                        }
+                    else:
+                        # Старый формат: собираем корзины из сохраненных сообщений
+                        for msg in self.messages:
+                            self._count_message(msg['chat_id'], msg['timestamp'][:10], msg['user_id'], msg.get('username'))
+                    self._prune_activity()
             except Exception as e:
                 print(f"Ошибка загрузки данных: {e}")
                 self.members = {}
                 self.messages = []
+                self.activity = {}
+
+    def _snapshot_data(self) -> Dict:
+        """Данные для записи в файл"""
+        return {
+            'members': self.members,
+            'messages': self.messages,
+            'activity': self.activity
+        }
+
+    @staticmethod
+    def _day_key(day: datetime) -> str:
+        return day.strftime("%Y-%m-%d")
+
+    def _count_message(self, chat_id: int, day: str, user_id: int, username: Optional[str]):
+        """Учесть сообщение в дневной корзине чата"""
+        users = self.activity.setdefault(chat_id, {}).setdefault(day, {})
+        if user_id not in users:
+            users[user_id] = {'count': 0, 'username': username or 'Unknown'}
+        users[user_id]['count'] += 1
+
+    def _prune_activity(self):
+        """Удалить корзины старше message_retention_days"""
+        cutoff = self._day_key(datetime.now() - timedelta(days=self.message_retention_days))
+        for chat_id in list(self.activity):
+            days = self.activity[chat_id]
+            for day in [day for day in days if day < cutoff]:
+                del days[day]
+            if not days:
+                del self.activity[chat_id]
+
+    def _recent_buckets(self, chat_id: int, days: int) -> List[Dict[int, Dict]]:
+        """Корзины чата за последние days дней (сегодня включительно), от старых к новым"""
+        chat_days = self.activity.get(chat_id, {})
+        today = datetime.now()
+        keys = (self._day_key(today - timedelta(days=offset)) for offset in range(days - 1, -1, -1))
+        return [chat_days[key] for key in keys if key in chat_days]
 
     def save_data(self):
         """Сохранение данных в файл"""
+        if self.persistence:
+            self.persistence.mark_dirty(self.data_file)
+            return
         try:
-            data = {
-                'members': self.members,
-                'messages': self.messages
-            }
-            with open(self.data_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            write_json_atomic(self.data_file, self._snapshot_data())
         except Exception as e:
             print(f"Ошибка сохранения данных: {e}")
 
@@ -68,19 +132,26 @@ class MembersManager:
             self.members[user_id]['message_count'] += 1
             self.members[user_id]['last_seen'] = datetime.now().isoformat()
 
+        now = datetime.now()
+        day = self._day_key(now)
+        if chat_id not in self.activity or day not in self.activity[chat_id]:
+            # Первое сообщение чата за день - самое время выбросить старые корзины
+            self._prune_activity()
+        self._count_message(chat_id, day, user_id, username)
+
         # Сохраняем сообщение
         message_data = {
             'user_id': user_id,
             'username': username,
             'chat_id': chat_id,
             'text': message_text[:500],  # Ограничиваем длину
-            'timestamp': datetime.now().isoformat()
+            'timestamp': now.isoformat()
         }
         self.messages.append(message_data)
 
-        # Ограничиваем количество сохраненных сообщений (последние 1000)
-        if len(self.messages) > 1000:
-            self.messages = self.messages[-1000:]
+        # Ограничиваем количество сохраненных сообщений
+        if len(self.messages) > self.MAX_MESSAGES:
+            del self.messages[:-self.MAX_MESSAGES]
 
         self.save_data()
 
@@ -89,26 +160,17 @@ class MembersManager:
         return self.members.get(user_id)
 
     def get_chat_stats(self, chat_id: int, days: int = 7) -> Dict:
-        """Получить статистику по чату за указанный период"""
-        cutoff_date = datetime.now() - timedelta(days=days)
-
-        # Фильтруем сообщения за период
-        recent_messages = [
-            msg for msg in self.messages
-            if msg['chat_id'] == chat_id and
-            datetime.fromisoformat(msg['timestamp']) > cutoff_date
-        ]
-
-        # Считаем активность пользователей
+        """Получить статистику по чату за указанный период (последние days календарных дней)"""
+        # Складываем счетчики дневных корзин; имя - из самой ранней корзины
         user_activity = {}
-        for msg in recent_messages:
-            user_id = msg['user_id']
-            if user_id not in user_activity:
-                user_activity[user_id] = {
-                    'count': 0,
-                    'username': msg.get('username', 'Unknown')
-                }
-            user_activity[user_id]['count'] += 1
+        for bucket in self._recent_buckets(chat_id, days):
+            for user_id, counter in bucket.items():
+                if user_id not in user_activity:
+                    user_activity[user_id] = {
+                        'count': 0,
+                        'username': counter['username']
+                    }
+                user_activity[user_id]['count'] += counter['count']
 
         # Сортируем по активности
         top_users = sorted(
@@ -118,17 +180,19 @@ class MembersManager:
         )[:10]  # Топ-10
 
         return {
-            'total_messages': len(recent_messages),
+            'total_messages': sum(activity['count'] for activity in user_activity.values()),
             'unique_users': len(user_activity),
             'period_days': days,
             'top_users': top_users
         }
 
-    def get_members_list(self, chat_id: int = None) -> List[Dict]:
-        """Получить список участников"""
+    def get_members_list(self, chat_id: int = None, days: int = 7) -> List[Dict]:
+        """Получить список участников (для чата - писавших за последние days дней)"""
         if chat_id:
             # Фильтруем по чату
-            user_ids = set(msg['user_id'] for msg in self.messages if msg['chat_id'] == chat_id)
+            user_ids = set()
+            for bucket in self._recent_buckets(chat_id, days):
+                user_ids.update(bucket)
             return [self.members[uid] for uid in user_ids if uid in self.members]
         return list(self.members.values())
 
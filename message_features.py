@@ -0,0 +1,112 @@
+"""
+Признаки входящего сообщения, вычисляемые один раз на апдейт
+"""
+import re
+from typing import Callable, Dict, List, Optional
+
+BOT_NAMES = ['чупапи', 'чупа', 'чупик']
+BOT_NAME_RE = re.compile(r'\b(чупапи|чупа|чупик)(?:\s|,|!|\?|:|$)')
+BOT_NAME_STRIP_RES = [re.compile(rf'\b{word}\b(?:\s+|,\s*)', re.IGNORECASE) for word in BOT_NAMES]
+
+# Просьбы о начислении очков
+RATING_REQUEST_RES = [re.compile(p) for p in (
+    r'дай\s+(?:мне\s+)?(?:\d+\s+)?очк',  # дай очки, дай 5 очков
+    r'начисл[и|ь]\s+(?:мне\s+)?(?:\d+\s+)?(?:рейтинг|очк)',  # начисли очки, начисли рейтинг
+    r'добав[ь|и]\s+(?:мне\s+)?(?:\d+\s+)?(?:рейтинг|очк)',  # добавь очки
+    r'очк[и|а|ов]\s+(?:плиз|пожалуйста)',  # очки плиз, очки пожалуйста
+    r'начисл(?:и|ь)\s+(?:мне\s+)?рейтинг',  # начисли рейтинг
+    r'плюс\s+\d+\s+(?:рейтинг|очк)',  # плюс 5 очков
+)]
+RATING_POINTS_RE = re.compile(r'(\d+)\s+(?:очк|рейтинг)')
+MENTION_RE = re.compile(r'@(\w+)')
+RATING_TARGET_RE = re.compile(r'(?:дай|начисл|добав|плюс)\s+(?:\d+\s+)?(?:очк|рейтинг)?\s*(?:для\s+)?(\w+)')
+
+
+class MessageFeatures:
+    """Нормализованный текст и результаты детекторов для одного сообщения
+
+    Собирается в handle_message и передается дальше, чтобы обращение к
+    боту, просьба об очках, сентимент, намерение и сущности считались
+    один раз, а не в каждом обработчике заново.
+
+    Поля исходного сообщения (text, lower, words, адресация, просьба об
+    очках) считаются сразу. Текст для ответа (reply_text) - это сообщение
+    без обращения к боту; детекторы SmartLocalAI прогоняются по нему
+    лениво при первом чтении analysis.
+    """
+
+    def __init__(self, text: str, analyzer: Callable[[str], Dict], bot_username: Optional[str] = None):
+        """
+        Args:
+            text: Текст сообщения
+            analyzer: Функция анализа текста (SmartLocalAI.analyze)
+            bot_username: Username бота для поиска @упоминания
+        """
+        self.text = text.strip()
+        self.lower = self.text.lower()
+        self.words: List[str] = self.text.split()
+        self._analyzer = analyzer
+
+        # Обращение к боту
+        self.bot_mention = f"@{bot_username}" if bot_username else None
+        self.mentions_bot = bool(self.bot_mention) and self.bot_mention in self.lower
+        self.addresses_bot = BOT_NAME_RE.search(self.lower) is not None
+
+        # Просьба о начислении очков
+        self.rating_request = any(p.search(self.lower) for p in RATING_REQUEST_RES)
+        self.rating_points = 1
+        self.rating_mention: Optional[str] = None
+        self.rating_target: Optional[str] = None
+        if self.rating_request:
+            points_match = RATING_POINTS_RE.search(self.lower)
+            if points_match:
+                self.rating_points = int(points_match.group(1))
+            mention_match = MENTION_RE.search(self.text)
+            if mention_match:
+                self.rating_mention = mention_match.group(1)
+            target_match = RATING_TARGET_RE.search(self.text)
+            if target_match:
+                self.rating_target = target_match.group(1)
+
+        self.set_reply_text(self.text)
+
+    def set_reply_text(self, text: str):
+        """Задать текст, на который отвечает бот (сбрасывает результаты детекторов)"""
+        self.reply_text = text
+        self.reply_lower = text.lower()
+        self.search_words = [word for word in self.reply_lower.split() if len(word) > 2]  # как KnowledgeManager.search_words
+        self._analysis: Optional[Dict] = None
+
+    def strip_bot_mention(self):
+        """Убрать @упоминание бота из текста ответа"""
+        self.set_reply_text(self.reply_text.replace(self.bot_mention, "").strip())
+
+    def strip_bot_name(self):
+        """Убрать обращение к боту по имени из текста ответа"""
+        text = self.reply_text
+        for pattern in BOT_NAME_STRIP_RES:
+            text = pattern.sub('', text).strip()
+        self.set_reply_text(text)
+
+    @property
+    def analysis(self) -> Dict:
+        """Результаты всех детекторов SmartLocalAI для текста ответа"""
+        if self._analysis is None:
+            self._analysis = self._analyzer(self.reply_text)
+        return self._analysis
+
+    @property
+    def sentiment(self) -> Optional[str]:
+        return self.analysis['sentiment']
+
+    @property
+    def intent(self) -> Optional[str]:
+        return self.analysis['intent']
+
+    @property
+    def entities(self) -> Dict[str, str]:
+        return self.analysis['entities']
+
+    @property
+    def tokens(self) -> List[str]:
+        return self.analysis['tokens']
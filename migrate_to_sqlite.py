@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Одноразовый перенос рейтинга, участников, ачивок и дневной статистики
+из JSON-файлов в SQLite (для STORAGE_BACKEND=sqlite)
+
+JSON-файлы не изменяются - остаются резервной копией.
+
+Запуск: python migrate_to_sqlite.py [--db bot_data.db] [--force]
+"""
+import argparse
+import json
+import os
+
+from sqlite_storage import SQLiteStorage
+
+
+def load_json(path: str):
+    if not os.path.exists(path):
+        print(f"⚠️  {path} не найден - пропускаю")
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def migrate_ratings(storage: SQLiteStorage, path: str) -> int:
+    data = load_json(path)
+    if not data:
+        return 0
+
+    history = data.get('history', {})
+    count = 0
+    for chat_id, users in data.get('ratings', {}).items():
+        for user_id, rating in users.items():
+            user_history = history.get(chat_id, {}).get(user_id, [])
+            username = user_history[-1].get('username') if user_history else None
+            storage.execute(
+                "INSERT OR REPLACE INTO ratings (chat_id, user_id, rating, username) VALUES (?, ?, ?, ?)",
+                (int(chat_id), int(user_id), rating, username)
+            )
+            count += 1
+
+    for chat_id, users in history.items():
+        for user_id, items in users.items():
+            storage.conn.executemany(
+                "INSERT INTO rating_history (chat_id, user_id, timestamp, points, reason, username) VALUES (?, ?, ?, ?, ?, ?)",
+                [(int(chat_id), int(user_id), item.get('timestamp', ''), item.get('points', 0),
+                  item.get('reason', ''), item.get('username')) for item in items]
+            )
+    return count
+
+
+def migrate_members(storage: SQLiteStorage, path: str) -> int:
+    data = load_json(path)
+    if not data:
+        return 0
+
+    members = data.get('members', {})
+    for member in members.values():
+        storage.execute(
+            "INSERT OR REPLACE INTO members (user_id, username, first_name, last_name, message_count, first_seen, last_seen) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (int(member['id']), member.get('username'), member.get('first_name'), member.get('last_name'),
+             member.get('message_count', 0), member.get('first_seen'), member.get('last_seen'))
+        )
+
+    storage.conn.executemany(
+        "INSERT INTO member_messages (user_id, username, chat_id, text, timestamp) VALUES (?, ?, ?, ?, ?)",
+        [(msg['user_id'], msg.get('username'), msg['chat_id'], msg.get('text', ''), msg['timestamp'])
+         for msg in data.get('messages', [])]
+    )
+    return len(members)
+
+
+def migrate_achievements(storage: SQLiteStorage, path: str) -> int:
+    data = load_json(path)
+    if not data:
+        return 0
+
+    count = 0
+    for chat_id, users in data.items():
+        for user_id, achievements in users.items():
+            for achievement_id, info in achievements.items():
+                storage.execute(
+                    "INSERT OR IGNORE INTO achievements (chat_id, user_id, achievement_id, unlocked_at) VALUES (?, ?, ?, ?)",
+                    (int(chat_id), int(user_id), achievement_id, info.get('unlocked_at'))
+                )
+                count += 1
+    return count
+
+
+def migrate_daily_stats(storage: SQLiteStorage, path: str) -> int:
+    data = load_json(path)
+    if not data:
+        return 0
+
+    count = 0
+    for chat_id, days in data.items():
+        for date, stats in days.items():
+            storage.execute(
+                "INSERT OR REPLACE INTO daily_stats (chat_id, date, messages, rating_points, manual_grant_points) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (int(chat_id), date, stats.get('messages', 0), stats.get('rating_points', 0),
+                 stats.get('manual_grant_points', 0))
+            )
+            count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="bot_data.db", help="Файл базы SQLite")
+    parser.add_argument("--ratings", default="ratings.json")
+    parser.add_argument("--members", default="members_data.json")
+    parser.add_argument("--achievements", default="achievements.json")
+    parser.add_argument("--daily-stats", default="daily_stats.json")
+    parser.add_argument("--force", action="store_true", help="Переносить, даже если в базе уже есть данные")
+    args = parser.parse_args()
+
+    storage = SQLiteStorage(args.db)
+    tables = ("ratings", "rating_history", "members", "member_messages", "achievements", "daily_stats")
+    existing = sum(storage.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in tables)
+    if existing and not args.force:
+        print(f"❌ В {args.db} уже есть данные ({existing} строк). Повторный перенос создаст дубли истории.")
+        print("   Удалите базу или запустите с --force.")
+        return
+
+    print(f"🔄 Перенос данных в {args.db}...")
+    try:
+        with storage.transaction():
+            ratings = migrate_ratings(storage, args.ratings)
+            members = migrate_members(storage, args.members)
+            achievements = migrate_achievements(storage, args.achievements)
+            days = migrate_daily_stats(storage, args.daily_stats)
+    except Exception as e:
+        print(f"❌ Ошибка переноса, база не изменена: {e}")
+        return
+    finally:
+        storage.close()
+
+    print(f"✅ Рейтинги: {ratings}, участники: {members}, ачивки: {achievements}, дни статистики: {days}")
+    print("Теперь можно запускать бота с STORAGE_BACKEND=sqlite")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Выбор модели GLM для запроса: быстрая для коротких реплик, большая для сложных задач
+"""
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Sequence
+
+from glm_resilience import LatencyTracker
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограммы задержек, сек (последняя корзина - всё, что дольше)
+LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 20, 60)
+
+
+class ModelStats:
+    """Скользящее окно запросов к одной модели: задержки, ошибки и гистограмма"""
+
+    def __init__(self, window: int = 100, min_samples: int = 10):
+        """
+        Args:
+            window: Сколько последних запросов учитывать
+            min_samples: Меньше ответов - задержку модели считаем неизвестной
+        """
+        self.latency = LatencyTracker(window=window, min_samples=min_samples)
+        self.outcomes: Deque[bool] = deque(maxlen=window)  # True - успех
+        self.histogram: List[int] = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.requests = 0
+        self.errors = 0
+        self.last_chosen = 0.0  # time.monotonic() последнего выбора модели
+
+    def record(self, seconds: float, ok: bool):
+        self.requests += 1
+        self.outcomes.append(ok)
+        if not ok:
+            self.errors += 1
+            return
+        self.latency.record(seconds)
+        bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound), len(LATENCY_BUCKETS))
+        self.histogram[bucket] += 1
+
+    def error_rate(self) -> float:
+        """Доля ошибок в окне (0, пока запросов не было)"""
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def stats(self) -> Dict:
+        p50 = self.latency.percentile(0.5)
+        p95 = self.latency.percentile(0.95)
+        labels = [f"<={bound}s" for bound in LATENCY_BUCKETS] + [f">{LATENCY_BUCKETS[-1]}s"]
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "error_rate": round(self.error_rate(), 2),
+            "p50": round(p50, 2) if p50 is not None else None,
+            "p95": round(p95, 2) if p95 is not None else None,
+            "histogram": {label: count for label, count in zip(labels, self.histogram) if count},
+        }
+
+
+class ModelRouter:
+    """Выбирает модель для запроса по его классу, размеру промпта и здоровью моделей
+
+    Модели разбиты на уровни (tiers: "fast" -> "glm-4-flash", "large" ->
+    "glm-4.6"). Для класса запроса (random_reaction, silence_hook,
+    simple_reply, complex_task) routes задает уровни в порядке
+    предпочтения; класс без маршрута идет на default_tier.
+
+    Берется первый подходящий уровень из маршрута. Уровень не подходит, если
+    промпт длиннее его max_prompt_chars (быстрая модель плохо держит длинный
+    контекст) или модель сейчас нездорова: в окне последних запросов больше
+    max_error_rate ошибок или медианная задержка выше бюджета класса
+    (latency_budgets). Если не подходит ни один - берется тот, у кого меньше
+    ошибок и быстрее ответы.
+
+    Нездоровой модели раз в probe_interval секунд все равно отдается
+    запрос - иначе ее окно не обновится и она не вернется в строй.
+    """
+
+    def __init__(self, tiers: Dict[str, str], routes: Dict[str, Sequence[str]], default_tier: str = "large",
+                 latency_budgets: Optional[Dict[str, float]] = None,
+                 max_prompt_chars: Optional[Dict[str, int]] = None,
+                 max_error_rate: float = 0.3, window: int = 100, probe_interval: float = 30.0):
+        """
+        Args:
+            tiers: Уровень -> имя модели
+            routes: Класс запроса -> уровни в порядке предпочтения
+            default_tier: Уровень для классов без маршрута
+            latency_budgets: Класс запроса -> допустимая медианная задержка модели, сек
+            max_prompt_chars: Уровень -> максимальная длина промпта в символах
+            max_error_rate: Доля ошибок в окне, при которой модель считается нездоровой
+            window: Сколько последних запросов к модели учитывать
+            probe_interval: Как часто пробовать нездоровую модель, сек
+        """
+        self.tiers = dict(tiers)
+        self.routes = {request_class: tuple(route) for request_class, route in routes.items()}
+        self.default_tier = default_tier
+        self.latency_budgets = dict(latency_budgets or {})
+        self.max_prompt_chars = dict(max_prompt_chars or {})
+        self.max_error_rate = max_error_rate
+        self.window = window
+        self.probe_interval = probe_interval
+
+        self.models: Dict[str, ModelStats] = {}
+        self.routed: Dict[str, Dict[str, int]] = {}  # класс -> модель -> сколько раз выбрана
+
+    def _stats_for(self, model: str) -> ModelStats:
+        if model not in self.models:
+            self.models[model] = ModelStats(window=self.window)
+        return self.models[model]
+
+    def latency_for(self, model: str) -> LatencyTracker:
+        """Окно задержек модели (для хеджирования запросов к ней)"""
+        return self._stats_for(model).latency
+
+    def _healthy(self, model: str, budget: Optional[float]) -> bool:
+        stats = self._stats_for(model)
+        if stats.error_rate() > self.max_error_rate:
+            return False
+        p50 = stats.latency.percentile(0.5)
+        return budget is None or p50 is None or p50 <= budget
+
+    def choose(self, request_class: Optional[str], prompt_chars: int) -> str:
+        """
+        Модель для запроса
+
+        Args:
+            request_class: Класс запроса (без маршрута - default_tier)
+            prompt_chars: Длина всех сообщений запроса в символах
+        """
+        route = self.routes.get(request_class) or (self.default_tier,)
+        fitting = [tier for tier in route
+                   if prompt_chars <= self.max_prompt_chars.get(tier, prompt_chars) and tier in self.tiers]
+        candidates = [self.tiers[tier] for tier in fitting] or [self.tiers.get(route[-1], self.tiers[self.default_tier])]
+
+        now = time.monotonic()
+        budget = self.latency_budgets.get(request_class)
+        model = next((m for m in candidates if self._healthy(m, budget)), None)
+        if model is None:
+            model = min(candidates, key=lambda m: (
+                self._stats_for(m).error_rate(), self._stats_for(m).latency.percentile(0.5) or 0.0))
+        preferred = self._stats_for(candidates[0])
+        if model != candidates[0] and now - preferred.last_chosen >= self.probe_interval:
+            logger.info(f"[GLM_ROUTER] {request_class}: probing degraded {candidates[0]}")
+            model = candidates[0]
+        elif model != candidates[0]:
+            logger.info(f"[GLM_ROUTER] {request_class}: {candidates[0]} is degraded, using {model}")
+        self._stats_for(model).last_chosen = now
+
+        per_class = self.routed.setdefault(request_class or "default", {})
+        per_class[model] = per_class.get(model, 0) + 1
+        return model
+
+    def record(self, model: str, seconds: float, ok: bool):
+        """Учесть результат запроса к модели"""
+        self._stats_for(model).record(seconds, ok)
+
+    def stats(self) -> Dict:
+        """Выбор моделей по классам и задержки по моделям"""
+        return {
+            "routed": {request_class: dict(models) for request_class, models in self.routed.items()},
+            "models": {model: stats.stats() for model, stats in self.models.items()},
+        }
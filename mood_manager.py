@@ -1,57 +1,109 @@
 import json
 import os
 import random
+import time
 from datetime import datetime, timedelta
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
+
+from persistence import write_json_atomic
 
 class MoodManager:
-    """Управление персистентным настроением бота"""
+    """Управление персистентным настроением бота
+
+    Настроение чата хранится как (mood_score, energy, updated_at - секунды
+    epoch). Затухание к нейтралу считается по формуле при чтении, поэтому
+    чтение ничего не пишет, а на диск уходят только изменения от сентимента.
+    """
 
-    def __init__(self, state_file: str = "mood_state.json"):
+    # Каждые 5 минут: -0.5 к абсолютному значению настроения (стремится к 0)
+    SCORE_DECAY_PER_SECOND = 0.5 / (5 * 60)
+    # Энергия восстанавливается до 5 за 30 минут
+    ENERGY_RECOVERY_PER_SECOND = 5 / (30 * 60)
+
+    def __init__(self, state_file: str = "mood_state.json", persistence=None):
         self.state_file = state_file
         self.mood_states = self._load_state()
-        self.last_decay = datetime.now()
+        self.persistence = persistence  # PersistenceService (без него - сохранение сразу)
+        if persistence:
+            persistence.register(self.state_file, lambda: self.mood_states)
 
     def _load_state(self) -> Dict:
         """Загрузить состояние настроения из файла"""
         if os.path.exists(self.state_file):
             try:
                 with open(self.state_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                    states = json.load(f)
             except Exception:
                 return {}
+            # Старый формат: время последнего обновления ISO-строкой
+            for mood in states.values():
+                if 'updated_at' not in mood:
+                    last_update = mood.pop('last_update', None)
+                    mood['updated_at'] = datetime.fromisoformat(last_update).timestamp() if last_update else time.time()
+            return states
         return {}
 
     def _save_state(self):
         """Сохранить состояние настроения в файл"""
+        if self.persistence:
+            self.persistence.mark_dirty(self.state_file)
+            return
         try:
-            with open(self.state_file, 'w', encoding='utf-8') as f:
-                json.dump(self.mood_states, f, ensure_ascii=False, indent=2)
+            write_json_atomic(self.state_file, self.mood_states)
         except Exception as e:
             print(f"Error saving mood state: {e}")
 
+    @staticmethod
+    def _new_mood() -> Dict:
+        return {
+            "mood_score": 0,
+            "energy": 5,
+            "updated_at": time.time(),
+            "messages_count": 0
+        }
+
     def get_or_create_mood(self, chat_id: int) -> Dict:
-        """Получить или создать настроение для чата"""
+        """Получить или создать настроение для чата (без затухания и без сохранения)"""
         chat_key = str(chat_id)
         if chat_key not in self.mood_states:
-            self.mood_states[chat_key] = {
-                "mood_score": 0,
-                "energy": 5,
-                "last_update": datetime.now().isoformat(),
-                "messages_count": 0
-            }
-            self._save_state()
+            self.mood_states[chat_key] = self._new_mood()
         return self.mood_states[chat_key]
 
+    def _decayed(self, mood: Dict, now: float) -> Tuple[float, float]:
+        """Настроение и энергия на момент now с учетом затухания"""
+        elapsed = max(now - mood['updated_at'], 0)
+
+        score = mood['mood_score']
+        decay_amount = elapsed * self.SCORE_DECAY_PER_SECOND
+        if score > 0:
+            score = max(score - decay_amount, 0)
+        elif score < 0:
+            score = min(score + decay_amount, 0)
+
+        energy = mood['energy']
+        if energy < 5:
+            energy = min(energy + elapsed * self.ENERGY_RECOVERY_PER_SECOND, 5)
+
+        return score, energy
+
+    def _current(self, chat_id: int) -> Tuple[float, float]:
+        """Текущие настроение и энергия чата (только чтение)"""
+        mood = self.mood_states.get(str(chat_id))
+        if mood is None:
+            mood = self._new_mood()
+        return self._decayed(mood, time.time())
+
     def update_mood(self, chat_id: int, sentiment: Optional[str], decay: bool = True):
         """Обновить настроение на основе сентимента"""
         mood = self.get_or_create_mood(chat_id)
+        now = time.time()
 
-        # Применить decay если нужно
+        # Зафиксировать накопленное затухание
         if decay:
-            self._apply_decay(chat_id)
+            mood['mood_score'], mood['energy'] = self._decayed(mood, now)
 
         # Изменить настроение на основе сентимента
+        changed = sentiment in ('joy', 'sadness', 'anger')
         if sentiment == 'joy':
             mood['mood_score'] = min(mood['mood_score'] + 1, 10)
             mood['energy'] = min(mood['energy'] + 0.5, 10)
@@ -62,47 +114,29 @@ class MoodManager:
             mood['mood_score'] = max(mood['mood_score'] - 0.5, -10)
             mood['energy'] = min(mood['energy'] + 1, 10)  # Раздражение даёт энергию
 
-        mood['last_update'] = datetime.now().isoformat()
+        mood['updated_at'] = now
         mood['messages_count'] = mood.get('messages_count', 0) + 1
 
         # Усталость после 50 сообщений
         if mood['messages_count'] >= 50:
             mood['energy'] = max(mood['energy'] - 1, 0)
             mood['messages_count'] = 0
+            changed = True
 
-        self._save_state()
-
-    def _apply_decay(self, chat_id: int):
-        """Применить затухание настроения к нейтралу"""
-        mood = self.get_or_create_mood(chat_id)
-
-        last_update = datetime.fromisoformat(mood['last_update'])
-        minutes_passed = (datetime.now() - last_update).total_seconds() / 60
-
-        # Каждые 5 минут: -0.5 к абсолютному значению (стремится к 0)
-        decay_amount = (minutes_passed / 5) * 0.5
-
-        if mood['mood_score'] > 0:
-            mood['mood_score'] = max(mood['mood_score'] - decay_amount, 0)
-        elif mood['mood_score'] < 0:
-            mood['mood_score'] = min(mood['mood_score'] + decay_amount, 0)
-
-        # Энергия восстанавливается за 30 минут
-        if mood['energy'] < 5:
-            mood['energy'] = min(mood['energy'] + (minutes_passed / 30) * 5, 5)
-
-        self._save_state()
+        # Без сентимента состояние восстанавливается по формуле - писать нечего,
+        # счетчик сообщений уйдет на диск со следующим изменением
+        if changed:
+            self._save_state()
 
     def get_mood_category(self, chat_id: int) -> str:
         """Получить категорию настроения"""
-        mood = self.get_or_create_mood(chat_id)
-        score = mood['mood_score']
+        score, _ = self._current(chat_id)
 
         if score >= 6:
             return "очень_радостное"
         elif score >= 2:
             return "радостное"
-        elif score >= -1 and score <= 1:
+        elif score >= -1:
             return "нейтральное"
         elif score >= -5:
             return "грустное"
@@ -111,7 +145,7 @@ class MoodManager:
 
     def get_mood_prompt_context(self, chat_id: int) -> str:
         """Получить текст для добавления в промпт GLM"""
-        mood = self.get_or_create_mood(chat_id)
+        _, energy = self._current(chat_id)
         category = self.get_mood_category(chat_id)
 
         mood_descriptions = {
@@ -122,7 +156,7 @@ class MoodManager:
             "очень_грустное": "Ты подавлен и грустен. Очень спокойный, сочувствующий тон. Предлагай поддержку и понимание."
         }
 
-        energy_level = "высокий" if mood['energy'] > 7 else "средний" if mood['energy'] > 3 else "низкий"
+        energy_level = "высокий" if energy > 7 else "средний" if energy > 3 else "низкий"
 
         context = f"\n📊 КОНТЕКСТ НАСТРОЕНИЯ:\n"
         context += f"Текущее настроение: {category.replace('_', ' ')}\n"
@@ -133,10 +167,12 @@ class MoodManager:
 
     def get_mood_info(self, chat_id: int) -> Dict:
         """Получить полную информацию о настроении"""
-        mood = self.get_or_create_mood(chat_id)
+        score, energy = self._current(chat_id)
+        mood = self.mood_states.get(str(chat_id))
+        updated_at = mood['updated_at'] if mood else time.time()
         return {
-            "score": mood['mood_score'],
-            "energy": mood['energy'],
+            "score": score,
+            "energy": energy,
             "category": self.get_mood_category(chat_id),
-            "last_update": mood['last_update']
+            "last_update": datetime.fromtimestamp(updated_at).isoformat()
         }
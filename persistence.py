@@ -0,0 +1,87 @@
+"""
+Фоновое сохранение JSON-менеджеров: изменения копятся и пишутся пачкой
+"""
+import asyncio
+import json
+import logging
+import os
+from typing import Callable, Dict, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def write_json_atomic(path: str, data, indent: Optional[int] = 2):
+    """Записать JSON через временный файл и rename - файл никогда не бывает наполовину записан"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent)
+    os.replace(tmp_path, path)
+
+
+def _write_encoded(path: str, encoded: str, indent: Optional[int]):
+    """Запись в потоке: красивое форматирование (медленный Python-кодировщик) + атомарная замена"""
+    if indent is not None:
+        encoded = json.dumps(json.loads(encoded), ensure_ascii=False, indent=indent)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(encoded)
+    os.replace(tmp_path, path)
+
+
+class PersistenceService:
+    """Отложенное пакетное сохранение для всех JSON-менеджеров
+
+    Менеджер регистрирует файл и функцию, возвращающую данные для записи,
+    а при изменении только помечает файл "грязным". Фоновая задача раз в
+    flush_interval секунд сохраняет все грязные файлы: сколько бы изменений
+    ни накопилось, файл пишется один раз.
+
+    Снимок данных кодируется быстрым C-кодировщиком JSON прямо в цикле
+    событий - так он согласован, даже если менеджер тут же меняет данные.
+    Форматирование с отступами и запись на диск идут в отдельном потоке.
+    """
+
+    def __init__(self, flush_interval: float = 0.5):
+        """
+        Args:
+            flush_interval: Как часто сбрасывать изменения на диск, сек
+        """
+        self.flush_interval = flush_interval
+        self._targets: Dict[str, Tuple[Callable[[], object], Optional[int]]] = {}  # путь -> (снимок, отступ)
+        self._dirty: Set[str] = set()
+        self._running = False
+        self._lock = asyncio.Lock()  # Один сброс за раз - иначе два потока пишут один .tmp
+
+    def register(self, path: str, snapshot: Callable[[], object], indent: Optional[int] = 2):
+        """Зарегистрировать файл и функцию, возвращающую данные для записи"""
+        self._targets[path] = (snapshot, indent)
+
+    def mark_dirty(self, path: str):
+        """Отметить, что файл нужно сохранить при ближайшем сбросе"""
+        self._dirty.add(path)
+
+    async def flush(self):
+        """Сохранить все грязные файлы"""
+        async with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            for path in dirty:
+                snapshot, indent = self._targets[path]
+                try:
+                    encoded = json.dumps(snapshot(), ensure_ascii=False)
+                    await asyncio.to_thread(_write_encoded, path, encoded, indent)
+                except Exception as e:
+                    logger.error(f"Ошибка сохранения {path}: {e}")
+                    self._dirty.add(path)  # Попробуем в следующий раз
+
+    async def run(self):
+        """Фоновый цикл сброса изменений"""
+        self._running = True
+        logger.info(f"Persistence loop started (interval {self.flush_interval}s)")
+        while self._running:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def close(self):
+        """Остановить фоновый цикл и сохранить все, что не успело сохраниться"""
+        self._running = False
+        await self.flush()
@@ -0,0 +1,83 @@
+"""
+Кэш редко меняющихся частей промпта GLM (персона, правила чата, профили пользователей)
+"""
+from collections import OrderedDict
+from typing import Callable, Dict
+
+
+class PromptSegmentCache:
+    """Готовые куски промпта по чатам и пользователям
+
+    Персона со стилем и ролью чата и его поведенческие правила меняются
+    только через настройки и команды, профиль пользователя - когда бот
+    узнает о нем новое. Куски собираются один раз и отдаются одним и тем же
+    объектом строки, пока их не сбросят: invalidate_chat вызывается при
+    изменении настроек или правил чата, invalidate_user - профиля. Так
+    начало промпта повторяется байт в байт и попадает в кэш префиксов у
+    провайдера.
+
+    Подписывается на SettingsManager и KnowledgeManager через их
+    add_change_listener.
+    """
+
+    def __init__(self, max_users: int = 1000):
+        """
+        Args:
+            max_users: Сколько профилей пользователей держать (самые давние вытесняются)
+        """
+        self.max_users = max_users
+        self._chats: Dict[int, Dict[str, str]] = {}  # chat_id -> имя куска -> текст
+        self._users: "OrderedDict[int, str]" = OrderedDict()  # user_id -> контекст профиля
+
+        # Метрики
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def chat_segment(self, chat_id: int, name: str, build: Callable[[], str]) -> str:
+        """Кусок промпта чата (build вызывается, только если его нет в кэше)"""
+        segments = self._chats.setdefault(chat_id, {})
+        if name in segments:
+            self.hits += 1
+            return segments[name]
+        self.misses += 1
+        segments[name] = build()
+        return segments[name]
+
+    def user_segment(self, user_id: int, build: Callable[[], str]) -> str:
+        """Контекст профиля пользователя (build вызывается, только если его нет в кэше)"""
+        if user_id in self._users:
+            self.hits += 1
+            self._users.move_to_end(user_id)
+            return self._users[user_id]
+        self.misses += 1
+        self._users[user_id] = build()
+        if len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+        return self._users[user_id]
+
+    def invalidate_chat(self, chat_id: int):
+        """Сбросить куски чата (изменились настройки или правила)"""
+        if self._chats.pop(chat_id, None) is not None:
+            self.invalidations += 1
+
+    def invalidate_user(self, user_id: int):
+        """Сбросить профиль пользователя"""
+        if self._users.pop(user_id, None) is not None:
+            self.invalidations += 1
+
+    def on_knowledge_change(self, kind: str, target_id: int):
+        """Слушатель KnowledgeManager: kind "rules" - правила чата, "user_info" - профиль"""
+        if kind == "rules":
+            self.invalidate_chat(target_id)
+        elif kind == "user_info":
+            self.invalidate_user(target_id)
+
+    def stats(self) -> Dict:
+        return {
+            "chats": len(self._chats),
+            "users": len(self._users),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,250 @@
+"""
+Сборка промпта GLM в бюджет токенов: секции с бюджетами и приоритетами
+"""
+import logging
+import math
+import string
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Кириллица (U+0400-U+04FF) в UTF-8 - два байта с первым байтом D0-D3
+CYRILLIC_LEAD_BYTES = (b"\xd0", b"\xd1", b"\xd2", b"\xd3")
+ASCII_WHITESPACE = string.whitespace.encode()
+ASCII_ALNUM = (string.ascii_letters + string.digits).encode()
+
+# Служебные токены на одно сообщение чата (роль, разделители)
+MESSAGE_OVERHEAD = 4
+
+
+@lru_cache(maxsize=4096)
+def estimate_tokens(text: str) -> int:
+    """
+    Оценка числа токенов без токенизатора (с запасом)
+
+    Кириллица в токенизаторах GLM - около 3 символов на токен, латиница и
+    цифры - около 4, пунктуация и эмодзи - примерно токен на символ.
+    Результат запоминается: куски из PromptSegmentCache приходят одним и тем
+    же объектом строки, и повторная оценка персоны ничего не стоит.
+    """
+    if not text:
+        return 0
+    # Считаем по байтам (bytes.count/translate), без регулярок - оценка идет на каждый факт и реплику
+    encoded = text.encode("utf-8")
+    cyrillic = sum(encoded.count(lead) for lead in CYRILLIC_LEAD_BYTES)
+    ascii_text = text.encode("ascii", "ignore")
+    ascii_chars = ascii_text.translate(None, ASCII_WHITESPACE)
+    punctuation = len(ascii_chars.translate(None, ASCII_ALNUM))
+    latin = len(ascii_chars) - punctuation
+    non_ascii = len(text) - len(ascii_text)
+    other = punctuation + non_ascii - cyrillic  # Пунктуация, эмодзи и прочие символы
+    return math.ceil(cyrillic / 3 + latin / 4 + other)
+
+
+def message_tokens(message: Dict[str, str]) -> int:
+    """Оценка токенов одного сообщения истории"""
+    return estimate_tokens(message.get("content", "")) + MESSAGE_OVERHEAD
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Обрезать текст до max_tokens (по целым строкам, если получается)"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+    lines = text.split("\n")
+    while len(lines) > 1 and estimate_tokens("\n".join(lines)) > max_tokens:
+        lines.pop()
+    cut = "\n".join(lines)
+    while cut and estimate_tokens(cut) > max_tokens:
+        cut = cut[:int(len(cut) * 0.9)]
+    return cut
+
+
+class PromptSection:
+    """Часть промпта: текст или список элементов (факты, сообщения истории)"""
+
+    def __init__(self, name: str, priority: int, items: Sequence[Any],
+                 scores: Optional[Sequence[float]] = None,
+                 render: Optional[Callable[[List[Any]], str]] = None,
+                 cost: Optional[Callable[[Any], int]] = None,
+                 keep_last: int = 0, required: bool = False, is_text: bool = False):
+        self.name = name
+        self.priority = priority
+        self.items = list(items)
+        self.scores = list(scores) if scores is not None else [0.0] * len(self.items)
+        self.render = render
+        self.cost = cost or estimate_tokens
+        self.keep_last = keep_last
+        self.required = required
+        self.is_text = is_text
+        self.selected: List[int] = []  # Индексы оставленных элементов, от важных к менее важным
+        self.text = ""  # Текст текстовой секции после обрезки
+
+    def ranking(self) -> List[int]:
+        """Индексы элементов от самых важных: последние keep_last, затем по оценке, затем более новые"""
+        forced = set(range(max(0, len(self.items) - self.keep_last), len(self.items)))
+        return sorted(range(len(self.items)), key=lambda i: (i not in forced, -self.scores[i], -i))
+
+    def chosen(self) -> List[Any]:
+        """Оставленные элементы в исходном порядке"""
+        return [self.items[i] for i in sorted(self.selected)]
+
+    def tokens(self) -> int:
+        if self.is_text:
+            return estimate_tokens(self.text)
+        chosen = self.chosen()
+        if not chosen:
+            return 0
+        if self.render:
+            return estimate_tokens(self.render(chosen))
+        return sum(self.cost(item) for item in chosen)
+
+    def fit(self, budget: Optional[int]):
+        """Уложить секцию в свой бюджет (None - без ограничения)"""
+        if self.is_text:
+            text = self.items[0] if self.items else ""
+            self.text = text if budget is None or self.required else truncate_to_tokens(text, budget)
+            return
+
+        ranking = self.ranking()
+        if budget is None or self.required:
+            self.selected = ranking
+            return
+
+        # Жадно по важности: элемент, который не влезает, пропускаем - следующий может влезть
+        self.selected, spent = [], 0
+        for i in ranking:
+            cost = self.cost(self.items[i])
+            if spent + cost <= budget:
+                self.selected.append(i)
+                spent += cost
+        # Заголовки и группировка в render тоже стоят токенов
+        while self.selected and self.tokens() > budget:
+            self.selected.pop()
+
+    def shrink(self) -> bool:
+        """Убрать наименее важную часть (для общего лимита). False - убирать нечего"""
+        if self.required:
+            return False
+        if self.is_text:
+            if not self.text:
+                return False
+            self.text = ""
+            return True
+        if not self.selected:
+            return False
+        self.selected.pop()
+        return True
+
+
+class PackedPrompt:
+    """Результат сборки: содержимое секций и расход токенов по ним"""
+
+    def __init__(self, sections: List[PromptSection], budgets: Dict[str, Optional[int]], max_tokens: int):
+        self._sections = {section.name: section for section in sections}
+        self.max_tokens = max_tokens
+        self.usage = {
+            section.name: {
+                "tokens": section.tokens(),
+                "budget": budgets.get(section.name),
+                "kept": len(section.selected) if not section.is_text else int(bool(section.text)),
+                "total": len(section.items) if not section.is_text else int(bool(section.items and section.items[0])),
+            }
+            for section in sections
+        }
+        self.total_tokens = sum(usage["tokens"] for usage in self.usage.values())
+
+    def text(self, name: str) -> str:
+        """Текст секции (для списка - результат render)"""
+        section = self._sections.get(name)
+        if section is None:
+            return ""
+        if section.is_text:
+            return section.text
+        chosen = section.chosen()
+        return section.render(chosen) if section.render and chosen else ""
+
+    def items(self, name: str) -> List[Any]:
+        """Оставленные элементы секции в исходном порядке"""
+        section = self._sections.get(name)
+        return section.chosen() if section is not None else []
+
+    def describe(self) -> str:
+        """Расход токенов по секциям одной строкой (для логов)"""
+        parts = []
+        for name, usage in self.usage.items():
+            budget = f"/{usage['budget']}" if usage["budget"] is not None else ""
+            dropped = f" ({usage['kept']}/{usage['total']})" if usage["kept"] < usage["total"] else ""
+            parts.append(f"{name} {usage['tokens']}{budget}{dropped}")
+        return f"{self.total_tokens}/{self.max_tokens} tokens: " + ", ".join(parts)
+
+
+class PromptPacker:
+    """Собирает промпт из секций так, чтобы он уложился в max_tokens
+
+    Каждая секция сначала укладывается в свой бюджет (budgets[имя], None -
+    без ограничения): текст обрезается по строкам, а из списка (факты,
+    история) остаются самые важные элементы - по оценке релевантности, при
+    равной оценке более новые, последние keep_last элементов - в первую
+    очередь (урезаются последними). Если
+    в сумме все равно больше max_tokens, урезаются секции с наименьшим
+    приоритетом (больший номер) - по одному элементу, текст целиком.
+    Обязательные секции (required: персона, сообщение пользователя) не
+    урезаются никогда.
+    """
+
+    def __init__(self, max_tokens: int, budgets: Optional[Dict[str, Optional[int]]] = None):
+        """
+        Args:
+            max_tokens: Жесткий лимит входных токенов на запрос
+            budgets: Бюджет токенов для каждой секции
+        """
+        self.max_tokens = max_tokens
+        self.budgets = dict(budgets or {})
+        self.sections: List[PromptSection] = []
+
+    def add_text(self, name: str, text: str, priority: int, required: bool = False):
+        """Добавить текстовую секцию"""
+        self.sections.append(PromptSection(name, priority, [text or ""], required=required, is_text=True))
+
+    def add_items(self, name: str, items: Sequence[Any], priority: int,
+                  scores: Optional[Sequence[float]] = None,
+                  render: Optional[Callable[[List[Any]], str]] = None,
+                  cost: Optional[Callable[[Any], int]] = None, keep_last: int = 0):
+        """
+        Добавить секцию-список
+
+        Args:
+            name: Имя секции (ключ бюджета)
+            items: Элементы в порядке вывода
+            priority: Приоритет секции (меньше - важнее, урезается последней)
+            scores: Релевантность элементов (больше - важнее)
+            render: Как превратить оставленные элементы в текст
+            cost: Оценка токенов элемента (по умолчанию estimate_tokens)
+            keep_last: Сколько последних элементов оставлять всегда
+        """
+        self.sections.append(PromptSection(name, priority, items, scores, render, cost, keep_last))
+
+    def pack(self) -> PackedPrompt:
+        for section in self.sections:
+            section.fit(self.budgets.get(section.name))
+
+        # Общий лимит: урезаем с наименее важных секций (при равенстве - добавленные позже)
+        order = sorted(range(len(self.sections)), key=lambda i: (-self.sections[i].priority, -i))
+        total = sum(section.tokens() for section in self.sections)
+        for i in order:
+            section = self.sections[i]
+            tokens = section.tokens()
+            while total > self.max_tokens and section.shrink():
+                total -= tokens
+                tokens = section.tokens()
+                total += tokens
+            if total <= self.max_tokens:
+                break
+
+        packed = PackedPrompt(self.sections, self.budgets, self.max_tokens)
+        if packed.total_tokens > self.max_tokens:
+            logger.warning(f"[PROMPT] Required sections alone exceed the limit: {packed.describe()}")
+        return packed
@@ -0,0 +1,242 @@
+"""
+Общий ограничитель исходящих запросов к Telegram с приоритетами
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты отправки: меньше - раньше
+PRIORITY_REPLY = 0  # Прямые ответы пользователям (по умолчанию)
+PRIORITY_ANNOUNCEMENT = 1  # Объявления: очки, уровни, погода
+PRIORITY_PROACTIVE = 2  # Проактивные реплики: оживление чата, случайные реакции
+
+PRIORITY_NAMES = {PRIORITY_REPLY: "reply", PRIORITY_ANNOUNCEMENT: "announcement", PRIORITY_PROACTIVE: "proactive"}
+
+
+def priority(level: int) -> Dict:
+    """rate_limit_args для методов бота: bot.send_message(..., rate_limit_args=priority(PRIORITY_PROACTIVE))"""
+    return {"priority": level}
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        """Через сколько секунд появится целый токен (после refill)"""
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class PriorityRateLimiter(BaseRateLimiter[Dict]):
+    """Ограничитель запросов python-telegram-bot: общий и по чатам, с приоритетами
+
+    Все запросы бота с chat_id (сообщения, правки, "печатает") ждут токен
+    в общем ведре (лимит Telegram на бота) и в ведре своего чата (лимит на
+    чат, в группах строже). Ожидающие запросы выпускаются по приоритету:
+    ответы пользователям раньше объявлений, объявления раньше проактивных
+    реплик. Приоритет передается через rate_limit_args (см. priority()).
+
+    При 429 (RetryAfter) все отправки приостанавливаются на указанное
+    Telegram время, и запрос повторяется до max_retries раз.
+
+    stats() - глубина очереди по приоритетам, время ожидания и число 429.
+    """
+
+    BUCKET_CLEANUP_THRESHOLD = 1000  # Чистить полные ведра чатов, когда их больше
+
+    def __init__(self, overall_rate: float = 30, private_chat_rate: float = 1,
+                 group_chat_per_minute: float = 20, chat_burst: float = 3, max_retries: int = 3):
+        """
+        Args:
+            overall_rate: Запросов в секунду на всего бота
+            private_chat_rate: Запросов в секунду в личный чат
+            group_chat_per_minute: Запросов в минуту в группу
+            chat_burst: Сколько запросов подряд можно отправить в чат без ожидания
+            max_retries: Сколько раз повторять запрос после RetryAfter
+        """
+        self.overall = TokenBucket(overall_rate, overall_rate)
+        self.private_chat_rate = private_chat_rate
+        self.group_chat_rate = group_chat_per_minute / 60
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+
+        self._chat_buckets: Dict[Union[int, str], TokenBucket] = {}
+        self._waiting: List[tuple] = []  # (приоритет, номер, chat_id, future)
+        self._counter = itertools.count()
+        self._wake: Optional[asyncio.Event] = None
+        self._pump_task: Optional[asyncio.Task] = None
+        self._paused_until = 0.0
+
+        # Метрики
+        self._sent: Dict[int, int] = {}
+        self._wait_total: Dict[int, float] = {}
+        self._wait_max: Dict[int, float] = {}
+        self._flood_waits = 0
+
+    async def initialize(self):
+        self._wake = asyncio.Event()
+        self._pump_task = asyncio.create_task(self._pump())
+
+    async def shutdown(self):
+        if self._pump_task:
+            self._pump_task.cancel()
+            await asyncio.gather(self._pump_task, return_exceptions=True)
+            self._pump_task = None
+        for *_, future in self._waiting:
+            if not future.done():
+                future.cancel()
+        self._waiting.clear()
+
+    def _chat_bucket(self, chat_id: Union[int, str]) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            # Отрицательные id и @username - группы и каналы
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            rate = self.group_chat_rate if is_group else self.private_chat_rate
+            bucket = self._chat_buckets[chat_id] = TokenBucket(rate, self.chat_burst)
+        return bucket
+
+    def _cleanup_buckets(self, now: float):
+        """Убрать ведра чатов, которые успели наполниться - они равны новым"""
+        for chat_id in list(self._chat_buckets):
+            bucket = self._chat_buckets[chat_id]
+            bucket.refill(now)
+            if bucket.tokens >= bucket.capacity:
+                del self._chat_buckets[chat_id]
+
+    async def _pump(self):
+        """Выдавать токены ожидающим запросам в порядке приоритета"""
+        while True:
+            if not self._waiting:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+
+            now = time.monotonic()
+            delay = self._paused_until - now
+            if delay <= 0:
+                self.overall.refill(now)
+                delay = self.overall.wait_time()
+
+            if delay <= 0:
+                # Самый приоритетный запрос, чей чат не исчерпал лимит
+                delay = float('inf')
+                for entry in sorted(self._waiting):
+                    chat_id, future = entry[2], entry[3]
+                    if future.done():  # Запрос отменили, пока он ждал
+                        self._waiting.remove(entry)
+                        heapq.heapify(self._waiting)
+                        delay = 0
+                        break
+                    bucket = self._chat_bucket(chat_id)
+                    bucket.refill(now)
+                    if bucket.tokens >= 1:
+                        bucket.tokens -= 1
+                        self.overall.tokens -= 1
+                        self._waiting.remove(entry)
+                        heapq.heapify(self._waiting)
+                        future.set_result(None)
+                        delay = 0
+                        break
+                    delay = min(delay, bucket.wait_time())
+                else:
+                    if len(self._chat_buckets) > self.BUCKET_CLEANUP_THRESHOLD:
+                        self._cleanup_buckets(now)
+
+            if delay > 0:
+                # Проснуться по таймеру или раньше, если пришел новый запрос
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(0)
+
+    async def _acquire(self, chat_id: Union[int, str], level: int):
+        """Дождаться разрешения на отправку в чат"""
+        if self._pump_task is None:
+            await self.initialize()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (level, next(self._counter), chat_id, future))
+        self._wake.set()
+        await future
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict[str, Any], List[Dict[str, Any]], None]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Dict],
+    ) -> Union[bool, Dict[str, Any], List[Dict[str, Any]], None]:
+        chat_id = data.get("chat_id")
+        level = (rate_limit_args or {}).get("priority", PRIORITY_REPLY)
+
+        attempt = 0
+        while True:
+            if chat_id is not None:
+                start = time.monotonic()
+                await self._acquire(chat_id, level)
+                self._record_wait(level, time.monotonic() - start)
+
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                retry_after = retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+                self._flood_waits += 1
+                logger.warning(f"[RATE_LIMIT] Flood wait {retry_after:.0f}s on {endpoint} (chat {chat_id}), attempt {attempt + 1}")
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                # Пауза для всех отправок: Telegram ограничил бота
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                if chat_id is None:
+                    await asyncio.sleep(retry_after)
+
+    def _record_wait(self, level: int, waited: float):
+        self._sent[level] = self._sent.get(level, 0) + 1
+        self._wait_total[level] = self._wait_total.get(level, 0.0) + waited
+        self._wait_max[level] = max(self._wait_max.get(level, 0.0), waited)
+
+    def stats(self) -> Dict:
+        """Метрики очереди отправки"""
+        depth = {name: 0 for name in PRIORITY_NAMES.values()}
+        for level, *_ in self._waiting:
+            name = PRIORITY_NAMES.get(level, str(level))
+            depth[name] = depth.get(name, 0) + 1
+
+        by_priority = {}
+        for level, sent in self._sent.items():
+            by_priority[PRIORITY_NAMES.get(level, str(level))] = {
+                "sent": sent,
+                "avg_wait_ms": round(self._wait_total[level] / sent * 1000, 1),
+                "max_wait_ms": round(self._wait_max[level] * 1000, 1),
+            }
+
+        return {
+            "queue_depth": len(self._waiting),
+            "queue_depth_by_priority": depth,
+            "by_priority": by_priority,
+            "flood_waits": self._flood_waits,
+            "paused_for": round(max(0.0, self._paused_until - time.monotonic()), 1),
+        }
@@ -6,19 +6,25 @@ import os
 from typing import Dict, List
 from datetime import datetime
 
+from persistence import write_json_atomic
+
 
 class RatingManager:
     """Управляет рейтингом пользователей в разных чатах"""
 
-    def __init__(self, ratings_file: str = "ratings.json"):
+    def __init__(self, ratings_file: str = "ratings.json", persistence=None):
         """
         Args:
             ratings_file: Путь к файлу с рейтингами
+            persistence: PersistenceService для отложенного сохранения (без него - сразу на диск)
         """
         self.ratings_file = ratings_file
         self.ratings: Dict[int, Dict[int, int]] = {}  # chat_id -> {user_id: rating}
         self.history: Dict[int, Dict[int, List[Dict]]] = {}  # chat_id -> {user_id: [history_items]}
+        self.persistence = persistence
         self.load_ratings()
+        if persistence:
+            persistence.register(self.ratings_file, self._snapshot_data)
 
     def load_ratings(self):
         """Загрузить рейтинги из файла"""
@@ -40,17 +46,22 @@ class RatingManager:
             self.ratings = {}
             self.history = {}
 
+    def _snapshot_data(self) -> Dict:
+        """Данные для записи в файл"""
+        return {
+            'ratings': {str(chat_id): {str(user_id): rating for user_id, rating in users.items()}
+                       for chat_id, users in self.ratings.items()},
+            'history': {str(chat_id): {str(user_id): hist for user_id, hist in users.items()}
+                       for chat_id, users in self.history.items()}
+        }
+
     def save_ratings(self):
         """Сохранить рейтинги в файл"""
+        if self.persistence:
+            self.persistence.mark_dirty(self.ratings_file)
+            return
         try:
-            data = {
-                'ratings': {str(chat_id): {str(user_id): rating for user_id, rating in users.items()}
-                           for chat_id, users in self.ratings.items()},
-                'history': {str(chat_id): {str(user_id): hist for user_id, hist in users.items()}
-                           for chat_id, users in self.history.items()}
-            }
-            with open(self.ratings_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            write_json_atomic(self.ratings_file, self._snapshot_data())
         except Exception as e:
             print(f"Error saving ratings: {e}")
 
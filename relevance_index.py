@@ -0,0 +1,116 @@
+"""
+Векторный индекс фактов (TF-IDF) для поиска похожих сообщений
+"""
+import heapq
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
+
+NON_WORD_RE = re.compile(r'[^\w\s]')
+
+
+def tokenize(text: str) -> List[str]:
+    """Токенизация как в SmartLocalAI.tokenize: нижний регистр, слова длиннее 2 символов"""
+    return [t for t in NON_WORD_RE.sub(' ', text.lower()).split() if len(t) > 2]
+
+
+class RelevanceIndex:
+    """TF-IDF индекс фактов KnowledgeManager
+
+    Для каждого факта один раз считается вектор частот токенов, а
+    токены ведут списки фактов (postings). Запрос проходит только по
+    спискам своих токенов, поэтому поиск зависит от числа совпадений,
+    а не от размера базы. IDF берется из текущего словаря на момент
+    запроса, так что индекс не пересчитывается при каждом изменении.
+
+    Подписывается на KnowledgeManager через add_listener.
+    """
+
+    def __init__(self):
+        self.vectors: Dict[int, Counter] = {}  # id факта -> частоты токенов
+        self.facts: Dict[int, Dict] = {}  # id факта -> сам факт
+        self.postings: Dict[str, Set[int]] = {}  # токен -> id фактов
+
+    # --- Обновление (интерфейс слушателя KnowledgeManager) ---
+
+    def rebuild(self, facts: Dict[str, List[Dict]]):
+        self.vectors = {}
+        self.facts = {}
+        self.postings = {}
+        for key, fact_list in facts.items():
+            for fact in fact_list:
+                self.add_fact(key, fact)
+
+    def add_fact(self, key: str, fact: Dict):
+        vector = Counter(tokenize(fact.get('fact', '')))
+        if not vector:
+            return
+
+        fact_id = id(fact)
+        self.vectors[fact_id] = vector
+        self.facts[fact_id] = fact
+        for token in vector:
+            self.postings.setdefault(token, set()).add(fact_id)
+
+    def remove_fact(self, key: str, fact: Dict):
+        fact_id = id(fact)
+        vector = self.vectors.pop(fact_id, None)
+        if vector is None:
+            return
+
+        del self.facts[fact_id]
+        for token in vector:
+            postings = self.postings.get(token)
+            if postings is not None:
+                postings.discard(fact_id)
+                if not postings:
+                    del self.postings[token]
+
+    # --- Поиск ---
+
+    def idf(self, token: str) -> float:
+        """Сглаженный IDF: редкие слова весят больше, частые - не обнуляются"""
+        return math.log((len(self.vectors) + 1) / (len(self.postings.get(token, ())) + 1)) + 1
+
+    def search(self, query: str, limit: int = 5, min_score: float = 0.0,
+               exclude_user: Optional[int] = None, tokens: Optional[List[str]] = None) -> List[Tuple[float, Dict]]:
+        """Найти факты, похожие на query (косинус TF-IDF векторов)
+
+        Args:
+            query: Текст запроса
+            limit: Сколько лучших фактов вернуть
+            min_score: Отбросить факты со сходством не выше этого порога
+            exclude_user: Не возвращать факты этого пользователя
+            tokens: Уже посчитанные токены запроса (tokenize(query))
+
+        Returns:
+            Список (сходство, факт), лучшие первые
+        """
+        query_vector = Counter(tokens if tokens is not None else tokenize(query))
+        if not query_vector:
+            return []
+
+        idf = {token: self.idf(token) for token in query_vector}
+        query_weights = {token: count * idf[token] for token, count in query_vector.items()}
+        query_norm = math.sqrt(sum(w * w for w in query_weights.values()))
+
+        # Скалярные произведения только по спискам токенов запроса
+        dots: Dict[int, float] = {}
+        for token, weight in query_weights.items():
+            for fact_id in self.postings.get(token, ()):
+                dots[fact_id] = dots.get(fact_id, 0.0) + weight * self.vectors[fact_id][token] * idf[token]
+
+        scored = []
+        for fact_id, dot in dots.items():
+            fact = self.facts[fact_id]
+            if exclude_user is not None and fact.get('added_by') == exclude_user:
+                continue
+
+            fact_norm = math.sqrt(sum((count * self.idf(token)) ** 2
+                                      for token, count in self.vectors[fact_id].items()))
+            score = dot / (query_norm * fact_norm)
+            if score > min_score:
+                scored.append((score, fact))
+
+        return heapq.nlargest(limit, scored, key=lambda item: item[0])
@@ -0,0 +1,85 @@
+"""
+Кэш ответов GLM для повторяющихся запросов (погода, приветствия, напоминания)
+"""
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+
+def normalize_messages(messages: List[Dict[str, str]]) -> List[Tuple[str, str]]:
+    """Роль и текст без лишних пробелов - мелкие отличия форматирования не мешают попаданию"""
+    return [(m.get("role", ""), " ".join(str(m.get("content", "")).split())) for m in messages]
+
+
+def make_key(model: str, messages: List[Dict[str, str]], temperature: float, max_tokens: int) -> str:
+    """Хэш запроса: модель, нормализованные сообщения, температура (с шагом 0.1), лимит токенов"""
+    raw = json.dumps(
+        [model, normalize_messages(messages), round(temperature, 1), max_tokens],
+        ensure_ascii=False, separators=(",", ":")
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """LRU-кэш ответов с TTL и лимитом размера в байтах
+
+    Что и на сколько кэшировать, решает политика: call_site -> TTL в
+    секундах. Места вызова, которых нет в политике (или с TTL 0), не
+    кэшируются никогда - например, обычные ответы в process_message.
+    """
+
+    def __init__(self, policy: Dict[str, float], max_bytes: int = 1_000_000):
+        """
+        Args:
+            policy: TTL в секундах для каждого места вызова (call_site)
+            max_bytes: Максимальный суммарный размер ответов в кэше
+        """
+        self.policy = dict(policy)
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, Tuple[float, str, int]]" = OrderedDict()  # ключ -> (истекает, ответ, размер)
+        self.total_bytes = 0
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+
+    def ttl_for(self, call_site: Optional[str]) -> float:
+        """TTL для места вызова (0 - не кэшировать)"""
+        return self.policy.get(call_site, 0) if call_site else 0
+
+    def get(self, key: str, call_site: str) -> Optional[str]:
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] < time.monotonic():
+            self._drop(key)
+            entry = None
+
+        if entry is None:
+            self.misses[call_site] = self.misses.get(call_site, 0) + 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits[call_site] = self.hits.get(call_site, 0) + 1
+        return entry[1]
+
+    def put(self, key: str, value: str, ttl: float):
+        size = len(key) + len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+
+        if key in self.entries:
+            self._drop(key)
+        self.entries[key] = (time.monotonic() + ttl, value, size)
+        self.total_bytes += size
+
+        # Вытесняем давно не использованные
+        while self.total_bytes > self.max_bytes:
+            self._drop(next(iter(self.entries)))
+
+    def _drop(self, key: str):
+        _, _, size = self.entries.pop(key)
+        self.total_bytes -= size
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Попадания и промахи по местам вызова"""
+        sites = set(self.hits) | set(self.misses)
+        return {site: {"hits": self.hits.get(site, 0), "misses": self.misses.get(site, 0)} for site in sorted(sites)}
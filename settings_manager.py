@@ -1,13 +1,19 @@
 import json
 import os
-from typing import Dict
+from typing import Callable, Dict, List
+
+from persistence import write_json_atomic
 
 class SettingsManager:
     """Менеджер настроек бота для различных чатов"""
     
-    def __init__(self, settings_file: str = "bot_settings.json"):
+    def __init__(self, settings_file: str = "bot_settings.json", persistence=None):
         self.settings_file = settings_file
         self.settings: Dict[str, Dict] = self._load_settings()
+        self.persistence = persistence  # PersistenceService (без него - сохранение сразу)
+        self._change_listeners: List[Callable[[int], None]] = []  # Кэши, зависящие от настроек чата
+        if persistence:
+            persistence.register(self.settings_file, lambda: self.settings, indent=4)
         
     def _load_settings(self) -> Dict:
         if os.path.exists(self.settings_file):
@@ -19,9 +25,11 @@ class SettingsManager:
         return {}
 
     def _save_settings(self):
+        if self.persistence:
+            self.persistence.mark_dirty(self.settings_file)
+            return
         try:
-            with open(self.settings_file, 'w', encoding='utf-8') as f:
-                json.dump(self.settings, f, ensure_ascii=False, indent=4)
+            write_json_atomic(self.settings_file, self.settings, indent=4)
         except Exception as e:
             print(f"Error saving settings: {e}")
 
@@ -35,7 +43,8 @@ class SettingsManager:
                 "proactive_hooks": True,
                 "silence_revival": True,
                 "silence_timeout": 45, # минут (увеличено до 45, чтобы не часто вмешивался)
-                "custom_persona": None
+                "custom_persona": None,
+                "glm_weight": 1.0  # Доля чата в очереди к GLM при нагрузке (2 - вдвое больше)
             }
             self._save_settings()
         return self.settings[chat_id_str]
@@ -47,6 +56,21 @@ class SettingsManager:
         
         self.settings[chat_id_str][key] = value
         self._save_settings()
+        for listener in self._change_listeners:
+            listener(chat_id)
+
+    def add_change_listener(self, listener: Callable[[int], None]):
+        """Подписаться на изменение настроек: listener(chat_id) после update_setting"""
+        self._change_listeners.append(listener)
+
+    def get_glm_weight(self, chat_id: int) -> float:
+        """Вес чата в справедливой очереди к GLM (без создания настроек для нового чата)"""
+        return float(self.settings.get(str(chat_id), {}).get("glm_weight", 1.0))
+
+    def get_deadline(self, chat_id: int, path: str, defaults: Dict[str, float]):
+        """Дедлайн ответа GLM для пути (process_message, roast, reminder): настройка чата или значение по умолчанию"""
+        deadlines = self.settings.get(str(chat_id), {}).get("deadlines") or {}
+        return deadlines.get(path, defaults.get(path))
 
     def get_intervention_params(self, chat_id: int) -> Dict:
         settings = self.get_chat_settings(chat_id)
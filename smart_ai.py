@@ -1,15 +1,25 @@
 import re
 import random
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Set, Tuple
 from datetime import datetime
 import math
+from collections import Counter
 from persona import FALLBACK_RESPONSES, SENTIMENT_RESPONSES, COMPLEX_MARKERS, SEARCH_MARKERS
+from relevance_index import RelevanceIndex
+from intent_matcher import KeywordPrefilter
+
+NON_WORD_RE = re.compile(r'[^\w\s]')
+BOT_ADDRESS_RE = re.compile(r'^(?:чупапи|чупа|чупик)[,\s]*', re.IGNORECASE)
 
 class SmartLocalAI:
     """Умная локальная AI с продвинутыми алгоритмами и персоной"""
 
     def __init__(self, knowledge_manager):
         self.km = knowledge_manager
+
+        # TF-IDF индекс фактов, обновляется вместе с KnowledgeManager
+        self.relevance = RelevanceIndex()
+        self.km.add_listener(self.relevance)
         
         # Состояние разговора (topic tracking)
         # {user_id: {"topic": "unknown", "last_intent": "greeting", "timestamp": ...}}
@@ -25,6 +35,7 @@ class SmartLocalAI:
             'how': r'\b(как|каким образом|каким способом)\b',
             'yes_no': r'\b(это|есть|является|будет|может|можешь|ты)\s.*\?'
         }
+        self.question_regexes = {q_type: re.compile(pattern, re.IGNORECASE) for q_type, pattern in self.question_patterns.items()}
 
         # Паттерны извлечения фактов
         self.extraction_patterns = {
@@ -52,6 +63,10 @@ class SmartLocalAI:
                 r'(?:i love|i like|my favorite)\s+([A-Za-z\s]+)'
             ]
         }
+        self.extraction_regexes = {
+            entity_type: [re.compile(p, re.IGNORECASE | re.MULTILINE) for p in patterns]
+            for entity_type, patterns in self.extraction_patterns.items()
+        }
 
         # Шаблоны для математических выражений
         self.math_pattern = re.compile(r'(\d+(?:\.\d+)?)\s*([\+\-\*\/x÷])\s*(\d+(?:\.\d+)?)')
@@ -70,35 +85,79 @@ class SmartLocalAI:
             'живу', 'люблю', 'пошел', 'иду', 'вчера', 'сегодня', 'сейчас', 'здесь', 'тут'
         }
 
-    def detect_persona_change(self, text: str) -> Tuple[Optional[str], bool]:
-        """
-        Определить, хочет ли пользователь сменить личность бота.
-        Возвращает: (описание_личности, это_сброс)
-        """
-        text = text.lower().strip()
-        
-        # Паттерны сброса
-        reset_patterns = [
+        # Паттерны смены личности: сброс и смена
+        self.persona_reset_patterns = [re.compile(p) for p in (
             r'верни(?:сь)?\s+(?:в\s+)?(?:норм|обычн|стандарт|базов)',
             r'стань\s+(?:собой|обычным|как\s+раньше)',
             r'хватит\s+притворяться'
-        ]
-        
-        for p in reset_patterns:
-            if re.search(p, text):
-                return None, True
-                
-        # Паттерны смены
-        switch_patterns = [
+        )]
+        self.persona_switch_patterns = [re.compile(p) for p in (
             r'будь\s+([а-яА-ЯёЁ\s]+)',
             r'стань\s+([а-яА-ЯёЁ\s]+)',
             r'отвечай\s+как\s+([а-яА-ЯёЁ\s]+)',
             r'говори\s+как\s+([а-яА-ЯёЁ\s]+)',
             r'теперь\s+ты\s+([а-яА-ЯёЁ\s]+)'
-        ]
-        
-        for p in switch_patterns:
-            match = re.search(p, text)
+        )]
+
+        # Паттерны поведенческих инструкций
+        self.instruction_patterns = [re.compile(p) for p in (
+            r'начинай\s+(?:говорить|сообщения|ответы|отвечать)\s+(?:со\s+слов?|с)\s+["\']?(.+?)["\']?$',
+            r'начинай\s+(?:говорить|сообщения|ответы|отвечать)\s+(?:со\s+слов?|с)\s+(.+)',
+            r'всегда\s+(?:говори|пиши|добавляй|используй|начинай)\s+(.+)',
+            r'каждый\s+(?:раз|ответ)\s+(?:говори|пиши|добавляй|начинай)\s+(.+)',
+            r'отвечай\s+(?:только|всегда)\s+(.+)',
+            r'(?:говори|пиши)\s+(?:только|всегда)\s+(.+)',
+            r'заканчивай\s+(?:сообщения|ответы)\s+(.+)',
+            r'добавляй\s+в\s+(?:конец|начало)\s+(.+)',
+        )]
+
+        # Паттерны для напоминаний
+        self.reminder_patterns = [re.compile(p) for p in (
+            r'напомни\s+через\s+(\d+)\s+(секунд|сек|минут|мин|час|часа|часов)(?:\s+(.+))?',
+            r'через\s+(\d+)\s+(секунд|сек|минут|мин|час|часа|часов)\s+напомни(?:\s+(.+))?',
+            r'поставь\s+напоминание\s+на\s+(\d+)\s+(секунд|сек|минут|мин|час|часа|часов)(?:\s+(.+))?',
+        )]
+
+        # Ключевые слова, без которых паттерны детектора не сработают:
+        # один проход по тексту отсекает детекторы, которым нечего искать
+        prefilter_groups = {
+            'persona': ['верни', 'стань', 'хватит', 'будь', 'отвечай', 'говори', 'теперь'],
+            'instruction': ['начинай', 'всегда', 'каждый', 'отвечай', 'говори', 'пиши', 'заканчивай', 'добавляй'],
+            'reminder': ['напомни', 'напоминание'],
+            'entity:name': ['меня зовут', 'зови', 'my name is', 'call me'],
+            'entity:age': ['лет', 'год', 'age'],
+            'entity:city': ['я из', 'живу в', 'горой', 'город', 'i am from', 'i live in'],
+            'entity:work': ['работаю', 'профессия', 'специальность', 'i work as', 'i am a'],
+            'entity:likes': ['люблю', 'обожаю', 'нравится', 'i love', 'i like', 'my favorite'],
+        }
+        for q_type, pattern in self.question_patterns.items():
+            # Слова из альтернатив паттерна вопроса (плюс "?" для yes_no)
+            words = re.search(r'\((.+?)\)', pattern).group(1).split('|')
+            prefilter_groups[f'question:{q_type}'] = words + (['?'] if q_type == 'yes_no' else [])
+        for sentiment, stems in self.sentiment_patterns.items():
+            # Паттерны сентимента - обычные основы слов
+            prefilter_groups[f'sentiment:{sentiment}'] = stems
+        self.prefilter = KeywordPrefilter(prefilter_groups)
+
+    def _scan(self, text_lower: str, triggered: Optional[Set[str]]) -> Set[str]:
+        """Группы ключевых слов в тексте (готовый результат analyze или новый проход)"""
+        return triggered if triggered is not None else self.prefilter.scan(text_lower)
+
+    def detect_persona_change(self, text: str, triggered: Optional[Set[str]] = None) -> Tuple[Optional[str], bool]:
+        """
+        Определить, хочет ли пользователь сменить личность бота.
+        Возвращает: (описание_личности, это_сброс)
+        """
+        text = text.lower().strip()
+        if 'persona' not in self._scan(text, triggered):
+            return None, False
+
+        for p in self.persona_reset_patterns:
+            if p.search(text):
+                return None, True
+
+        for p in self.persona_switch_patterns:
+            match = p.search(text)
             if match:
                 persona_desc = match.group(1).strip()
                 # Игнорируем слишком короткие или чисто пустые
@@ -106,7 +165,7 @@ class SmartLocalAI:
                     return persona_desc, False                    
         return None, False
 
-    def detect_behavioral_instruction(self, text: str) -> Optional[str]:
+    def detect_behavioral_instruction(self, text: str, triggered: Optional[Set[str]] = None) -> Optional[str]:
         """
         Определить, содержит ли сообщение поведенческую инструкцию для бота.
         Возвращает текст инструкции или None.
@@ -117,33 +176,23 @@ class SmartLocalAI:
         - "отвечай только короткими фразами"
         """
         text = text.lower().strip()
-        
-        # Паттерны поведенческих инструкций
-        instruction_patterns = [
-            r'начинай\s+(?:говорить|сообщения|ответы|отвечать)\s+(?:со\s+слов?|с)\s+["\']?(.+?)["\']?$',
-            r'начинай\s+(?:говорить|сообщения|ответы|отвечать)\s+(?:со\s+слов?|с)\s+(.+)',
-            r'всегда\s+(?:говори|пиши|добавляй|используй|начинай)\s+(.+)',
-            r'каждый\s+(?:раз|ответ)\s+(?:говори|пиши|добавляй|начинай)\s+(.+)',
-            r'отвечай\s+(?:только|всегда)\s+(.+)',
-            r'(?:говори|пиши)\s+(?:только|всегда)\s+(.+)',
-            r'заканчивай\s+(?:сообщения|ответы)\s+(.+)',
-            r'добавляй\s+в\s+(?:конец|начало)\s+(.+)',
-        ]
-        
-        for pattern in instruction_patterns:
-            match = re.search(pattern, text)
+        if 'instruction' not in self._scan(text, triggered):
+            return None
+
+        for pattern in self.instruction_patterns:
+            match = pattern.search(text)
             if match:
                 instruction = match.group(1).strip()
                 # Игнорируем слишком короткие или пустые инструкции
                 if len(instruction) > 2:
                     # Формируем полную инструкцию из оригинального текста
                     # Убираем обращение к боту
-                    clean_text = re.sub(r'^(?:чупапи|чупа|чупик)[,\s]*', '', text, flags=re.IGNORECASE).strip()
+                    clean_text = BOT_ADDRESS_RE.sub('', text).strip()
                     return clean_text
                     
         return None
 
-    def detect_reminder_request(self, text: str) -> Optional[Dict]:
+    def detect_reminder_request(self, text: str, triggered: Optional[Set[str]] = None) -> Optional[Dict]:
         """
         Определить, содержит ли сообщение запрос на напоминание.
         Возвращает словарь с временем и текстом напоминания или None.
@@ -154,16 +203,11 @@ class SmartLocalAI:
         - "через час напомни позвонить"
         """
         text = text.lower().strip()
-        
-        # Паттерны для напоминаний
-        reminder_patterns = [
-            r'напомни\s+через\s+(\d+)\s+(секунд|сек|минут|мин|час|часа|часов)(?:\s+(.+))?',
-            r'через\s+(\d+)\s+(секунд|сек|минут|мин|час|часа|часов)\s+напомни(?:\s+(.+))?',
-            r'поставь\s+напоминание\s+на\s+(\d+)\s+(секунд|сек|минут|мин|час|часа|часов)(?:\s+(.+))?',
-        ]
-        
-        for pattern in reminder_patterns:
-            match = re.search(pattern, text)
+        if 'reminder' not in self._scan(text, triggered):
+            return None
+
+        for pattern in self.reminder_patterns:
+            match = pattern.search(text)
             if match:
                 amount = int(match.group(1))
                 unit = match.group(2)
@@ -198,7 +242,7 @@ class SmartLocalAI:
     def tokenize(self, text: str) -> List[str]:
         """Токенизация текста"""
         text = text.lower()
-        text = re.sub(r'[^\w\s]', ' ', text)
+        text = NON_WORD_RE.sub(' ', text)
         tokens = text.split()
         return [t for t in tokens if len(t) > 2]
 
@@ -210,11 +254,10 @@ class SmartLocalAI:
         if not tokens1 or not tokens2:
             return 0.0
 
-        all_tokens = list(set(tokens1 + tokens2))
-        tf1 = {t: tokens1.count(t) / len(tokens1) for t in all_tokens}
-        tf2 = {t: tokens2.count(t) / len(tokens2) for t in all_tokens}
+        tf1 = Counter(tokens1)
+        tf2 = Counter(tokens2)
 
-        dot_product = sum(tf1[t] * tf2[t] for t in all_tokens)
+        dot_product = sum(count * tf2[t] for t, count in tf1.items() if t in tf2)
         norm1 = math.sqrt(sum(v**2 for v in tf1.values()))
         norm2 = math.sqrt(sum(v**2 for v in tf2.values()))
 
@@ -223,17 +266,19 @@ class SmartLocalAI:
 
         return dot_product / (norm1 * norm2)
 
-    def classify_question(self, text: str) -> str:
+    def classify_question(self, text: str, triggered: Optional[Set[str]] = None) -> str:
         """Классифицировать тип вопроса"""
         text_lower = text.lower()
-        for q_type, pattern in self.question_patterns.items():
-            if re.search(pattern, text_lower, re.IGNORECASE):
+        triggered = self._scan(text_lower, triggered)
+        for q_type, regex in self.question_regexes.items():
+            if f'question:{q_type}' in triggered and regex.search(text_lower):
                 return q_type
         return 'general'
 
-    def extract_entities(self, text: str) -> Dict[str, str]:
+    def extract_entities(self, text: str, triggered: Optional[Set[str]] = None) -> Dict[str, str]:
         """Извлечь сущности из текста"""
         entities = {}
+        triggered = self._scan(text.lower(), triggered)
 
         # Только ищем сущности если текст начинается с явного обращения к боту
         # Это предотвращает извлечение случайных имен из обычного текста
@@ -243,13 +288,15 @@ class SmartLocalAI:
             for phrase in ['меня зовут', 'зови меня', 'my name is', 'call me', 'я из', 'живу в', 'работаю', 'мне']
         )
 
-        for entity_type, patterns in self.extraction_patterns.items():
+        for entity_type, patterns in self.extraction_regexes.items():
+            if f'entity:{entity_type}' not in triggered:
+                continue
             # Для имен - требуем явное обращение в начале
             if entity_type == 'name' and not is_direct_address:
                 continue
 
             for pattern in patterns:
-                match = re.search(pattern, text, re.IGNORECASE | re.MULTILINE)
+                match = pattern.search(text)
                 if match:
                     value = match.group(1).strip()
                     # Проверка на стоп-слова и длину для имен
@@ -265,14 +312,34 @@ class SmartLocalAI:
                         break
         return entities
 
-    def detect_sentiment(self, text: str) -> Optional[str]:
+    def detect_sentiment(self, text: str, triggered: Optional[Set[str]] = None) -> Optional[str]:
         """Определить сентимент сообщения"""
-        text_lower = text.lower()
-        for sentiment, patterns in self.sentiment_patterns.items():
-            if any(re.search(p, text_lower) for p in patterns):
+        # Основы сентимента сами являются ключевыми словами фильтра
+        triggered = self._scan(text.lower(), triggered)
+        for sentiment in self.sentiment_patterns:
+            if f'sentiment:{sentiment}' in triggered:
                 return sentiment
         return None
-    def track_topic(self, user_id: int, text: str, intent: Optional[str] = None):
+
+    def analyze(self, text: str) -> Dict:
+        """
+        Прогнать сообщение через все детекторы за один проход фильтра ключевых слов
+        Returns: Словарь с результатами всех детекторов
+        """
+        triggered = self.prefilter.scan(text.lower().strip())
+        persona, persona_reset = self.detect_persona_change(text, triggered)
+        return {
+            'persona': persona,
+            'persona_reset': persona_reset,
+            'instruction': self.detect_behavioral_instruction(text, triggered),
+            'reminder': self.detect_reminder_request(text, triggered),
+            'question_type': self.classify_question(text, triggered),
+            'sentiment': self.detect_sentiment(text, triggered),
+            'entities': self.extract_entities(text, triggered),
+            'intent': self.detect_conversational_intent(text),
+            'tokens': self.tokenize(text)
+        }
+    def track_topic(self, user_id: int, text: str, intent: Optional[str] = None, tokens: Optional[List[str]] = None):
         """Отслеживать тему разговора"""
         if user_id not in self.conversation_states:
             self.conversation_states[user_id] = {
@@ -290,7 +357,8 @@ class SmartLocalAI:
         state["timestamp"] = datetime.now()
         
         # Простой поиск темы по ключевым словам
-        tokens = self.tokenize(text)
+        if tokens is None:
+            tokens = self.tokenize(text)
         if tokens:
             # Берем самое длинное слово как потенциальную тему
             potential_topic = max(tokens, key=len)
@@ -340,35 +408,22 @@ class SmartLocalAI:
                 return None
         return None
 
-    def find_relevant_responses(self, query: str, user_id: int, limit: int = 5) -> List[Dict]:
-        """Найти релевантные ответы из истории"""
-        relevant = []
-        all_facts = self.km.get_all_facts()
-
-        for key, fact_list in all_facts.items():
-            for fact in fact_list:
-                if fact.get('added_by') == user_id:
-                    continue
-
-                message_text = fact['fact']
-                similarity = self.calculate_similarity(query, message_text)
-
-                if similarity > 0.2:
-                    relevant.append({
-                        'text': message_text,
-                        'similarity': similarity,
-                        'user': fact.get('username', 'Unknown'),
-                        'timestamp': fact.get('timestamp', '')
-                    })
-
-        relevant.sort(key=lambda x: x['similarity'], reverse=True)
-        return relevant[:limit]
+    def find_relevant_responses(self, query: str, user_id: int, limit: int = 5,
+                                tokens: Optional[List[str]] = None) -> List[Dict]:
+        """Найти релевантные ответы из истории (TF-IDF индекс фактов)"""
+        matches = self.relevance.search(query, limit=limit, min_score=0.2, exclude_user=user_id, tokens=tokens)
+        return [{
+            'text': fact['fact'],
+            'similarity': similarity,
+            'user': fact.get('username', 'Unknown'),
+            'timestamp': fact.get('timestamp', '')
+        } for similarity, fact in matches]
 
     def detect_conversational_intent(self, text: str) -> Optional[str]:
         """Определить намерение разговора"""
         text_lower = text.lower().strip()
         # Очистка от знаков препинания для поиска ключевых слов
-        clean_text = re.sub(r'[^\w\s]', '', text_lower)
+        clean_text = NON_WORD_RE.sub('', text_lower)
         tokens = set(clean_text.split())
 
         # Приветствия - только если это явное приветствие
@@ -436,15 +491,20 @@ class SmartLocalAI:
         response = random.choice(responses)
         return response.format(name=user_name)
 
-    def generate_smart_response(self, message: str, user_id: int, username: str = None) -> Tuple[str, float]:
+    def generate_smart_response(self, message: str, user_id: int, username: str = None,
+                                analysis: Optional[Dict] = None) -> Tuple[str, float]:
         """
         Сгенерировать умный ответ локально
+        Args:
+            analysis: Готовый результат analyze(message), чтобы не считать детекторы заново
         Returns: (ответ, уверенность)
         """
         message_lower = message.lower().strip()
+        if analysis is None:
+            analysis = self.analyze(message)
 
         # 1. Сентимент/Эмоции (всегда в приоритете)
-        sentiment = self.detect_sentiment(message)
+        sentiment = analysis['sentiment']
         if sentiment:
             user_name = self.km.get_user_name(user_id) or "друг"
             responses = SENTIMENT_RESPONSES.get(sentiment)
@@ -463,7 +523,7 @@ class SmartLocalAI:
             return math_result, 1.0
 
         # 3. Интент (Приветствие, как дела и т.д.)
-        intent = self.detect_conversational_intent(message)
+        intent = analysis['intent']
         if intent:
             if intent == 'greeting':
                 state = self.conversation_states.get(user_id)
@@ -474,13 +534,13 @@ class SmartLocalAI:
                         if diff < 1800: # 30 минут кулдаун на приветствие
                             return "", 0.0 
 
-            self.track_topic(user_id, message, intent)
+            self.track_topic(user_id, message, intent, tokens=analysis['tokens'])
             response = self.get_user_contextual_response(user_id, intent)
             if response:
                 return response, 0.95
 
         # 4. Извлечение и сохранение инфо о пользователе
-        entities = self.extract_entities(message)
+        entities = analysis['entities']
         if entities:
             username_display = username or f"User_{user_id}"
             user_name = self.km.get_user_name(user_id) or "друг"
@@ -509,7 +569,7 @@ class SmartLocalAI:
                 return f"Ммм, {entities['likes']}... {user_name}, у тебя хороший вкус! 😋", 0.9
 
         # 5. Поиск похожих ответов в истории (цитирование)
-        relevant = self.find_relevant_responses(message, user_id)
+        relevant = self.find_relevant_responses(message, user_id, tokens=analysis['tokens'])
         if isinstance(relevant, list) and len(relevant) > 0:
             best = relevant[0]
             if isinstance(best, dict) and best.get('similarity', 0) > 0.45:
@@ -0,0 +1,406 @@
+"""
+SQLite-хранилище для рейтинга, участников, ачивок и дневной статистики
+
+Альтернатива JSON-файлам: те же API менеджеров, но каждое изменение -
+одна строка в базе (WAL), а при старте ничего не читается целиком.
+Включается через STORAGE_BACKEND=sqlite, перенос старых данных -
+migrate_to_sqlite.py.
+"""
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from achievements_manager import AchievementsManager
+from daily_stats import DailyStatsManager
+from members_manager import MembersManager
+from rating_manager import RatingManager
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ratings (
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    rating INTEGER NOT NULL DEFAULT 0,
+    username TEXT,
+    PRIMARY KEY (chat_id, user_id)
+);
+CREATE INDEX IF NOT EXISTS idx_ratings_chat_rating ON ratings (chat_id, rating);
+
+CREATE TABLE IF NOT EXISTS rating_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    timestamp TEXT NOT NULL,
+    points INTEGER NOT NULL,
+    reason TEXT,
+    username TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_rating_history_user ON rating_history (chat_id, user_id, id);
+CREATE INDEX IF NOT EXISTS idx_rating_history_time ON rating_history (timestamp);
+
+CREATE TABLE IF NOT EXISTS members (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    first_seen TEXT,
+    last_seen TEXT
+);
+
+CREATE TABLE IF NOT EXISTS member_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    username TEXT,
+    chat_id INTEGER NOT NULL,
+    text TEXT,
+    timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_member_messages_chat_time ON member_messages (chat_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_member_messages_time ON member_messages (timestamp);
+
+CREATE TABLE IF NOT EXISTS achievements (
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    achievement_id TEXT NOT NULL,
+    unlocked_at TEXT,
+    PRIMARY KEY (chat_id, user_id, achievement_id)
+);
+
+CREATE TABLE IF NOT EXISTS daily_stats (
+    chat_id INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    messages INTEGER NOT NULL DEFAULT 0,
+    rating_points INTEGER NOT NULL DEFAULT 0,
+    manual_grant_points INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (chat_id, date)
+);
+"""
+
+
+class SQLiteStorage:
+    """Соединение с базой SQLite (WAL) и ее схема"""
+
+    def __init__(self, db_file: str = "bot_data.db"):
+        """
+        Args:
+            db_file: Путь к файлу базы
+        """
+        self.db_file = db_file
+        # isolation_level=None - автокоммит: каждая запись сразу фиксируется
+        self.conn = sqlite3.connect(db_file, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # В WAL-режиме NORMAL не теряет целостность, а fsync идет только при checkpoint
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def execute(self, sql: str, params=()) -> sqlite3.Cursor:
+        return self.conn.execute(sql, params)
+
+    @contextmanager
+    def transaction(self):
+        """Несколько записей одной транзакцией (в автокоммите BEGIN нужен явно)"""
+        self.conn.execute("BEGIN")
+        try:
+            yield
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def close(self):
+        self.conn.close()
+
+
+class SQLiteRatingManager(RatingManager):
+    """RatingManager поверх SQLite"""
+
+    def __init__(self, storage: SQLiteStorage):
+        self.storage = storage
+
+    def add_rating(self, chat_id: int, user_id: int, username: str, points: int = 1, reason: str = ""):
+        """Добавить рейтинг пользователю (см. RatingManager.add_rating)"""
+        old_rating = self.get_user_rating(chat_id, user_id)
+        with self.storage.transaction():
+            self.storage.execute(
+                "INSERT INTO ratings (chat_id, user_id, rating, username) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (chat_id, user_id) DO UPDATE SET rating = rating + excluded.rating, username = excluded.username",
+                (chat_id, user_id, points, username)
+            )
+            self.storage.execute(
+                "INSERT INTO rating_history (chat_id, user_id, timestamp, points, reason, username) VALUES (?, ?, ?, ?, ?, ?)",
+                (chat_id, user_id, datetime.now().isoformat(), points, reason, username)
+            )
+        new_rating = old_rating + points
+        print(f"[RATING_MANAGER] {username} (user_id={user_id}, chat_id={chat_id}): {old_rating} + {points} = {new_rating} points. Reason: {reason}")
+
+    def get_user_rating(self, chat_id: int, user_id: int) -> int:
+        """Получить рейтинг пользователя в чате"""
+        row = self.storage.execute(
+            "SELECT rating FROM ratings WHERE chat_id = ? AND user_id = ?", (chat_id, user_id)
+        ).fetchone()
+        return row["rating"] if row else 0
+
+    def get_top_users(self, chat_id: int, limit: int = 10) -> List[tuple]:
+        """
+        Получить топ пользователей по рейтингу
+
+        Returns: Список (user_id, rating, last_known_username)
+        """
+        rows = self.storage.execute(
+            "SELECT user_id, rating, username FROM ratings WHERE chat_id = ? AND rating > 0 "
+            "ORDER BY rating DESC, rowid LIMIT ?", (chat_id, limit)
+        ).fetchall()
+        return [(row["user_id"], row["rating"], row["username"] or "Unknown") for row in rows]
+
+    def get_chat_stats(self, chat_id: int) -> Dict:
+        """Получить статистику рейтинга чата"""
+        totals = self.storage.execute(
+            "SELECT COUNT(*) AS users, COALESCE(SUM(rating), 0) AS points FROM ratings "
+            "WHERE chat_id = ? AND rating > 0", (chat_id,)
+        ).fetchone()
+        top = self.storage.execute(
+            "SELECT rating, username FROM ratings WHERE chat_id = ? ORDER BY rating DESC, rowid LIMIT 1", (chat_id,)
+        ).fetchone()
+
+        if top is None:
+            return {
+                'total_users': 0,
+                'total_points': 0,
+                'top_user': None,
+                'average_rating': 0
+            }
+
+        total_users = totals["users"]
+        total_points = totals["points"]
+        average_rating = total_points / total_users if total_users > 0 else 0
+        return {
+            'total_users': total_users,
+            'total_points': total_points,
+            'top_user': top["username"],
+            'top_user_rating': top["rating"],
+            'average_rating': round(average_rating, 2)
+        }
+
+    def get_user_history(self, chat_id: int, user_id: int, limit: int = 5) -> List[Dict]:
+        """Получить историю рейтинга пользователя"""
+        rows = self.storage.execute(
+            "SELECT timestamp, points, reason, username FROM rating_history "
+            "WHERE chat_id = ? AND user_id = ? ORDER BY id DESC LIMIT ?", (chat_id, user_id, limit)
+        ).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+    def save_ratings(self):
+        """Каждое изменение уже записано в базу"""
+
+
+class SQLiteMembersManager(MembersManager):
+    """MembersManager поверх SQLite
+
+    Участников немного, поэтому они держатся в памяти (self.members, как
+    в JSON-версии), а в базу пишется только изменившаяся строка. Сообщения
+    живут только в базе и хранятся message_retention_days дней.
+    """
+
+    PRUNE_EVERY = 1000  # Чистить старые сообщения раз в столько записей
+
+    def __init__(self, storage: SQLiteStorage, message_retention_days: int = 90):
+        self.storage = storage
+        self.message_retention_days = message_retention_days
+        self._inserts_since_prune = 0
+        self.members: Dict[int, Dict] = {}
+        self.load_data()
+
+    def load_data(self):
+        """Загрузить участников из базы и удалить устаревшие сообщения"""
+        rows = self.storage.execute(
+            "SELECT user_id AS id, username, first_name, last_name, message_count, first_seen, last_seen FROM members"
+        ).fetchall()
+        self.members = {row["id"]: dict(row) for row in rows}
+        self._prune_messages()
+
+    def _prune_messages(self):
+        cutoff = (datetime.now() - timedelta(days=self.message_retention_days)).isoformat()
+        self.storage.execute("DELETE FROM member_messages WHERE timestamp < ?", (cutoff,))
+        self._inserts_since_prune = 0
+
+    def _save_member(self, member: Dict):
+        self.storage.execute(
+            "INSERT OR REPLACE INTO members (user_id, username, first_name, last_name, message_count, first_seen, last_seen) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (member['id'], member.get('username'), member.get('first_name'), member.get('last_name'),
+             member.get('message_count', 0), member.get('first_seen'), member.get('last_seen'))
+        )
+
+    def save_data(self):
+        """Каждое изменение уже записано в базу"""
+
+    def add_member(self, user_id: int, username: str = None, first_name: str = None, last_name: str = None):
+        """Добавить или обновить информацию об участнике"""
+        super().add_member(user_id, username, first_name, last_name)
+        self._save_member(self.members[user_id])
+
+    def record_message(self, user_id: int, chat_id: int, message_text: str, username: str = None):
+        """Записать сообщение от участника"""
+        now = datetime.now().isoformat()
+        if user_id in self.members:
+            self.members[user_id]['message_count'] += 1
+            self.members[user_id]['last_seen'] = now
+
+        with self.storage.transaction():
+            if user_id in self.members:
+                self._save_member(self.members[user_id])
+            self.storage.execute(
+                "INSERT INTO member_messages (user_id, username, chat_id, text, timestamp) VALUES (?, ?, ?, ?, ?)",
+                (user_id, username, chat_id, message_text[:500], now)  # Ограничиваем длину
+            )
+
+        self._inserts_since_prune += 1
+        if self._inserts_since_prune >= self.PRUNE_EVERY:
+            self._prune_messages()
+
+    def get_chat_stats(self, chat_id: int, days: int = 7) -> Dict:
+        """Получить статистику по чату за указанный период (последние days календарных дней)"""
+        # Границы те же, что у дневных корзин JSON-версии: с начала дня days - 1 дней назад
+        cutoff_day = (datetime.now() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+
+        # MIN(id) - имя берется из первого сообщения пользователя за период, а при равном
+        # числе сообщений раньше идет тот, кто написал первым - как в JSON-версии
+        rows = self.storage.execute(
+            "SELECT user_id, COUNT(*) AS count, username, MIN(id) AS first_id FROM member_messages "
+            "WHERE chat_id = ? AND timestamp >= ? GROUP BY user_id ORDER BY count DESC, first_id",
+            (chat_id, cutoff_day)
+        ).fetchall()
+
+        return {
+            'total_messages': sum(row["count"] for row in rows),
+            'unique_users': len(rows),
+            'period_days': days,
+            'top_users': [
+                (row["user_id"], {'count': row["count"], 'username': row["username"] or 'Unknown'})
+                for row in rows[:10]  # Топ-10
+            ]
+        }
+
+    def get_members_list(self, chat_id: int = None, days: int = 7) -> List[Dict]:
+        """Получить список участников (для чата - писавших за последние days дней)"""
+        if chat_id:
+            cutoff_day = (datetime.now() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+            rows = self.storage.execute(
+                "SELECT DISTINCT user_id FROM member_messages WHERE chat_id = ? AND timestamp >= ?",
+                (chat_id, cutoff_day)
+            ).fetchall()
+            return [self.members[row["user_id"]] for row in rows if row["user_id"] in self.members]
+        return list(self.members.values())
+
+    @property
+    def messages(self) -> List[Dict]:
+        """Последние 100 сообщений (для экспорта)"""
+        rows = self.storage.execute(
+            "SELECT user_id, username, chat_id, text, timestamp FROM member_messages ORDER BY id DESC LIMIT 100"
+        ).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+
+class SQLiteAchievementsManager(AchievementsManager):
+    """AchievementsManager поверх SQLite"""
+
+    def __init__(self, storage: SQLiteStorage):
+        self.storage = storage
+
+    def save_achievements(self):
+        """Каждое изменение уже записано в базу"""
+
+    def unlock_achievement(self, chat_id: int, user_id: int, achievement_id: str) -> bool:
+        """
+        Разблокировать ачивку для пользователя.
+        Returns: True если ачивка была разблокирована, False если уже была разблокирована
+        """
+        if achievement_id not in self.ACHIEVEMENTS:
+            return False
+
+        cursor = self.storage.execute(
+            "INSERT OR IGNORE INTO achievements (chat_id, user_id, achievement_id, unlocked_at) VALUES (?, ?, ?, ?)",
+            (chat_id, user_id, achievement_id, datetime.now().isoformat())
+        )
+        return cursor.rowcount > 0
+
+    def get_user_achievements(self, chat_id: int, user_id: int) -> List[Dict]:
+        """Получить все ачивки пользователя"""
+        rows = self.storage.execute(
+            "SELECT achievement_id, unlocked_at FROM achievements WHERE chat_id = ? AND user_id = ? ORDER BY rowid",
+            (chat_id, user_id)
+        ).fetchall()
+
+        achievements_list = []
+        for row in rows:
+            if row["achievement_id"] in self.ACHIEVEMENTS:
+                ach_data = self.ACHIEVEMENTS[row["achievement_id"]].copy()
+                ach_data['id'] = row["achievement_id"]
+                ach_data['unlocked_at'] = row["unlocked_at"] or ''
+                achievements_list.append(ach_data)
+
+        return achievements_list
+
+    def has_achievement(self, chat_id: int, user_id: int, achievement_id: str) -> bool:
+        """Проверить, есть ли у пользователя ачивка"""
+        row = self.storage.execute(
+            "SELECT 1 FROM achievements WHERE chat_id = ? AND user_id = ? AND achievement_id = ?",
+            (chat_id, user_id, achievement_id)
+        ).fetchone()
+        return row is not None
+
+
+class SQLiteDailyStatsManager(DailyStatsManager):
+    """DailyStatsManager поверх SQLite"""
+
+    def __init__(self, storage: SQLiteStorage):
+        self.storage = storage
+
+    def save_stats(self):
+        """Каждое изменение уже записано в базу"""
+
+    def _increment(self, chat_id: int, column: str, amount: int):
+        self.storage.execute(
+            f"INSERT INTO daily_stats (chat_id, date, {column}) VALUES (?, ?, ?) "
+            f"ON CONFLICT (chat_id, date) DO UPDATE SET {column} = {column} + excluded.{column}",
+            (chat_id, self.get_today_key(), amount)
+        )
+
+    def _today_row(self, chat_id: int) -> Optional[sqlite3.Row]:
+        return self.storage.execute(
+            "SELECT messages, rating_points, manual_grant_points, date FROM daily_stats WHERE chat_id = ? AND date = ?",
+            (chat_id, self.get_today_key())
+        ).fetchone()
+
+    def add_message(self, chat_id: int):
+        """Добавить сообщение в статистику дня"""
+        self._increment(chat_id, "messages", 1)
+
+    def add_rating_points(self, chat_id: int, points: int):
+        """Добавить очки рейтинга в статистику дня"""
+        self._increment(chat_id, "rating_points", points)
+
+    def add_manual_grant_points(self, chat_id: int, points: int):
+        """Добавить ручно начисленные очки в статистику дня"""
+        self._increment(chat_id, "manual_grant_points", points)
+
+    def get_today_stats(self, chat_id: int) -> Dict:
+        """Получить статистику за сегодня"""
+        row = self._today_row(chat_id)
+        if row is None:
+            return {"messages": 0, "rating_points": 0}
+        return dict(row)
+
+    def get_today_manual_grants(self, chat_id: int) -> int:
+        """Получить количество ручно начисленных очков за сегодня"""
+        row = self._today_row(chat_id)
+        return row["manual_grant_points"] if row else 0
+
+    def reset_today_stats(self, chat_id: int):
+        """Сбросить статистику за сегодня (после отправки)"""
+        self.storage.execute(
+            "UPDATE daily_stats SET messages = 0, rating_points = 0, manual_grant_points = 0 WHERE chat_id = ? AND date = ?",
+            (chat_id, self.get_today_key())
+        )
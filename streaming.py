@@ -0,0 +1,122 @@
+"""
+Потоковая доставка ответа в Telegram: первое сообщение сразу после
+первого предложения, дальше - редактирование по мере генерации
+"""
+import asyncio
+import logging
+import re
+import time
+from typing import AsyncIterator, Optional
+
+from telegram.error import RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Конец предложения: знак препинания с пробелом/концом строки или перенос строки
+SENTENCE_END_RE = re.compile(r'[.!?…]+(?:\s|$)|\n')
+
+# Лимит Telegram - 4096 символов, оставляем запас
+MAX_MESSAGE_LENGTH = 4000
+
+
+def _retry_after_seconds(error: RetryAfter) -> float:
+    retry_after = error.retry_after
+    return retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+
+
+async def stream_to_message(
+    message,
+    deltas: AsyncIterator[str],
+    edit_interval: float = 1.5,
+    max_length: int = MAX_MESSAGE_LENGTH
+) -> str:
+    """
+    Показать потоковый ответ в чате
+
+    Первое сообщение уходит ответом на message, как только готово первое
+    предложение. Затем оно редактируется не чаще раза в edit_interval
+    секунд (Telegram ограничивает частоту правок). Если текст не влезает
+    в одно сообщение, начинается следующее.
+
+    Args:
+        message: Сообщение пользователя, на которое отвечаем
+        deltas: Куски текста (например, GLMClient.stream_chat_completion)
+        edit_interval: Минимальная пауза между правками, сек
+        max_length: Максимальная длина одного сообщения
+
+    Returns:
+        Полный текст ответа (пустая строка, если ничего не пришло)
+    """
+    started = time.monotonic()
+    text = ""
+    sent = None  # Текущее (последнее) отправленное сообщение
+    sent_from = 0  # С какого символа text начинается текущее сообщение
+    shown = ""  # Что сейчас видно в текущем сообщении
+    next_edit = 0.0
+    first_shown_at: Optional[float] = None
+
+    async def show(part: str, final: bool):
+        nonlocal sent, shown, next_edit, first_shown_at
+        part = part.rstrip()
+        if not part or part == shown:
+            return
+
+        for attempt in range(2):
+            try:
+                if sent is None:
+                    sent = await message.reply_text(part)
+                    if first_shown_at is None:
+                        first_shown_at = time.monotonic() - started
+                else:
+                    await sent.edit_text(part)
+                shown = part
+                break
+            except RetryAfter as e:
+                delay = _retry_after_seconds(e)
+                next_edit = time.monotonic() + delay
+                # Промежуточную правку можно пропустить, финальную - нет
+                if not final or attempt:
+                    logger.warning(f"Стриминг: Telegram просит подождать {delay} с")
+                    return
+                await asyncio.sleep(delay)
+            except Exception as e:
+                logger.warning(f"Стриминг: не удалось обновить сообщение: {e}")
+                return
+
+    async def sync(final: bool = False):
+        nonlocal sent, shown, sent_from
+        pending = text[sent_from:]
+
+        # Переполнение: дописываем текущее сообщение до лимита и начинаем новое
+        while len(pending) > max_length:
+            cut = pending.rfind(' ', 0, max_length)
+            if cut <= 0:
+                cut = max_length
+            await show(pending[:cut], final=True)
+            sent, shown = None, ""
+            sent_from += cut
+            while sent_from < len(text) and text[sent_from].isspace():
+                sent_from += 1
+            pending = text[sent_from:]
+
+        await show(pending, final)
+
+    async for delta in deltas:
+        text += delta
+
+        now = time.monotonic()
+        if first_shown_at is None:
+            # Ждем конца первого предложения, чтобы не показывать обрывок слова
+            if SENTENCE_END_RE.search(text) or len(text) > max_length:
+                await sync()
+                next_edit = max(next_edit, now + edit_interval)
+        elif now >= next_edit:
+            await sync()
+            next_edit = max(next_edit, now + edit_interval)
+
+    await sync(final=True)
+
+    if first_shown_at is not None:
+        logger.info(f"Стриминг: первое сообщение через {first_shown_at:.2f} с, "
+                    f"полный ответ через {time.monotonic() - started:.2f} с")
+    return text.strip()
@@ -0,0 +1,47 @@
+"""
+Проверка ChatDispatcher: чаты обрабатываются параллельно, а внутри чата - по порядку
+
+Три чата по пять сообщений, каждое "обрабатывается" 0.1 с. При
+последовательной обработке это заняло бы 1.5 с, с диспетчером - около 0.5 с.
+"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+from chat_dispatcher import ChatDispatcher
+
+CHATS = 3
+MESSAGES = 5
+DELAY = 0.1
+
+
+async def main():
+    dispatcher = ChatDispatcher(max_backlog=MESSAGES)
+    processed = {chat_id: [] for chat_id in range(CHATS)}
+
+    async def handler(update, context):
+        await asyncio.sleep(DELAY)  # Пауза "печатает"
+        processed[update.effective_chat.id].append(update.message_id)
+
+    wrapped = dispatcher.wrap(handler)
+    start = time.perf_counter()
+    for message_id in range(MESSAGES):
+        for chat_id in range(CHATS):
+            update = SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id), message_id=message_id)
+            await wrapped(update, None)
+
+    # Переполненная очередь отбрасывает апдейт
+    dropped = not dispatcher.submit(0, lambda: asyncio.sleep(0))
+
+    await asyncio.gather(*dispatcher.workers.values())
+    elapsed = time.perf_counter() - start
+
+    in_order = all(ids == list(range(MESSAGES)) for ids in processed.values())
+    print(f"Обработано за {elapsed:.2f} с (последовательно было бы {CHATS * MESSAGES * DELAY:.1f} с)")
+    print(f"Порядок внутри чатов сохранен: {'✅' if in_order else '❌'}")
+    print(f"Переполнение очереди отбрасывает апдейт: {'✅' if dropped else '❌'}")
+    print(f"Воркеры и очереди убраны: {'✅' if not dispatcher.workers and not dispatcher.chat_queues else '❌'}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
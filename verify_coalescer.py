@@ -0,0 +1,80 @@
+"""
+Проверка MessageCoalescer: серия сообщений - одна пачка, пачки чата по очереди,
+а через ChatDispatcher - в общем порядке с апдейтами чата
+
+Ответ GLM имитируется задержкой.
+"""
+import asyncio
+import time
+
+from chat_dispatcher import ChatDispatcher
+from coalescer import MessageCoalescer
+
+
+async def check_dispatch_order():
+    """Апдейт, пришедший во время ответа на пачку, обрабатывается после него"""
+    dispatcher = ChatDispatcher()
+    log = []
+
+    async def process(chat_id, items):
+        log.append(f"batch {items} start")
+        await asyncio.sleep(0.2)  # "Запрос к GLM"
+        log.append(f"batch {items} end")
+
+    coalescer = MessageCoalescer(
+        lambda chat_id, batch: dispatcher.run(chat_id, lambda: process(chat_id, batch)), debounce=0.05)
+
+    async def handle(text):
+        log.append(f"update {text}")  # Рейтинг, история и т.п.
+        coalescer.submit(1, text)
+
+    dispatcher.submit(1, lambda: handle("a"))
+    await asyncio.sleep(0.1)  # Пачка ['a'] уже у "GLM"
+    dispatcher.submit(1, lambda: handle("b"))
+    await asyncio.sleep(0.05)
+    await asyncio.gather(*coalescer.tasks.values())
+
+    expected = ["update a", "batch ['a'] start", "batch ['a'] end", "update b", "batch ['b'] start", "batch ['b'] end"]
+    print(f"Апдейт во время ответа ждет пачку: {log} {'✅' if log == expected else '❌'}")
+
+
+async def main():
+    batches = []
+    start = time.perf_counter()
+
+    async def handler(chat_id, items):
+        batches.append((chat_id, list(items), round(time.perf_counter() - start, 2)))
+        await asyncio.sleep(0.3)  # "Запрос к GLM"
+
+    coalescer = MessageCoalescer(handler, debounce=0.1, max_wait=0.5, max_batch=4)
+
+    # Серия из трех строк подряд
+    for text in ["эй бот", "глянь", "что думаешь про кино?"]:
+        coalescer.submit(1, text)
+        await asyncio.sleep(0.03)
+    await asyncio.sleep(0.2)  # Первая пачка уже у "GLM"
+    coalescer.submit(1, "и еще вопрос")  # Пришло во время ответа
+    coalescer.submit(1, "ау")
+    coalescer.submit(2, "другой чат")
+    await asyncio.gather(*coalescer.tasks.values())
+
+    chat1 = [items for chat_id, items, _ in batches if chat_id == 1]
+    print(f"Пачки чата 1: {chat1} {'✅' if chat1 == [['эй бот', 'глянь', 'что думаешь про кино?'], ['и еще вопрос', 'ау']] else '❌'}")
+    first, second = [t for chat_id, _, t in batches if chat_id == 1]
+    print(f"Вторая пачка ушла после ответа на первую: {'✅' if second - first >= 0.3 else '❌'}")
+    print(f"Чат 2 не ждал чат 1: {'✅' if next(t for chat_id, _, t in batches if chat_id == 2) < second else '❌'}")
+
+    # Непрерывный поток не копится дольше max_wait
+    for i in range(10):
+        coalescer.submit(3, f"m{i}")
+        await asyncio.sleep(0.06)
+    await asyncio.gather(*coalescer.tasks.values())
+    sizes = [len(items) for chat_id, items, _ in batches if chat_id == 3]
+    print(f"Поток из 10 сообщений: пачки {sizes} (max_batch=4)")
+    print(f"Метрики: {coalescer.stats()}")
+
+    await check_dispatch_order()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
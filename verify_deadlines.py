@@ -0,0 +1,43 @@
+"""
+Проверка дедлайнов ответа GLM: быстрый запрос отдает результат, медленный -
+нет, но продолжает работать и досылает результат через on_late
+"""
+import asyncio
+import time
+
+from deadlines import run_with_deadline, cancel_late_requests, _late_tasks
+
+
+async def fake_glm(delay: float, answer: str) -> str:
+    await asyncio.sleep(delay)
+    return answer
+
+
+async def main():
+    finished, result = await run_with_deadline(fake_glm(0.01, "быстро"), 0.2)
+    print(f"Успел к дедлайну: {'✅' if finished and result == 'быстро' else '❌'}")
+
+    late = []
+
+    async def on_late(response):
+        late.append((time.monotonic(), response))
+
+    start = time.monotonic()
+    finished, result = await run_with_deadline(fake_glm(0.3, "поздно"), 0.1, on_late=on_late)
+    waited = time.monotonic() - start
+    print(f"Не успел, ждали {waited * 1000:.0f} мс вместо 300: "
+          f"{'✅' if not finished and result is None and waited < 0.2 else '❌'}")
+
+    await asyncio.sleep(0.3)
+    print(f"Поздний ответ досылается: {'✅' if late and late[0][1] == 'поздно' else '❌'}")
+
+    finished, _ = await run_with_deadline(fake_glm(10, "никогда"), 0.05, on_late=on_late)
+    await cancel_late_requests()
+    print(f"Остановка отменяет опоздавшие запросы: {'✅' if not finished and not _late_tasks and len(late) == 1 else '❌'}")
+
+    finished, result = await run_with_deadline(fake_glm(0.05, "без дедлайна"), 0)
+    print(f"Дедлайн 0 - ждем сколько угодно: {'✅' if finished and result == 'без дедлайна' else '❌'}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,78 @@
+"""
+Проверка DeliveryScheduler: отправка ответа не держит обработчик, планы сливаются
+
+Паузы "печатает" укорочены, чтобы проверка шла быстро.
+"""
+import asyncio
+import time
+
+from delivery import DeliveryScheduler
+from human_behavior import HumanBehavior
+
+
+class FakeMessage:
+    def __init__(self, log, text):
+        self.log, self.text = log, text
+
+    async def edit_text(self, text):
+        self.log.append(("edit", text))
+
+
+async def main():
+    scheduler = DeliveryScheduler()
+    log = []
+    start = time.perf_counter()
+
+    async def send(text):
+        log.append((round(time.perf_counter() - start, 2), text))
+        return FakeMessage(log, text)
+
+    async def send_typing():
+        pass
+
+    def plan(texts):
+        return [{'text': t, 'typing': 0.2, 'pause': 0.1, 'fix': None, 'fix_delay': 0} for t in texts]
+
+    scheduler.schedule(1, plan(["a1", "a2", "a3"]), send, send_typing)
+    returned_after = time.perf_counter() - start
+    await asyncio.sleep(0.25)  # a1 уже ушло
+    scheduler.schedule(1, plan(["b1"]), send, send_typing)  # Новый ответ: a2, a3 уходят сразу
+    await asyncio.gather(*scheduler.tasks.values())
+
+    texts = [text for _, text in log]
+    times = dict((text, t) for t, text in log)
+    print(f"schedule() вернул управление через {returned_after * 1000:.1f} мс")
+    print(f"Порядок отправки: {texts} {'✅' if texts == ['a1', 'a2', 'a3', 'b1'] else '❌'}")
+    print(f"Хвост старого ответа ушел без пауз: {'✅' if times['a3'] - times['a2'] < 0.05 else '❌'}")
+    print(f"Новый ответ 'печатался': {'✅' if times['b1'] - times['a3'] >= 0.2 else '❌'}")
+
+    scheduler.schedule(2, plan(["c1", "c2"]), send, send_typing)
+    dropped = scheduler.cancel(2)
+    await asyncio.sleep(0.5)
+    print(f"cancel() отменил {dropped} части, отправлено: {[t for _, t in log if t.startswith('c')]}")
+
+    # Новый ответ сразу после cancel() - отдельный план, а не слияние с отмененным
+    scheduler.schedule(3, plan(["d1", "d2"]), send, send_typing)
+    scheduler.cancel(3)
+    scheduler.schedule(3, plan(["e1"]), send, send_typing)
+    await asyncio.gather(*scheduler.tasks.values())
+    sent = [t for _, t in log if t[0] in "de"]
+    print(f"После cancel() новый план отправлен целиком: {sent} {'✅' if sent == ['e1'] and not scheduler.plans else '❌'}")
+
+    # Ошибка отправки одной части не теряет остальные
+    async def flaky_send(text):
+        if text == "f1":
+            raise RuntimeError("Bad Request")
+        return await send(text)
+
+    scheduler.schedule(4, plan(["f1", "f2"]), flaky_send, send_typing)
+    await asyncio.gather(*scheduler.tasks.values())
+    sent = [t for _, t in log if t.startswith('f')]
+    print(f"После ошибки части отправлены остальные: {sent} {'✅' if sent == ['f2'] else '❌'}")
+
+    real_plan = HumanBehavior.plan_reply("Первое предложение. " * 20, max_length=200)
+    print(f"plan_reply: {len(real_plan)} частей, паузы печати {[round(p['typing'], 1) for p in real_plan]}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,96 @@
+"""
+Проверка справедливой очереди GLMScheduler: шумный чат не отнимает GLM у тихих
+
+Шумный чат держит в очереди десятки запросов, тихие чаты пишут изредка.
+Сравнивается ожидание тихих чатов в очереди по порядку прихода (все веса
+равны, но без разделения по чатам) и в справедливой очереди.
+"""
+import asyncio
+import statistics
+import time
+
+from glm_scheduler import GLMScheduler
+
+SERVICE_TIME = 0.02  # "Ответ GLM"
+LIMIT = 2
+
+
+async def request(scheduler: GLMScheduler, chat_id, waits: dict):
+    queued = time.monotonic()
+    started = await scheduler.acquire("process_message", chat_id if scheduler.weight_for else None)
+    waits.setdefault(chat_id, []).append(time.monotonic() - queued)
+    await asyncio.sleep(SERVICE_TIME)
+    scheduler.release(started, True, chat_id if scheduler.weight_for else None)
+
+
+async def scenario(scheduler: GLMScheduler) -> dict:
+    waits = {}
+    tasks = [asyncio.create_task(request(scheduler, "noisy", waits)) for _ in range(60)]
+    for i in range(10):
+        await asyncio.sleep(0.05)
+        for quiet in ("quiet1", "quiet2"):
+            tasks.append(asyncio.create_task(request(scheduler, quiet, waits)))
+    await asyncio.gather(*tasks)
+    return waits
+
+
+def make_scheduler(fair: bool, weights: dict = None) -> GLMScheduler:
+    weights = weights or {}
+    return GLMScheduler(
+        {"process_message": (0, None)}, initial_limit=LIMIT, min_limit=LIMIT, max_limit=LIMIT,
+        latency_target=60, weight_for=(lambda chat_id: weights.get(chat_id, 1.0)) if fair else None
+    )
+
+
+async def main():
+    fifo = await scenario(make_scheduler(fair=False))
+    fair = await scenario(make_scheduler(fair=True))
+
+    for title, waits in (("По порядку прихода", fifo), ("Справедливая очередь", fair)):
+        quiet = [w * 1000 for chat in ("quiet1", "quiet2") for w in waits[chat]]
+        noisy = [w * 1000 for w in waits["noisy"]]
+        print(f"{title}: тихие чаты ждут в среднем {statistics.mean(quiet):.0f} мс "
+              f"(макс {max(quiet):.0f} мс), шумный - {statistics.mean(noisy):.0f} мс")
+
+    quiet_fair = max(w for chat in ("quiet1", "quiet2") for w in fair[chat])
+    print(f"Тихие чаты ждут не дольше пары ответов: {'✅' if quiet_fair <= 3 * SERVICE_TIME else '❌'}")
+
+    # Вес 2 - вдвое большая доля при равной нагрузке
+    scheduler = make_scheduler(fair=True, weights={"vip": 2.0})
+    order = []
+
+    async def tracked(chat_id):
+        started = await scheduler.acquire("process_message", chat_id)
+        order.append(chat_id)
+        await asyncio.sleep(SERVICE_TIME)
+        scheduler.release(started, True, chat_id)
+
+    await asyncio.gather(*(tracked(chat) for _ in range(20) for chat in ("vip", "regular")))
+    first = order[:18]
+    print(f"Первые 18 слотов: vip {first.count('vip')}, regular {first.count('regular')} (веса 2:1)")
+    print(f"Счетчики по чатам в конце: {scheduler.stats()['chats']}")
+
+    # Запросы, отброшенные по сроку ожидания, не отодвигают следующие запросы чата
+    scheduler = GLMScheduler({"process_message": (0, None), "random_reaction": (0, 0.05)},
+                             initial_limit=1, min_limit=1, max_limit=1, latency_target=60,
+                             weight_for=lambda chat_id: 1.0)
+    started = await scheduler.acquire("process_message", "busy")
+    stale = [scheduler.acquire("random_reaction", "a") for _ in range(5)]
+    dropped = await asyncio.gather(*stale)
+    order = []
+
+    async def queued(chat_id):
+        slot = await scheduler.acquire("process_message", chat_id)
+        order.append(chat_id)
+        scheduler.release(slot, True, chat_id)
+
+    tasks = [asyncio.create_task(queued("a")), asyncio.create_task(queued("b"))]
+    await asyncio.sleep(0)
+    scheduler.release(started, True, "busy")
+    await asyncio.gather(*tasks)
+    print(f"После {dropped.count(None)} отброшенных запросов чат не штрафуется: {order} "
+          f"{'✅' if order == ['a', 'b'] else '❌'}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
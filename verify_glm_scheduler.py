@@ -0,0 +1,127 @@
+"""
+Проверка GLMScheduler: лимит подстраивается под провайдера, приоритеты, сброс устаревших запросов
+
+Провайдер имитируется задержкой, которая растет с числом одновременных
+запросов сверх его "емкости". Секунды сжаты в 100 раз.
+"""
+import asyncio
+import time
+
+import httpx
+
+from glm_resilience import is_overload
+from glm_scheduler import GLMScheduler
+
+POLICY = {
+    "process_message": (0, None),
+    "reminder": (1, 1.2),
+    "roast": (2, 0.3),
+    "random_reaction": (3, 0.15),
+    "silence_hook": (4, 0.6),
+}
+
+
+class FakeProvider:
+    """Отвечает за 0.05 с, пока запросов не больше capacity, дальше - медленнее"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.active = 0
+        self.peak = 0
+
+    async def call(self) -> bool:
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        overload = max(0, self.active - self.capacity)
+        await asyncio.sleep(0.05 * (1 + overload))
+        self.active -= 1
+        return True
+
+
+async def request(scheduler: GLMScheduler, provider: FakeProvider, call_site: str, log: list):
+    started = await scheduler.acquire(call_site)
+    if started is None:
+        log.append((call_site, "dropped"))
+        return
+    ok = False
+    try:
+        ok = await provider.call()
+    finally:
+        scheduler.release(started, ok)
+    log.append((call_site, round(time.monotonic() - started, 3)))
+
+
+async def main():
+    provider = FakeProvider(capacity=6)
+    scheduler = GLMScheduler(POLICY, initial_limit=2, max_limit=20, latency_target=0.08)
+
+    # Поток ответов: лимит должен вырасти примерно до емкости провайдера и не уйти сильно выше
+    log = []
+    for _ in range(30):
+        await asyncio.gather(*(request(scheduler, provider, "process_message", log) for _ in range(10)))
+    print(f"Лимит после нагрузки: {scheduler.limit:.1f} (емкость провайдера 6), пик одновременных: {provider.peak}")
+
+    # Провайдер "прилег": емкость 1 - лимит должен упасть
+    provider.capacity = 1
+    for _ in range(5):
+        await asyncio.gather(*(request(scheduler, provider, "process_message", log) for _ in range(10)))
+    print(f"Лимит после замедления провайдера: {scheduler.limit:.1f}")
+
+    # Очередь с приоритетами: ответы уходят первыми, устаревшие реакции отбрасываются
+    provider.capacity = 2
+    scheduler.limit = 2
+    log = []
+    sites = ["silence_hook", "random_reaction", "roast", "reminder", "process_message"] * 4
+    await asyncio.gather(*(request(scheduler, provider, site, log) for site in sites))
+    served = [site for site, result in log if result != "dropped"]
+    dropped = sorted({site for site, result in log if result == "dropped"})
+    first_replies = served[:6].count("process_message")
+    print(f"Порядок обслуживания: {served}")
+    print(f"Ответы пользователям в начале очереди: {'✅' if first_replies >= 4 else '❌'}")
+    print(f"Отброшены по сроку ожидания: {dropped} {'✅' if 'process_message' not in dropped and dropped else '❌'}")
+    print(f"Метрики: {scheduler.stats()}")
+
+    # Ошибки самого запроса (400, 401) лимит не трогают, перегрузка (таймаут, 429, 5xx) - уменьшает
+    def http_error(status):
+        request = httpx.Request("POST", "https://glm.test")
+        return httpx.HTTPStatusError("error", request=request, response=httpx.Response(status, request=request))
+
+    errors = {
+        "400": http_error(400), "401": http_error(401), "429": http_error(429),
+        "503": http_error(503), "timeout": httpx.ReadTimeout("timeout"),
+    }
+    overloads = {name: is_overload(error) for name, error in errors.items()}
+    print(f"Признаки перегрузки: {overloads} "
+          f"{'✅' if overloads == {'400': False, '401': False, '429': True, '503': True, 'timeout': True} else '❌'}")
+
+    scheduler = GLMScheduler(POLICY, initial_limit=8)
+    for name in ("400", "401"):
+        started = await scheduler.acquire("process_message")
+        scheduler.release(started, False, overload=is_overload(errors[name]))
+    print(f"Лимит после 400 и 401: {scheduler.limit:.1f} {'✅' if scheduler.limit == 8 else '❌'}")
+    started = await scheduler.acquire("process_message")
+    scheduler.release(started, False, overload=is_overload(errors["429"]))
+    print(f"Лимит после 429: {scheduler.limit:.1f} {'✅' if scheduler.limit == 4 else '❌'}")
+
+    # Отмена запроса в тот же ход цикла, в котором release выдал ему слот: слот возвращается
+    scheduler = GLMScheduler(POLICY, initial_limit=1, min_limit=1, max_limit=1)
+    holder = await scheduler.acquire("process_message", "a")
+    waiter = asyncio.create_task(scheduler.acquire("process_message", "b"))
+    await asyncio.sleep(0)  # waiter в очереди
+    scheduler.release(holder, True, "a")  # Слот выдан waiter...
+    waiter.cancel()  # ...но его отменили раньше, чем он проснулся
+    try:
+        await waiter
+    except asyncio.CancelledError:
+        pass
+    try:
+        started = await asyncio.wait_for(scheduler.acquire("process_message", "c"), timeout=1)
+        scheduler.release(started, True, "c")
+        freed = scheduler.in_flight == 0 and not scheduler.chat_in_flight
+    except asyncio.TimeoutError:
+        freed = False
+    print(f"Слот отмененного запроса возвращен: {'✅' if freed else '❌'}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,66 @@
+"""
+Проверка выбора модели GLM: короткие реплики - быстрой модели, сложные задачи
+и длинные промпты - большой, деградировавшая модель обходится
+"""
+from model_router import ModelRouter
+
+TIERS = {"fast": "glm-4-flash", "large": "glm-4.6"}
+ROUTES = {
+    "random_reaction": ("fast", "large"),
+    "simple_reply": ("fast", "large"),
+    "complex_task": ("large", "fast"),
+}
+
+
+def make_router() -> ModelRouter:
+    return ModelRouter(
+        TIERS, ROUTES,
+        latency_budgets={"random_reaction": 3, "simple_reply": 5},
+        max_prompt_chars={"fast": 1000},
+        max_error_rate=0.3, window=20, probe_interval=3600
+    )
+
+
+def check(title: str, ok: bool):
+    print(f"{title}: {'✅' if ok else '❌'}")
+
+
+def main():
+    router = make_router()
+    check("Случайная реакция -> быстрая модель", router.choose("random_reaction", 200) == "glm-4-flash")
+    check("Сложная задача -> большая модель", router.choose("complex_task", 200) == "glm-4.6")
+    check("Погода (нет маршрута) -> большая модель", router.choose("weather", 200) == "glm-4.6")
+    check("Длинный промпт -> большая модель", router.choose("simple_reply", 5000) == "glm-4.6")
+
+    # Быстрая модель начала тормозить: медиана 8 сек при бюджете 5
+    for _ in range(20):
+        router.record("glm-4-flash", 8.0, True)
+    check("Медленная быстрая модель обходится", router.choose("simple_reply", 200) == "glm-4.6")
+    check("Реакции тоже уходят на большую", router.choose("random_reaction", 200) == "glm-4.6")
+
+    # Быстрая модель снова в норме
+    for _ in range(20):
+        router.record("glm-4-flash", 0.8, True)
+    check("Восстановилась - снова быстрая", router.choose("simple_reply", 200) == "glm-4-flash")
+
+    # Большая модель падает: сложные задачи уходят на быструю
+    for _ in range(10):
+        router.record("glm-4.6", 2.0, False)
+    check("Большая модель с ошибками - сложная задача на быструю", router.choose("complex_task", 200) == "glm-4-flash")
+
+    # Обе нездоровы - та, у которой меньше ошибок
+    for _ in range(10):
+        router.record("glm-4-flash", 1.0, False)
+    check("Обе нездоровы - меньше ошибок у быстрой", router.choose("complex_task", 200) == "glm-4-flash")
+
+    # Нездоровая модель периодически получает пробный запрос
+    router.probe_interval = 0
+    check("Пробный запрос нездоровой модели", router.choose("complex_task", 200) == "glm-4.6")
+
+    stats = router.stats()
+    print(f"Гистограмма быстрой модели: {stats['models']['glm-4-flash']['histogram']}")
+    print(f"Выбор по классам: {stats['routed']}")
+
+
+if __name__ == "__main__":
+    main()
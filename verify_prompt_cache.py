@@ -0,0 +1,62 @@
+"""
+Проверка кэша кусков промпта: куски переиспользуются, пока не изменятся
+настройки, правила или профиль, а начало промпта совпадает байт в байт
+"""
+import os
+import tempfile
+
+from knowledge_manager import KnowledgeManager
+from prompt_cache import PromptSegmentCache
+from settings_manager import SettingsManager
+
+CHAT_ID = -100
+USER_ID = 42
+
+
+def check(title: str, ok: bool):
+    print(f"{title}: {'✅' if ok else '❌'}")
+
+
+def main():
+    folder = tempfile.mkdtemp()
+    settings = SettingsManager(os.path.join(folder, "settings.json"))
+    knowledge = KnowledgeManager(os.path.join(folder, "knowledge.json"))
+    cache = PromptSegmentCache()
+    settings.add_change_listener(cache.invalidate_chat)
+    knowledge.add_change_listener(cache.on_knowledge_change)
+
+    builds = []
+
+    def persona():
+        builds.append("persona")
+        style = settings.get_chat_settings(CHAT_ID).get("response_style")
+        return f"Ты - Чупапи. Стиль: {style}"
+
+    def prompt(mood: str) -> str:
+        return "\n".join([
+            cache.chat_segment(CHAT_ID, "persona", persona),
+            cache.chat_segment(CHAT_ID, "rules", lambda: knowledge.get_behavioral_context(CHAT_ID)),
+            cache.user_segment(USER_ID, lambda: knowledge.get_user_context(USER_ID)),
+            mood,
+        ])
+
+    first, second = prompt("Настроение: радостное"), prompt("Настроение: грустное")
+    prefix = first[:first.index("Настроение")]
+    check("Персона собрана один раз на два сообщения", builds == ["persona"])
+    check("Начало промпта совпадает байт в байт", second.startswith(prefix))
+
+    settings.update_setting(CHAT_ID, "response_style", "full")
+    check("Смена стиля сбрасывает кэш чата", "Стиль: full" in prompt("") and builds == ["persona", "persona"])
+
+    knowledge.add_behavioral_rule(CHAT_ID, "начинай ответ со слова Абудаби", USER_ID, "vasya")
+    check("Новое правило попадает в промпт", "Абудаби" in prompt(""))
+    knowledge.remove_behavioral_rule(CHAT_ID, 0)
+    check("Удаленное правило пропадает", "Абудаби" not in prompt(""))
+
+    knowledge.save_user_info(USER_ID, "city", "Казань", "vasya")
+    check("Новый факт о пользователе попадает в промпт", "Казань" in prompt(""))
+    print(f"Статистика кэша: {cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Проверка сборки промпта в бюджет токенов: оценка токенов кириллицы, бюджеты
+секций, отбор фактов и истории по релевантности и жесткий лимит
+"""
+import time
+
+from knowledge_manager import KnowledgeManager
+from persona import SYSTEM_PERSONA
+from prompt_packer import PromptPacker, estimate_tokens, message_tokens
+from relevance_index import tokenize
+
+BUDGETS = {"mood": 150, "time": 100, "rules": 500, "user": 200, "knowledge": 800, "history": 1200}
+
+
+def check(title: str, ok: bool):
+    print(f"{title}: {'✅' if ok else '❌'}")
+
+
+def make_facts(count: int) -> list:
+    facts = [{'key': 'пицца', 'relevance': 4, 'fact': {
+        'fact': 'Вася любит пиццу с ананасами и спорит об этом с каждым', 'username': 'vasya',
+        'timestamp': '2024-05-01T12:00:00'}}]
+    for i in range(count):
+        facts.append({'key': f'факт{i % 20}', 'fact': {
+            'fact': f'Какой-то давний факт номер {i} про жизнь чата, работу, котов и погоду за окном',
+            'username': 'user', 'timestamp': '2024-04-01T12:00:00'}})
+    return facts
+
+
+def make_history(count: int) -> list:
+    history = []
+    for i in range(count):
+        text = "кто заказывает пиццу на вечер?" if i == 3 else f"обычная болтовня номер {i} ни о чем конкретном"
+        history.append({"role": "user", "content": f"user{i % 3}: {text}"})
+    return history
+
+
+def pack(user_message: str, facts: list, history: list, max_tokens: int):
+    query = set(tokenize(user_message))
+    packer = PromptPacker(max_tokens, BUDGETS)
+    packer.add_text("persona", SYSTEM_PERSONA, priority=0, required=True)
+    packer.add_text("message", user_message, priority=0, required=True)
+    packer.add_text("mood", "\n📊 КОНТЕКСТ НАСТРОЕНИЯ:\nТекущее настроение: радостное\n", priority=3)
+    packer.add_text("rules", "\n1. Не матерись\n2. Всегда хвали котов\n", priority=1)
+    packer.add_items(
+        "knowledge", facts, priority=4,
+        scores=[len(facts) - i for i in range(len(facts))],
+        render=KnowledgeManager.format_facts_context,
+        cost=lambda item: estimate_tokens(item['fact']['fact']) + 10
+    )
+    packer.add_items(
+        "history", history, priority=2,
+        scores=[len(query & set(tokenize(m['content']))) for m in history],
+        cost=message_tokens, keep_last=4
+    )
+    return packer.pack()
+
+
+def main():
+    text = "Привет! Как дела? Расскажи, что нового в чате за неделю."
+    print(f"Оценка: {len(text)} символов -> {estimate_tokens(text)} токенов")
+    check("Кириллица дороже латиницы того же объема",
+          estimate_tokens("привет как дела") > estimate_tokens("hello how areyou"))
+
+    facts, history = make_facts(100), make_history(20)
+    user_message = "vasya: а какую пиццу я люблю?"
+    unpacked = (estimate_tokens(SYSTEM_PERSONA) + estimate_tokens(KnowledgeManager.format_facts_context(facts))
+                + sum(message_tokens(m) for m in history))
+    print(f"Без упаковки: ~{unpacked} токенов")
+
+    packed = pack(user_message, facts, history, max_tokens=3500)
+    print(f"С упаковкой: {packed.describe()}")
+    check("Уложились в лимит", packed.total_tokens <= 3500)
+    check("Факт про пиццу остался", "ананасами" in packed.text("knowledge"))
+    kept = packed.items("history")
+    check("Последние 4 реплики остались", kept[-4:] == history[-4:])
+    check("Старая реплика про пиццу осталась", history[3] in kept)
+    check("История в хронологическом порядке", kept == [m for m in history if m in kept])
+
+    tight = pack(user_message, facts, history, max_tokens=1500)
+    print(f"Жесткий лимит 1500: {tight.describe()}")
+    check("Первыми урезаны факты, персона цела",
+          tight.usage["knowledge"]["kept"] < packed.usage["knowledge"]["kept"]
+          and tight.text("persona") == SYSTEM_PERSONA)
+
+    start = time.perf_counter()
+    for _ in range(100):
+        pack(user_message, facts, history, max_tokens=3500)
+    print(f"Сборка: {(time.perf_counter() - start) * 10:.2f} мс на промпт")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Проверка PriorityRateLimiter: приоритеты, лимит на чат, повтор после 429
+и передача приоритета через методы ExtBot
+
+Лимиты занижены, чтобы очередь было видно за секунду.
+"""
+import asyncio
+import inspect
+import json
+import time
+
+from telegram import Chat, Message
+from telegram.error import RetryAfter
+from telegram.ext import ExtBot
+from telegram.request import BaseRequest
+
+from rate_limiter import PriorityRateLimiter, priority, PRIORITY_ANNOUNCEMENT, PRIORITY_PROACTIVE
+
+
+class FakeRequest(BaseRequest):
+    """Запросы к Bot API без сети: sendMessage отвечает отправленным сообщением"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        params = request_data.parameters if request_data else {}
+        self.sent.append((url.rsplit("/", 1)[-1], params))
+        result = {
+            "message_id": len(self.sent), "date": int(time.time()),
+            "chat": {"id": params.get("chat_id", 0), "type": "group"}, "text": params.get("text", ""),
+        }
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+async def check_ext_bot():
+    """Приоритет доходит до ограничителя через настоящий ExtBot.send_message"""
+    limiter = PriorityRateLimiter()
+    request = FakeRequest()
+    bot = ExtBot("123:TEST", request=request, get_updates_request=FakeRequest(), rate_limiter=limiter)
+
+    # Так бот шлет объявление об очках и случайную реакцию (с ответом на сообщение)
+    await bot.send_message(chat_id=-1, text="<b>+10</b>", parse_mode="HTML",
+                           rate_limit_args=priority(PRIORITY_ANNOUNCEMENT))
+    await bot.send_message(chat_id=-1, text="реакция", reply_to_message_id=1,
+                           rate_limit_args=priority(PRIORITY_PROACTIVE))
+    await bot.send_message(chat_id=-1, text="ответ")
+    by_priority = limiter.stats()["by_priority"]
+    sent = {name: stats["sent"] for name, stats in by_priority.items()}
+    print(f"ExtBot.send_message передал приоритеты: {sent} "
+          f"{'✅' if sent == {'announcement': 1, 'proactive': 1, 'reply': 1} and len(request.sent) == 3 else '❌'}")
+
+    # Сокращения Chat/Message не принимают rate_limit_args - приоритет только через методы бота
+    shortcuts = [Chat.send_message, Message.reply_text]
+    print(f"Chat.send_message и Message.reply_text без rate_limit_args: "
+          f"{'✅' if all('rate_limit_args' not in inspect.signature(m).parameters for m in shortcuts) else '❌'}")
+    await limiter.shutdown()
+
+
+async def main():
+    limiter = PriorityRateLimiter(overall_rate=10, private_chat_rate=5, chat_burst=1)
+    await limiter.initialize()
+    log = []
+    start = time.monotonic()
+
+    async def send(tag):
+        log.append((round(time.monotonic() - start, 2), tag))
+        return True
+
+    def request(tag, chat_id, rate_limit_args=None):
+        return limiter.process_request(send, (tag,), {}, "sendMessage", {"chat_id": chat_id}, rate_limit_args)
+
+    # Проактивные реплики встали в очередь первыми, но ответы их обгоняют
+    await asyncio.gather(
+        *(request(f"hook{i}", 1, priority(PRIORITY_PROACTIVE)) for i in range(2)),
+        *(request(f"reply{i}", 1) for i in range(3)),
+        *(request(f"other{i}", 2) for i in range(3)),
+    )
+    order = [tag for _, tag in log if not tag.startswith("other")]
+    print(f"Порядок в чате 1: {order} {'✅' if order == ['reply0', 'reply1', 'reply2', 'hook0', 'hook1'] else '❌'}")
+    replies = [t for t, tag in log if tag.startswith("reply")]
+    gaps = [round(b - a, 2) for a, b in zip(replies, replies[1:])]
+    print(f"Интервалы между ответами в чат 1 (лимит 5/с): {gaps}")
+    print(f"Чат 2 не ждал хуки чата 1: {'✅' if log.index(next(e for e in log if e[1] == 'other2')) < log.index(next(e for e in log if e[1] == 'hook0')) else '❌'}")
+
+    attempts = {"count": 0}
+
+    async def flood_once():
+        attempts["count"] += 1
+        if attempts["count"] == 1:
+            raise RetryAfter(1)
+        return True
+
+    waited = time.monotonic()
+    result = await limiter.process_request(flood_once, (), {}, "sendMessage", {"chat_id": 3}, None)
+    print(f"После 429 запрос повторен через {time.monotonic() - waited:.1f} с: {'✅' if result else '❌'}")
+
+    print(f"Метрики: {limiter.stats()}")
+    await limiter.shutdown()
+
+    await check_ext_bot()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,125 @@
+"""
+Проверка потоковых ответов: GLMClient.stream_chat_completion + stream_to_message
+
+Поднимает локальный SSE-сервер, который отдает ответ кусками с задержкой,
+и сравнивает, когда пользователь видит первый текст в обычном и потоковом режиме.
+"""
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from glm_client import GLMClient
+from streaming import stream_to_message
+
+ANSWER = ("Йоу, отличный вопрос! Смотри, тут всё просто. "
+          "Сначала берешь пиццу, потом кофе, и день удался. "
+          "А если серьезно - главное не забывать отдыхать. Кихи!")
+CHUNK_DELAY = 0.05  # Пауза между кусками, как у настоящей генерации
+
+
+class SSEHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        words = [word + " " for word in ANSWER.split(" ")]
+
+        if not payload.get("stream"):
+            time.sleep(CHUNK_DELAY * len(words))
+            body = json.dumps({"choices": [{"message": {"content": ANSWER}}]}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for word in words:
+            time.sleep(CHUNK_DELAY)
+            event = {"choices": [{"delta": {"content": word}}]}
+            self.wfile.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeSentMessage:
+    def __init__(self, log, started):
+        self.log, self.started = log, started
+
+    async def edit_text(self, text):
+        self.log.append((time.monotonic() - self.started, "edit", text))
+
+
+class FakeMessage:
+    """Вместо telegram.Message: записывает отправки и правки"""
+
+    def __init__(self):
+        self.log = []
+        self.started = time.monotonic()
+
+    async def reply_text(self, text):
+        self.log.append((time.monotonic() - self.started, "send", text))
+        return FakeSentMessage(self.log, self.started)
+
+
+async def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SSEHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = GLMClient("key", f"http://127.0.0.1:{server.server_address[1]}/chat/completions")
+    messages = [{"role": "user", "content": "привет"}]
+
+    print("=== Обычный режим ===")
+    started = time.monotonic()
+    full = await client.chat_completion(messages)
+    print(f"Ответ виден через {time.monotonic() - started:.2f} с")
+    assert full == ANSWER
+
+    print("\n=== stream=True в chat_completion (собирает куски) ===")
+    collected = await client.chat_completion(messages, stream=True)
+    print("✅ Совпадает с обычным ответом" if collected == ANSWER else f"❌ {collected!r}")
+    assert collected == ANSWER
+
+    print("\n=== Потоковый режим ===")
+    message = FakeMessage()
+    streamed = await stream_to_message(message, client.stream_chat_completion(messages), edit_interval=0.3)
+    for at, action, text in message.log:
+        print(f"  {at:.2f} с  {action:4}  {text[:60]}{'...' if len(text) > 60 else ''}")
+    print(f"Первый текст виден через {message.log[0][0]:.2f} с")
+    assert streamed == ANSWER
+    assert message.log[-1][2] == ANSWER
+    assert message.log[0][2] == "Йоу, отличный вопрос!"
+
+    print("\n=== Длинный ответ разбивается на несколько сообщений ===")
+    async def long_deltas():
+        for i in range(300):
+            yield f"слово{i} "
+    message = FakeMessage()
+    streamed = await stream_to_message(message, long_deltas(), edit_interval=0, max_length=500)
+    sends = [text for _, action, text in message.log if action == "send"]
+    finals = {}
+    current = -1
+    for _, action, text in message.log:
+        if action == "send":
+            current += 1
+        finals[current] = text
+    print(f"Сообщений: {len(sends)}, все в лимите: {all(len(t) <= 500 for t in finals.values())}")
+    assert " ".join(finals[i] for i in sorted(finals)) == streamed
+
+    await client.aclose()
+    server.shutdown()
+    print("\n=== VERIFICATION COMPLETE ===")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -6,6 +6,8 @@ import asyncio
 from datetime import datetime, time
 from telegram.ext import Application
 
+from rate_limiter import priority, PRIORITY_ANNOUNCEMENT
+
 logger = logging.getLogger(__name__)
 
 
@@ -91,10 +93,13 @@ class WeatherScheduler:
         try:
             # Получаем сообщение от AI
             message = await glm_client.chat_completion(
-                weather_prompt,
-                system_prompt=system_persona,
+                [
+                    {"role": "system", "content": system_persona},
+                    {"role": "user", "content": weather_prompt}
+                ],
                 max_tokens=500,
-                temperature=0.8
+                temperature=0.8,
+                call_site="weather"
             )
 
             if not message:
@@ -107,7 +112,8 @@ class WeatherScheduler:
                 try:
                     await application.bot.send_message(
                         chat_id=chat_id,
-                        text=message
+                        text=message,
+                        rate_limit_args=priority(PRIORITY_ANNOUNCEMENT)
                     )
                     success_count += 1
                     logger.info(f"Погода отправлена в чат {chat_id}")